@@ -0,0 +1,370 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from stock_data import StockData
+from strategy_analyzer import get_performance_summary, get_signal_performance
+from strategy_generator import MAStrategy, KDJStrategy, MACDStrategy, ADXStrategy
+
+STRATEGIES = {
+    'ma': MAStrategy,
+    'kdj': KDJStrategy,
+    'macd': MACDStrategy,
+    'adx': ADXStrategy,
+}
+
+# 只影响买卖信号、不影响指标计算的参数，指标缓存的键中不包含这些参数
+SIGNAL_PARAMS = {
+    'ma': ('ratio1', 'ratio2'),
+    'adx': ('adx_threshold',),
+}
+
+
+def downsample_lttb(x, y, max_points):
+    """
+    用Largest-Triangle-Three-Buckets算法对折线降采样，保留形状特征
+    :param x: 横坐标数组
+    :param y: 纵坐标数组
+    :param max_points: 最多保留的点数
+    :return: 保留点的下标数组
+    """
+    length = len(x)
+    if max_points >= length or max_points < 3:
+        return np.arange(length)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    edges = np.linspace(1, length - 1, max_points - 1).astype(int)
+    selected = [0]
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else length
+        next_start = end
+        avg_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        a = selected[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        selected.append(start + int(np.argmax(area)))
+    selected.append(length - 1)
+    return np.asarray(selected)
+
+
+def _to_json_value(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return None if math.isnan(value) else float(value)
+    if isinstance(value, (np.bool_,)):
+        return bool(value)
+    return value
+
+
+def _to_records(df):
+    return [{key: _to_json_value(value) for key, value in row.items()} for row in df.to_dict('records')]
+
+
+class BacktestService:
+    def __init__(self, stock_codes: dict, data_dir: str = "resource/stock_price", cache_size: int = 256):
+        """
+        常驻内存的回测服务，启动时加载全部股票数据，相同的并发请求只计算一次
+        :param stock_codes: 股票代码字典，格式为 {code: name}
+        :param data_dir: 数据存储目录
+        :param cache_size: 内存中缓存的回测结果数量
+        """
+        self.stocks = {code: StockData(code, name, data_dir, compact=True, offline=True)
+                       for code, name in stock_codes.items()}
+        self.cache_size = cache_size
+        self._results = OrderedDict()
+        # 指标计算结果，只有买卖阈值不同的请求共用同一份指标
+        self._indicators = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counters = {'requests': 0, 'errors': 0, 'computed': 0, 'cache_hits': 0, 'coalesced': 0,
+                          'indicator_hits': 0}
+
+    @staticmethod
+    def _request_key(request: dict):
+        return json.dumps({
+            'stock_code': request.get('stock_code'),
+            'strategy': request.get('strategy', 'ma'),
+            'params': request.get('params', {}),
+            'start_date': request.get('start_date'),
+            'end_date': request.get('end_date'),
+        }, sort_keys=True, ensure_ascii=False)
+
+    def _has_bars(self, stock_code, start_date, end_date):
+        days = self.stocks[stock_code].to_columns()['日期'].astype('datetime64[D]')
+        mask = np.ones(len(days), dtype=bool)
+        if start_date:
+            mask &= days >= np.datetime64(pd.Timestamp(start_date).date(), 'D')
+        if end_date:
+            mask &= days <= np.datetime64(pd.Timestamp(end_date).date(), 'D')
+        return bool(mask.any())
+
+    def _process(self, stock_code, strategy_name, strategy, params, start_date, end_date):
+        """计算指标，参数只在买卖阈值上不同的请求复用同一份结果，返回的DataFrame不能修改"""
+        key = json.dumps({
+            'stock_code': stock_code,
+            'strategy': strategy_name,
+            'params': {k: v for k, v in params.items() if k not in SIGNAL_PARAMS.get(strategy_name, ())},
+            'start_date': start_date,
+            'end_date': end_date,
+        }, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if key in self._indicators:
+                self._indicators.move_to_end(key)
+                self._counters['indicator_hits'] += 1
+                return self._indicators[key]
+        base = self.stocks[stock_code]
+        # _process_data会修改传入的StockData，每次使用共享同一份紧凑数据的新对象
+        stock_data = StockData.from_columns(base.stock_code, base.name, base.to_columns())
+        processed_df = strategy._process_data(stock_data, start_date, end_date)
+        with self._lock:
+            self._indicators[key] = processed_df
+            while len(self._indicators) > self.cache_size:
+                self._indicators.popitem(last=False)
+        return processed_df
+
+    def _compute(self, request: dict):
+        stock_code = request.get('stock_code')
+        if stock_code not in self.stocks:
+            raise FileNotFoundError(f"服务中没有股票 {stock_code} 的数据")
+        strategy_name = request.get('strategy', 'ma')
+        if strategy_name not in STRATEGIES:
+            raise ValueError(f"不支持的策略：{strategy_name}")
+        params = request.get('params', {})
+        if not isinstance(params, dict):
+            raise ValueError("params必须是JSON对象")
+        strategy = STRATEGIES[strategy_name](**params)
+        start_date, end_date = request.get('start_date'), request.get('end_date')
+        if self._has_bars(stock_code, start_date, end_date):
+            processed_df = self._process(stock_code, strategy_name, strategy, params, start_date, end_date)
+            signals = strategy._generate_signals(processed_df)
+            trades = strategy._generate_trades(signals)
+        else:
+            # 日期范围内没有K线，返回空的交易记录，指标按空仓计算
+            columns = ['日期', '收盘'] + strategy.new_feature_columns + strategy.new_indicator_columns
+            processed_df = pd.DataFrame(columns=list(dict.fromkeys(columns)))
+            signals = processed_df.assign(SIGNAL=pd.Series(dtype=np.int64))
+            trades = pd.DataFrame()
+        return {
+            'strategy': strategy,
+            'processed_df': processed_df,
+            'signals': signals,
+            'trades': trades,
+            'summary': get_performance_summary(trades),
+            'metrics': get_signal_performance(signals, getattr(strategy, 'period', 'D'))[1],
+        }
+
+    def run(self, request: dict):
+        """
+        执行回测，结果已缓存时直接返回，相同请求正在计算时等待同一个结果
+        :param request: 请求字典，包含stock_code、strategy、params、start_date、end_date
+        :return: 结果字典
+        """
+        key = self._request_key(request)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self._counters['cache_hits'] += 1
+                return self._results[key]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._counters['coalesced'] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._compute(request)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._counters['computed'] += 1
+            self._results[key] = result
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def backtest(self, request: dict) -> dict:
+        result = self.run(request)
+        return {
+            'trades': _to_records(result['trades']),
+            'summary': {k: _to_json_value(v) for k, v in result['summary'].items()},
+            'metrics': {k: _to_json_value(v) for k, v in result['metrics'].items()},
+        }
+
+    def summary(self, request: dict) -> dict:
+        result = self.run(request)
+        return {
+            'summary': {k: _to_json_value(v) for k, v in result['summary'].items()},
+            'metrics': {k: _to_json_value(v) for k, v in result['metrics'].items()},
+        }
+
+    def series(self, request: dict) -> dict:
+        """
+        图表数据，最多max_points个点：优先保留实际成交的买入和卖出K线，
+        其余点数按收盘价用LTTB降采样
+        """
+        result = self.run(request)
+        df = result['processed_df'].reset_index(drop=True)
+        max_points = int(request.get('max_points', 500))
+        dates = df['日期'].to_numpy().astype('datetime64[D]')
+        trades = result['trades']
+        trade_days = (pd.to_datetime(pd.concat([trades['买入日期'], trades['卖出日期']])).to_numpy()
+                      .astype('datetime64[D]') if len(trades) else np.empty(0, dtype='datetime64[D]'))
+        trade_rows = np.flatnonzero(np.isin(dates, trade_days))
+        if len(df) <= max_points:
+            keep = np.arange(len(df))
+        elif max_points - len(trade_rows) >= 3:
+            # 降采样的点与成交K线重合时总数更少，不会超过max_points
+            sampled = downsample_lttb(dates.astype(np.int64), df['收盘'].to_numpy(), max_points - len(trade_rows))
+            keep = np.union1d(sampled, trade_rows)
+        else:
+            # 成交K线本身已超过点数上限时均匀抽取
+            keep = trade_rows[np.unique(np.linspace(0, len(trade_rows) - 1, max(max_points, 1)).astype(int))]
+        columns = ['日期', '收盘'] + result['strategy'].new_feature_columns + result['strategy'].new_indicator_columns
+        columns = list(dict.fromkeys(col for col in columns if col in df.columns))
+        sampled = df.loc[keep, columns]
+        return {
+            'points': len(sampled),
+            'total_points': len(df),
+            'series': {col: [_to_json_value(v) for v in sampled[col]] for col in columns},
+            'signals': [_to_json_value(v) for v in result['signals']['SIGNAL'].to_numpy()[keep]],
+        }
+
+    def record_latency(self, endpoint: str, seconds: float, error: bool = False):
+        with self._lock:
+            self._counters['requests'] += 1
+            if error:
+                self._counters['errors'] += 1
+            self._latencies.setdefault(endpoint, deque(maxlen=10000)).append(seconds * 1000)
+
+    def metrics(self) -> dict:
+        """请求计数与各接口延迟分位数（毫秒）"""
+        with self._lock:
+            latencies = {endpoint: list(values) for endpoint, values in self._latencies.items()}
+            counters = dict(self._counters)
+            counters['cached_results'] = len(self._results)
+            counters['cached_indicators'] = len(self._indicators)
+        percentiles = {}
+        for endpoint, values in latencies.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            percentiles[endpoint] = {'count': len(values), 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+                                     'max_ms': max(values)}
+        return {'counters': counters, 'latency': percentiles}
+
+
+class BacktestRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, handler):
+        start = time.perf_counter()
+        error = False
+        try:
+            self._send_json(200, handler())
+        except FileNotFoundError as e:
+            error = True
+            self._send_json(404, {'error': str(e)})
+        except (ValueError, TypeError, KeyError) as e:
+            error = True
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            error = True
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            self.service.record_latency(self.path, time.perf_counter() - start, error)
+
+    def do_GET(self):
+        routes = {
+            '/health': lambda: {'status': 'ok'},
+            '/stocks': lambda: {code: stock.name for code, stock in self.service.stocks.items()},
+            '/metrics': self.service.metrics,
+        }
+        if self.path not in routes:
+            self._send_json(404, {'error': f"未知接口：{self.path}"})
+            return
+        self._handle(routes[self.path])
+
+    def do_POST(self):
+        routes = {
+            '/backtest': self.service.backtest,
+            '/summary': self.service.summary,
+            '/series': self.service.series,
+        }
+        if self.path not in routes:
+            self._send_json(404, {'error': f"未知接口：{self.path}"})
+            return
+        # 请求体在_handle中解析，格式错误的请求与其他错误一样计入错误数和延迟
+        self._handle(lambda: routes[self.path](self._read_request()))
+
+    def _read_request(self) -> dict:
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ValueError("请求体不是合法的JSON") from None
+        if not isinstance(request, dict):
+            raise TypeError("请求体必须是JSON对象")
+        return request
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(service: BacktestService, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+    """
+    创建HTTP服务
+    :param service: BacktestService
+    :param host: 监听地址
+    :param port: 端口，为0时自动选择
+    :return: ThreadingHTTPServer，调用serve_forever()启动
+    """
+    handler = type('Handler', (BacktestRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def default_universe(data_dir: str = "resource/stock_price") -> dict:
+    return {f[:-len('.csv')]: '' for f in sorted(os.listdir(data_dir)) if f.endswith('.csv')}
+
+
+# 使用示例:
+# curl -X POST localhost:8000/summary -d '{"stock_code": "601288", "strategy": "ma",
+#      "params": {"ratio1": 1.0, "ratio2": 1.03, "period": "W", "ma_period": 10}}'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地回测服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址，默认：127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='端口，默认：8000')
+    parser.add_argument('--data-dir', type=str, default='resource/stock_price', help='股价数据目录')
+    args = parser.parse_args()
+
+    service = BacktestService(default_universe(args.data_dir), args.data_dir)
+    server = create_server(service, args.host, args.port)
+    print(f"回测服务已启动：http://{args.host}:{server.server_port}")
+    server.serve_forever()
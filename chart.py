@@ -1,74 +1,152 @@
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 import sys
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.image as mimage
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
 
 
 def setup_chinese_font():
     if sys.platform.startswith("win"):
-        plt.rcParams["font.sans-serif"] = ["SimHei"]
+        matplotlib.rcParams["font.sans-serif"] = ["SimHei"]
     elif sys.platform.startswith("linux"):
-        plt.rcParams["font.sans-serif"] = ["WenQuanYi Micro Hei"]
+        matplotlib.rcParams["font.sans-serif"] = ["WenQuanYi Micro Hei"]
     elif sys.platform.startswith("darwin"):
-        plt.rcParams["font.sans-serif"] = ["PingFang HK"]
-    plt.rcParams["axes.unicode_minus"] = False
+        matplotlib.rcParams["font.sans-serif"] = ["PingFang HK"]
+    matplotlib.rcParams["axes.unicode_minus"] = False
+
+
+# 字体只在导入时设置一次，之后各图表不再修改全局配置，可以在多个线程中同时绘制
+setup_chinese_font()
+
+
+def _date_numbers(values) -> np.ndarray:
+    """将日期序列转换为matplotlib的日期数值"""
+    return mdates.date2num(pd.to_datetime(pd.Series(values)).to_numpy())
 
 
 class Chart:
-    def __init__(self):
-        setup_chinese_font()
+    """
+    图表基类，每个图表持有自己的Figure和Agg画布，不使用pyplot的全局当前图形，
+    用完后调用close（或使用with语句）释放。
+    子类在_dynamic_artists中返回随数据变化的图元，坐标范围、标题和图例不变时，
+    重复绘制只恢复缓存的背景并重绘这些图元（blitting）。
+    这些图元只在draw渲染期间标记为animated，show和savefig等普通绘制仍包含它们。
+    """
+
+    def __init__(self, figsize=(12, 8), nrows=1, height_ratios=None):
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig)
+        axes = self.fig.subplots(nrows, 1, height_ratios=height_ratios, squeeze=False)
+        self.axes = list(axes[:, 0])
+        self._background = None
+        self._background_key = None
+
+    def _dynamic_artists(self) -> list:
+        """随数据变化、需要在背景之上单独绘制的图元"""
+        return []
+
+    def _static_key(self, dynamic):
+        """决定背景是否需要重新绘制的状态"""
+        dynamic_ids = {id(artist) for artist in dynamic}
+        key = [tuple(self.fig.get_size_inches())]
+        for ax in self.axes:
+            legend = ax.get_legend()
+            static_lines = tuple((line.get_visible(), tuple(np.asarray(line.get_ydata(), dtype=np.float64)))
+                                 for line in ax.lines if id(line) not in dynamic_ids)
+            key.append((ax.get_xlim(), ax.get_ylim(), ax.get_title(), ax.get_xlabel(), ax.get_ylabel(),
+                        tuple(text.get_text() for text in legend.get_texts()) if legend else None,
+                        static_lines))
+        return tuple(key)
+
+    def draw(self):
+        """渲染到画布，背景未变化时只重绘动态图元"""
+        dynamic = self._dynamic_artists()
+        key = self._static_key(dynamic) if dynamic else None
+        canvas = self.fig.canvas
+        # 背景中不包含动态图元，渲染结束后恢复，普通绘制时它们仍然可见
+        for artist in dynamic:
+            artist.set_animated(True)
+        try:
+            if key is None or key != self._background_key:
+                # 坐标范围、标题或图例变化后刻度和标签的宽度也会变化，每次重绘背景时重新布局
+                self.fig.tight_layout()
+                canvas.draw()
+                self._background = canvas.copy_from_bbox(self.fig.bbox) if dynamic else None
+                self._background_key = key
+            else:
+                canvas.restore_region(self._background)
+            for artist in dynamic:
+                if artist.get_visible():
+                    self.fig.draw_artist(artist)
+        finally:
+            for artist in dynamic:
+                artist.set_animated(False)
+        return self
 
     def show(self):
-        plt.tight_layout()
+        # 交互显示需要GUI后端，只有此时才导入pyplot，窗口关闭后从pyplot中移除
+        import matplotlib.pyplot as plt
+        self.fig.tight_layout()
+        self._background_key = None
+        plt.figure(self.fig)
         plt.show()
+        plt.close(self.fig)
 
     def save(self, filepath):
-        plt.tight_layout()
-        plt.savefig(filepath)
+        self.draw()
+        mimage.imsave(filepath, np.asarray(self.fig.canvas.buffer_rgba()), dpi=self.fig.dpi)
+        return self
+
+    def close(self):
+        """释放图形占用的内存，关闭后不能再绘制"""
+        self._background = None
+        self.fig.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class CandlestickChart(Chart):
     def __init__(self, stock_data):
-        super().__init__()
+        super().__init__(figsize=(12, 8))
+        self.ax = self.axes[0]
         self.stock_data = stock_data
-        self.fig, self.ax = plt.subplots(figsize=(12, 8))
         self._setup_basic_style()
-        
-    def _setup_chinese_font(self):
-        if sys.platform.startswith("win"):
-            plt.rcParams["font.sans-serif"] = ["SimHei"]
-        elif sys.platform.startswith("linux"):
-            plt.rcParams["font.sans-serif"] = ["WenQuanYi Micro Hei"]
-        elif sys.platform.startswith("darwin"):
-            plt.rcParams["font.sans-serif"] = ["PingFang HK"]
-        plt.rcParams["axes.unicode_minus"] = False
-        
+
     def _setup_basic_style(self):
         self.ax.set_facecolor("#f6f6f6")
         self.fig.set_facecolor("white")
         self.ax.grid(True, linestyle="--", alpha=0.3)
-        
+
     def plot_candlesticks(self):
-        for i in range(len(self.stock_data.df)):
-            row = self.stock_data.df.iloc[i]
-            color = "red" if row['收盘'] >= row['开盘'] else "green"
-            
-            body_height = abs(row['收盘'] - row['开盘'])
-            bottom = min(row['开盘'], row['收盘'])
-            rect = Rectangle((i - 0.3, bottom), 0.6, body_height, facecolor=color)
-            self.ax.add_patch(rect)
-            
-            self.ax.plot([i, i], [row['最高'], max(row['开盘'], row['收盘'])], 
-                        color=color, linewidth=0.5)
-            self.ax.plot([i, i], [row['最低'], min(row['开盘'], row['收盘'])], 
-                        color=color, linewidth=0.5)
-        
+        # 实体和影线各用一个集合绘制，不为每根K线创建图元
+        df = self.stock_data.df
+        x = np.arange(len(df))
+        open_, close = df['开盘'].to_numpy(dtype=np.float64), df['收盘'].to_numpy(dtype=np.float64)
+        high, low = df['最高'].to_numpy(dtype=np.float64), df['最低'].to_numpy(dtype=np.float64)
+        colors = np.where(close >= open_, "red", "green")
+        bottom, top = np.minimum(open_, close), np.maximum(open_, close)
+
+        wicks = np.stack([np.column_stack([x, low]), np.column_stack([x, high])], axis=1)
+        self.ax.add_collection(LineCollection(wicks, colors=colors, linewidths=0.5))
+        bodies = np.stack([np.column_stack([x - 0.3, bottom]), np.column_stack([x + 0.3, bottom]),
+                           np.column_stack([x + 0.3, top]), np.column_stack([x - 0.3, top])], axis=1)
+        self.ax.add_collection(PolyCollection(bodies, facecolors=colors, edgecolors='none'))
+        self.ax.autoscale_view()
         return self
-        
+
     def plot_ma_lines(self):
         ma_columns = [col for col in self.stock_data.df.columns if col.startswith('MA')]
         if not ma_columns:
             return self
-            
+
         for idx, col in enumerate(ma_columns):
             self.ax.plot(
                 range(len(self.stock_data.df)),
@@ -78,10 +156,10 @@ class CandlestickChart(Chart):
                 alpha=0.8,
                 linestyle='dashdot'
             )
-            
+
         self.ax.legend()
         return self
-        
+
     def set_xticks(self):
         df = self.stock_data.df
         num_ticks = min(10, len(df))
@@ -97,101 +175,176 @@ class CandlestickChart(Chart):
     def set_title(self, period='D'):
         period_names = {"D": "日", "W": "周", "M": "月"}
         period_name = period_names.get(period, '日')
-        
+
         dates = self.stock_data.df['日期']
         date_range = f"({dates.min().strftime('%Y-%m-%d')} 至 {dates.max().strftime('%Y-%m-%d')})"
-        
+
         title = f"{self.stock_data.name}({self.stock_data.stock_code}) - {period_name}K线 {date_range}"
         self.ax.set_title(title, pad=15)
         return self
 
 
 class TradeChart(Chart):
+    """
+    交易图表，可以作为模板重复使用：坐标轴、网格、标签只创建一次，
+    update传入新的数据后再次调用plot只更新价格线、买卖点、指标线等图元的数据。
+    批量生成图片时复用同一个TradeChart，内存占用不随图片数量增长：
+    chart.update(df, trades, columns, args).plot().save(path)
+    """
+
     def __init__(self, df, trades, new_indicator_columns, args):
-        super().__init__()
-        self.df = df
-        self.trades = trades
-        self.new_indicator_columns = new_indicator_columns
-        self.args = args
-        self.fig, (self.price_ax, self.indicator_ax) = plt.subplots(
-            2, 1, figsize=(12, 8), height_ratios=[2, 1]
-        )
+        super().__init__(figsize=(12, 8), nrows=2, height_ratios=[2, 1])
+        self.price_ax, self.indicator_ax = self.axes
+        self._price_line = None
+        self._buy_points = None
+        self._sell_points = None
+        self._annotations = []
+        self._indicator_lines = []
+        self._indicator_points = []
+        self._threshold_lines = None
         self._setup_basic_style()
-    
+        self.update(df, trades, new_indicator_columns, args)
+
     def _setup_basic_style(self):
         for ax in [self.price_ax, self.indicator_ax]:
             ax.set_facecolor("#f6f6f6")
             ax.grid(True, linestyle="--", alpha=0.3)
+            ax.xaxis_date()
         self.fig.set_facecolor("white")
-    
+        self.price_ax.set_xlabel('日期')
+        self.price_ax.set_ylabel('价格')
+        self.indicator_ax.set_xlabel('日期')
+        self.indicator_ax.set_ylabel('指标值')
+
+    def update(self, df, trades, new_indicator_columns, args):
+        """
+        替换图表的数据，之后调用plot或各plot_*方法只更新已有图元，
+        本次没有绘制的可选图元（如阈值线）会被隐藏
+        """
+        self.df = df
+        self.trades = trades
+        self.new_indicator_columns = new_indicator_columns
+        self.args = args
+        self._dates = _date_numbers(df['日期'])
+        self._buy_dates = _date_numbers(trades['买入日期']) if len(trades) else np.empty(0)
+        self._sell_dates = _date_numbers(trades['卖出日期']) if len(trades) else np.empty(0)
+        for artist in self._dynamic_artists():
+            artist.set_visible(False)
+        if self._threshold_lines:
+            for line in self._threshold_lines:
+                line.set_visible(False)
+        return self
+
+    def _dynamic_artists(self):
+        artists = [self._price_line, self._buy_points, self._sell_points]
+        artists += self._annotations + self._indicator_lines + self._indicator_points
+        return [artist for artist in artists if artist is not None]
+
+    @staticmethod
+    def _trade_offsets(dates, prices):
+        return np.column_stack([dates, np.asarray(prices, dtype=np.float64)]) if len(dates) else np.empty((0, 2))
+
+    def _autoscale(self, ax):
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+
     def plot_price_line(self):
-        self.price_ax.plot(self.df['日期'], self.df['收盘'], 
-                          label='收盘价', color='gray', alpha=0.6)
+        if self._price_line is None:
+            self._price_line, = self.price_ax.plot([], [], label='收盘价', color='gray', alpha=0.6)
+        self._price_line.set_data(self._dates, self.df['收盘'].to_numpy(dtype=np.float64))
+        self._price_line.set_visible(True)
+        self._autoscale(self.price_ax)
         return self
-    
+
     def plot_trade_points(self):
-        for _, trade in self.trades.iterrows():
-            label_buy = '买入点' if '买入点' not in [l.get_label() for l in self.price_ax.get_lines()] else ""
-            label_sell = '卖出点' if '卖出点' not in [l.get_label() for l in self.price_ax.get_lines()] else ""
-            
-            self.price_ax.scatter(trade['买入日期'], trade['买入价格'], 
-                                color='green', marker='^', s=100, label=label_buy)
-            self.price_ax.scatter(trade['卖出日期'], trade['卖出价格'], 
-                                color='red', marker='v', s=100, label=label_sell)
-            
-            return_text = f"{trade['收益率']:.1f}%"
-            self.price_ax.annotate(return_text, 
-                                 xy=(trade['卖出日期'], trade['卖出价格']),
-                                 xytext=(10, 10), textcoords='offset points',
-                                 fontsize=8, color='red' if trade['收益率'] > 0 else 'green')
+        if self._buy_points is None:
+            self._buy_points = self.price_ax.scatter([], [], color='green', marker='^', s=100,
+                                                     label='买入点')
+            self._sell_points = self.price_ax.scatter([], [], color='red', marker='v', s=100,
+                                                      label='卖出点')
+        self._buy_points.set_offsets(self._trade_offsets(self._buy_dates, self.trades['买入价格']))
+        self._sell_points.set_offsets(self._trade_offsets(self._sell_dates, self.trades['卖出价格']))
+        self._buy_points.set_visible(True)
+        self._sell_points.set_visible(True)
+
+        # 收益率标注复用已有的文本图元，交易笔数变少时多余的隐藏
+        returns = self.trades['收益率'].to_numpy(dtype=np.float64) if len(self.trades) else np.empty(0)
+        sell_prices = self.trades['卖出价格'].to_numpy(dtype=np.float64) if len(self.trades) else np.empty(0)
+        while len(self._annotations) < len(returns):
+            self._annotations.append(self.price_ax.annotate('', xy=(0, 0), xytext=(10, 10),
+                                                            textcoords='offset points', fontsize=8))
+        for annotation, date, price, value in zip(self._annotations, self._sell_dates, sell_prices, returns):
+            annotation.xy = (date, price)
+            annotation.set_text(f"{value:.1f}%")
+            annotation.set_color('red' if value > 0 else 'green')
+            annotation.set_visible(True)
         return self
-    
+
     def set_price_chart_properties(self):
         date_range_str = self._get_date_range_str()
         self.price_ax.set_title(
             f'{self.args.stock_name}({self.args.stock_code}) 周线交易策略 {date_range_str}'
         )
-        self.price_ax.set_xlabel('日期')
-        self.price_ax.set_ylabel('价格')
-        
-        handles, labels = self.price_ax.get_legend_handles_labels()
-        by_label = dict(zip(labels, handles))
-        self.price_ax.legend(by_label.values(), by_label.keys())
+        self._legend(self.price_ax)
         return self
-    
+
+    @staticmethod
+    def _legend(ax):
+        # 只为可见的线和散点生成图例
+        handles = [artist for artist in ax.lines + ax.collections
+                   if artist.get_visible() and not artist.get_label().startswith('_')]
+        handles = list({artist.get_label(): artist for artist in handles}.values())
+        if handles:
+            ax.legend(handles, [artist.get_label() for artist in handles])
+
     def plot_indicator_line(self):
-        if self.new_indicator_columns:
-            for col in self.new_indicator_columns:
-                self.indicator_ax.plot(self.df['日期'], self.df[col], 
-                                     label=col, alpha=0.7)
+        columns = self.new_indicator_columns or []
+        while len(self._indicator_lines) < len(columns):
+            self._indicator_lines.append(self.indicator_ax.plot([], [], alpha=0.7)[0])
+        for line, col in zip(self._indicator_lines, columns):
+            line.set_data(self._dates, self.df[col].to_numpy(dtype=np.float64))
+            line.set_label(col)
+            line.set_visible(True)
+        self._autoscale(self.indicator_ax)
         return self
-    
+
     def plot_threshold_lines(self):
-        self.indicator_ax.axhline(y=self.args.ratio1, color='green', linestyle='--', 
-                                label=f'买入阈值 ({self.args.ratio1:.2f})')
-        self.indicator_ax.axhline(y=self.args.ratio2, color='red', linestyle='--', 
-                                label=f'卖出阈值 ({self.args.ratio2:.2f})')
-        self.indicator_ax.axhline(y=1, color='gray', linestyle='-', 
-                                label='均衡线 (1.00)', alpha=0.5)
+        if self._threshold_lines is None:
+            self._threshold_lines = [
+                self.indicator_ax.axhline(y=0, color='green', linestyle='--'),
+                self.indicator_ax.axhline(y=0, color='red', linestyle='--'),
+                self.indicator_ax.axhline(y=1, color='gray', linestyle='-', label='均衡线 (1.00)', alpha=0.5),
+            ]
+        buy_line, sell_line, balance_line = self._threshold_lines
+        buy_line.set_ydata([self.args.ratio1, self.args.ratio1])
+        buy_line.set_label(f'买入阈值 ({self.args.ratio1:.2f})')
+        sell_line.set_ydata([self.args.ratio2, self.args.ratio2])
+        sell_line.set_label(f'卖出阈值 ({self.args.ratio2:.2f})')
+        for line in self._threshold_lines:
+            line.set_visible(True)
+        self._autoscale(self.indicator_ax)
         return self
-    
+
     def plot_indicator_points(self):
-        if self.new_indicator_columns:
-            for indicator in self.new_indicator_columns:
-                for _, trade in self.trades.iterrows():
-                    self.indicator_ax.scatter(trade['买入日期'], trade[f'买入时{indicator}指标'], 
-                                            color='green', marker='^', s=100)
-                    self.indicator_ax.scatter(trade['卖出日期'], trade[f'卖出时{indicator}指标'], 
-                                            color='red', marker='v', s=100)
+        columns = self.new_indicator_columns or []
+        while len(self._indicator_points) < 2 * len(columns):
+            self._indicator_points.append(self.indicator_ax.scatter([], [], color='green', marker='^', s=100))
+            self._indicator_points.append(self.indicator_ax.scatter([], [], color='red', marker='v', s=100))
+        for i, indicator in enumerate(columns):
+            buy_points, sell_points = self._indicator_points[2 * i], self._indicator_points[2 * i + 1]
+            buy_values = self.trades[f'买入时{indicator}指标'] if len(self.trades) else []
+            sell_values = self.trades[f'卖出时{indicator}指标'] if len(self.trades) else []
+            buy_points.set_offsets(self._trade_offsets(self._buy_dates, buy_values))
+            sell_points.set_offsets(self._trade_offsets(self._sell_dates, sell_values))
+            buy_points.set_visible(True)
+            sell_points.set_visible(True)
         return self
-    
+
     def set_indicator_chart_properties(self):
         self.indicator_ax.set_title(f'{self.new_indicator_columns}变化')
-        self.indicator_ax.set_xlabel('日期')
-        self.indicator_ax.set_ylabel('指标值')
-        self.indicator_ax.legend()
+        self._legend(self.indicator_ax)
         return self
-    
+
     def _get_date_range_str(self):
         if self.args.start_date and self.args.end_date:
             return f"({self.args.start_date} 至 {self.args.end_date})"
@@ -211,41 +364,42 @@ class TradeChart(Chart):
                 .plot_indicator_points()
                 .set_indicator_chart_properties())
 
+
 class IndicatorDistributionChart(Chart):
     def __init__(self, df, indicator_name, args, bins=50):
-        super().__init__()
+        super().__init__(figsize=(12, 6))
+        self.dist_ax = self.axes[0]
         self.df = df
         self.indicator_name = indicator_name
         self.args = args
         self.bins = bins
-        self.fig, self.dist_ax = plt.subplots(figsize=(12, 6))
         self._setup_basic_style()
-        
+
     def _setup_basic_style(self):
         self.dist_ax.set_facecolor("#f6f6f6")
         self.dist_ax.grid(True, linestyle="--", alpha=0.3)
         self.fig.set_facecolor("white")
-        
+
     def plot_histogram(self):
         self.ratio_data = self.df[f'{self.indicator_name}'].dropna()
-        self.dist_ax.hist(self.ratio_data, bins=self.bins, 
-                         alpha=0.7, color='blue', density=True)
+        self.dist_ax.hist(self.ratio_data, bins=self.bins,
+                          alpha=0.7, color='blue', density=True)
         return self
-        
+
     def plot_threshold_lines(self):
         ylim = self.dist_ax.get_ylim()
-        
-        self.dist_ax.vlines(self.args.ratio1, 0, ylim[1], 
-                          colors='green', linestyles='--',
-                          label=f'买入阈值 ({self.args.ratio1:.2f})')
-        self.dist_ax.vlines(self.args.ratio2, 0, ylim[1], 
-                          colors='red', linestyles='--',
-                          label=f'卖出阈值 ({self.args.ratio2:.2f})')
-        self.dist_ax.vlines(1, 0, ylim[1], 
-                          colors='gray', linestyles='-',
-                          label='均衡线 (1.00)', alpha=0.5)
+
+        self.dist_ax.vlines(self.args.ratio1, 0, ylim[1],
+                            colors='green', linestyles='--',
+                            label=f'买入阈值 ({self.args.ratio1:.2f})')
+        self.dist_ax.vlines(self.args.ratio2, 0, ylim[1],
+                            colors='red', linestyles='--',
+                            label=f'卖出阈值 ({self.args.ratio2:.2f})')
+        self.dist_ax.vlines(1, 0, ylim[1],
+                            colors='gray', linestyles='-',
+                            label='均衡线 (1.00)', alpha=0.5)
         return self
-        
+
     def add_statistics(self):
         stats = {
             '均值': self.ratio_data.mean(),
@@ -254,32 +408,32 @@ class IndicatorDistributionChart(Chart):
             '10%分位数': self.ratio_data.quantile(0.1),
             '90%分位数': self.ratio_data.quantile(0.9)
         }
-        
+
         stats_text = '\n'.join(
             f'{key}: {value:.3f}' for key, value in stats.items()
         )
-        
+
         self.dist_ax.text(0.02, 0.98, stats_text,
-                         transform=self.dist_ax.transAxes,
-                         verticalalignment='top',
-                         bbox=dict(boxstyle='round', 
-                                 facecolor='white', 
-                                 alpha=0.8))
+                          transform=self.dist_ax.transAxes,
+                          verticalalignment='top',
+                          bbox=dict(boxstyle='round',
+                                    facecolor='white',
+                                    alpha=0.8))
         return self
-        
+
     def set_chart_properties(self):
         date_range_str = self._get_date_range_str()
         self.dist_ax.set_title(
             f'{self.args.stock_name}({self.args.stock_code}) '
             f'{self.indicator_name}指标值分布 {date_range_str}'
         )
-        
+
         self.dist_ax.set_xlabel(f'{self.indicator_name}值')
         self.dist_ax.set_ylabel('密度')
-        
+
         self.dist_ax.legend()
         return self
-        
+
     def _get_date_range_str(self):
         if self.args.start_date and self.args.end_date:
             return f"({self.args.start_date} 至 {self.args.end_date})"
@@ -296,21 +450,22 @@ class IndicatorDistributionChart(Chart):
                 .add_statistics()
                 .set_chart_properties())
 
+
 # 使用示例
 if __name__ == "__main__":
     from stock_data import StockData
-    
+
     # 准备数据
     stock = StockData("601288", "农业银行")
     processed_stock = (stock
         .aggregate_by_period('W')
         .filter_by_date('2023-01-01', '2023-12-31')
         .calculate_ma([5, 10, 20]))
-    
+
     # 绘制图表
-    chart = CandlestickChart(processed_stock)
-    (chart.plot_candlesticks()
-          .plot_ma_lines()
-          .set_xticks()
-          .set_title('W')
-          .show())
+    with CandlestickChart(processed_stock) as chart:
+        (chart.plot_candlesticks()
+              .plot_ma_lines()
+              .set_xticks()
+              .set_title('W')
+              .show())
@@ -0,0 +1,282 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from stock_data_downloader import PriceManifest, atomic_write_csv
+from trading_calendar import TradingCalendar
+
+# 出现即说明文件不可用的检查项，隔离时只按这些检查项处理
+ERROR_CHECKS = ('unreadable', 'bad_date', 'duplicate_date', 'unordered_date', 'non_positive_price',
+                'ohlc_inconsistent')
+# 数据可用但需要注意的检查项
+WARNING_CHECKS = ('missing_day', 'off_calendar', 'zero_volume', 'flat_bar', 'precision_loss', 'price_jump')
+CHECKS = ERROR_CHECKS + WARNING_CHECKS
+
+PRICE_COLUMNS = ['开盘', '收盘', '最高', '最低']
+ISSUE_COLUMNS = ['股票代码', '检查项', '开始日期', '结束日期', 'K线数', '说明']
+
+
+def price_limit(stock_code: str) -> float:
+    """
+    股票所在板块的涨跌停幅度
+    :param stock_code: 股票代码
+    :return: 主板0.1，创业板、科创板0.2，北交所0.3
+    """
+    code = str(stock_code)
+    if code.startswith(('300', '301', '688', '689')):
+        return 0.2
+    if code.startswith(('4', '8', '92')):
+        return 0.3
+    return 0.1
+
+
+def _runs(mask):
+    """连续为True的区间，返回 (起点数组, 终点数组)，终点包含在区间内"""
+    change = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(change == 1), np.flatnonzero(change == -1) - 1
+
+
+def _decimals(prices, max_decimals=4):
+    """价格的小数位数，即所有价格都是10^-d整数倍的最小d"""
+    prices = prices[np.isfinite(prices)]
+    for decimals in range(max_decimals + 1):
+        scaled = prices * 10 ** decimals
+        if np.all(np.abs(scaled - np.round(scaled)) < 1e-6):
+            return decimals
+    return max_decimals
+
+
+def scan_frame(df: pd.DataFrame, calendar_days=None, stock_code: str = '', max_tick_ratio: float = 0.005,
+               jump_tolerance: float = 0.005, max_ranges: int = 20):
+    """
+    对单只股票的K线做一次向量化的完整性检查，不修改df
+    :param df: 原始K线，包含'日期'、开高低收和'成交量'列，按文件中的顺序
+    :param calendar_days: 交易日历的datetime64[D]数组，None时不检查缺失的交易日
+    :param stock_code: 股票代码，用于确定涨跌停幅度和报告
+    :param max_tick_ratio: 最小价位变动占收盘价的比例超过该值时视为精度不足，如0.005表示一个价位超过0.5%
+    :param jump_tolerance: 涨跌幅超过涨跌停幅度加一个价位再加该值时视为可疑的复权跳变
+    :param max_ranges: 每个检查项最多报告的区间数，按K线数从多到少保留
+    :return: (摘要字典, 问题区间列表)，摘要中每个检查项为出问题的K线（或交易日）数
+    """
+    counts = dict.fromkeys(CHECKS, 0)
+    issues = []
+    n = len(df)
+    raw_dates = df['日期'].astype(str).to_numpy()
+
+    def report(check, starts, ends, bars, labels, details):
+        counts[check] += int(np.sum(bars))
+        # 只保留最长的max_ranges个区间，摘要中的计数仍是全部
+        keep = np.sort(np.argsort(-np.asarray(bars), kind='stable')[:max_ranges])
+        for i in keep:
+            issues.append({'股票代码': stock_code, '检查项': check, '开始日期': labels[starts[i]],
+                           '结束日期': labels[ends[i]], 'K线数': int(bars[i]), '说明': details[i]})
+
+    def report_mask(check, mask, detail=''):
+        starts, ends = _runs(mask)
+        report(check, starts, ends, ends - starts + 1, raw_dates, [detail] * len(starts))
+
+    # 日期：无法解析、重复和倒序
+    days = pd.to_datetime(pd.Series(raw_dates), errors='coerce').to_numpy().astype('datetime64[D]')
+    bad_date = np.isnat(days)
+    report_mask('bad_date', bad_date)
+    step = np.diff(days.astype(np.int64))
+    comparable = ~(bad_date[1:] | bad_date[:-1])
+    report_mask('duplicate_date', np.r_[False, comparable & (step == 0)])
+    report_mask('unordered_date', np.r_[False, comparable & (step < 0)])
+
+    # 价格：非正数或缺失、最高价低于开收低价、最低价高于开收高价
+    open_, close, high, low = (pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+                               for col in PRICE_COLUMNS)
+    prices = np.column_stack([open_, close, high, low])
+    positive = np.all(prices > 0, axis=1)
+    report_mask('non_positive_price', ~positive)
+    eps = 1e-9 * np.abs(prices).max(axis=1)
+    inconsistent = ((high < np.fmax(np.fmax(open_, close), low) - eps)
+                    | (low > np.fmin(np.fmin(open_, close), high) + eps))
+    report_mask('ohlc_inconsistent', positive & inconsistent)
+
+    # 停牌或异常的K线：零成交量、开高低收完全相同
+    volume = pd.to_numeric(df['成交量'], errors='coerce').to_numpy(dtype=np.float64)
+    report_mask('zero_volume', ~(volume > 0))
+    report_mask('flat_bar', positive & (open_ == high) & (high == low) & (low == close))
+
+    # 精度：价格只保留decimals位小数，价格很低时一个价位就是很大的涨跌幅
+    decimals = _decimals(prices[positive].ravel())
+    tick = 10.0 ** -decimals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tick_ratio = tick / close
+        starts, ends = _runs(positive & (tick_ratio > max_tick_ratio))
+        worst = [f"最小价位{tick:g}，最大占收盘价{np.max(tick_ratio[s:e + 1]) * 100:.2f}%"
+                 for s, e in zip(starts, ends)]
+        report('precision_loss', starts, ends, ends - starts + 1, raw_dates, worst)
+
+        # 复权跳变：相邻K线的涨跌幅超过涨跌停幅度，扣除一个价位的舍入误差
+        returns = close[1:] / close[:-1] - 1
+        allowed = price_limit(stock_code) + tick / close[:-1] + jump_tolerance
+        jump = np.r_[False, positive[1:] & positive[:-1] & (np.abs(returns) > allowed)]
+    jumps = np.flatnonzero(jump)
+    report('price_jump', jumps, jumps, np.ones(len(jumps), dtype=np.int64), raw_dates,
+           [f"{raw_dates[i - 1]}收盘{close[i - 1]:g}，当日收盘{close[i]:g}，涨跌幅{returns[i - 1] * 100:.2f}%"
+            for i in jumps])
+
+    # 交易日历：首尾之间缺失的交易日，以及不在日历中的日期
+    ordered = days[~bad_date]
+    if counts['duplicate_date'] or counts['unordered_date']:
+        ordered = np.unique(ordered)
+    if calendar_days is not None and len(ordered) > 0 and len(calendar_days) > 0:
+        calendar_days = np.asarray(calendar_days, dtype='datetime64[D]')
+        covered = calendar_days[(calendar_days >= ordered[0]) & (calendar_days <= ordered[-1])]
+        missing = ~np.isin(covered, ordered)
+        starts, ends = _runs(missing)
+        labels = covered.astype(str)
+        report('missing_day', starts, ends, ends - starts + 1, labels, [''] * len(starts))
+        inside = ordered[ordered <= calendar_days[-1]]
+        off = inside[~np.isin(inside, calendar_days)]
+        report('off_calendar', np.arange(len(off)), np.arange(len(off)), np.ones(len(off), dtype=np.int64),
+               off.astype(str), ['非交易日'] * len(off))
+
+    if any(counts[check] for check in ERROR_CHECKS):
+        status = 'error'
+    elif any(counts[check] for check in WARNING_CHECKS):
+        status = 'warning'
+    else:
+        status = 'ok'
+    summary = {
+        '股票代码': stock_code,
+        '状态': status,
+        'K线数': n,
+        '开始日期': str(ordered[0]) if len(ordered) else None,
+        '结束日期': str(ordered[-1]) if len(ordered) else None,
+        '价格小数位': decimals,
+        **counts,
+    }
+    return summary, issues
+
+
+def _scan_file(task):
+    stock_code, file_path, calendar_days, options = task
+    try:
+        df = pd.read_csv(file_path, dtype={'股票代码': str})
+        missing_columns = [col for col in ['日期', '成交量'] + PRICE_COLUMNS if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"缺少必要的列：{missing_columns}")
+    except (OSError, ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+        summary = {'股票代码': stock_code, '状态': 'error', 'K线数': 0, '开始日期': None, '结束日期': None,
+                   '价格小数位': None, **dict.fromkeys(CHECKS, 0), 'unreadable': 1}
+        return summary, [{'股票代码': stock_code, '检查项': 'unreadable', '开始日期': None, '结束日期': None,
+                          'K线数': 0, '说明': str(e)}]
+    return scan_frame(df, calendar_days, stock_code, **options)
+
+
+class IntegrityScanner:
+    def __init__(self, data_dir: str = "resource/stock_price", calendar: TradingCalendar = None,
+                 max_workers: int = None, max_tick_ratio: float = 0.005, jump_tolerance: float = 0.005,
+                 max_ranges: int = 20):
+        """
+        初始化股价数据完整性扫描器，每只股票一次向量化检查，多只股票在进程池中并行
+        :param data_dir: CSV数据目录
+        :param calendar: 交易日历，默认为data_dir对应的本地交易日历。缺失交易日和非交易日的检查只使用
+                         其中来自交易所的交易日，由股价数据推断的日期检查不出所有股票都缺失的交易日
+        :param max_workers: 进程数，为1时在当前进程中扫描
+        :param max_tick_ratio: 见scan_frame
+        :param jump_tolerance: 见scan_frame
+        :param max_ranges: 见scan_frame
+        """
+        self.data_dir = data_dir
+        self.calendar = calendar if calendar is not None else TradingCalendar(data_dir=data_dir)
+        self.max_workers = max_workers
+        self.options = {'max_tick_ratio': max_tick_ratio, 'jump_tolerance': jump_tolerance,
+                        'max_ranges': max_ranges}
+
+    @property
+    def quarantine_dir(self) -> str:
+        return os.path.join(self.data_dir, 'quarantine')
+
+    def _default_universe(self):
+        return [f[:-len('.csv')] for f in sorted(os.listdir(self.data_dir)) if f.endswith('.csv')]
+
+    def scan(self, stock_codes=None):
+        """
+        扫描股票数据
+        :param stock_codes: 股票代码列表，默认扫描数据目录中的全部股票
+        :return: (summary, issues)，summary每只股票一行，包含状态和各检查项的计数，
+                 '日历检查'列为False时表示没有交易所日历，missing_day和off_calendar未检查；
+                 issues每个问题区间一行
+        """
+        if stock_codes is None:
+            stock_codes = self._default_universe()
+        calendar_days = self._exchange_days()
+        tasks = [(code, os.path.join(self.data_dir, f"{code}.csv"), calendar_days, self.options)
+                 for code in stock_codes]
+
+        if self.max_workers == 1 or len(tasks) <= 1:
+            results = list(map(_scan_file, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                chunksize = max(1, len(tasks) // ((self.max_workers or os.cpu_count() or 1) * 4))
+                results = list(executor.map(_scan_file, tasks, chunksize=chunksize))
+
+        summary = pd.DataFrame([row for row, _ in results],
+                               columns=['股票代码', '状态', 'K线数', '开始日期', '结束日期', '价格小数位', *CHECKS])
+        summary.insert(summary.columns.get_loc('价格小数位') + 1, '日历检查', calendar_days is not None)
+        issues = pd.DataFrame([issue for _, rows in results for issue in rows], columns=ISSUE_COLUMNS)
+        return summary, issues
+
+    def _exchange_days(self):
+        """交易所日历的交易日，本地没有时从新浪更新，更新失败时返回None"""
+        if not self.calendar.has_exchange_days:
+            try:
+                self.calendar.update_from_akshare()
+            except Exception as e:
+                print(f"警告：无法获取交易所日历，不检查缺失的交易日和非交易日（{e}）")
+                return None
+        return self.calendar.exchange_days
+
+    @staticmethod
+    def write_report(summary: pd.DataFrame, issues: pd.DataFrame, report_dir: str):
+        """
+        保存扫描报告：integrity_summary.csv每只股票一行，integrity_issues.csv每个问题区间一行
+        :param summary: scan返回的摘要
+        :param issues: scan返回的问题区间
+        :param report_dir: 报告目录
+        :return: (摘要文件路径, 问题文件路径)
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        summary_path = os.path.join(report_dir, 'integrity_summary.csv')
+        issues_path = os.path.join(report_dir, 'integrity_issues.csv')
+        atomic_write_csv(summary, summary_path)
+        atomic_write_csv(issues, issues_path)
+        return summary_path, issues_path
+
+    def quarantine(self, summary: pd.DataFrame, checks=ERROR_CHECKS) -> list:
+        """
+        将有问题的文件移动到数据目录下的quarantine目录，并从清单中删除记录，
+        回测读取时不会用到这些文件，不使用离线模式时会重新下载
+        :param summary: scan返回的摘要
+        :param checks: 计数大于0时需要隔离的检查项，默认为ERROR_CHECKS
+        :return: 被隔离的股票代码列表
+        """
+        bad = summary[(summary[list(checks)] > 0).any(axis=1)]['股票代码'].tolist()
+        if not bad:
+            return []
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        manifest = PriceManifest(self.data_dir)
+        moved = []
+        for stock_code in bad:
+            file_name = f"{stock_code}.csv"
+            file_path = os.path.join(self.data_dir, file_name)
+            if not os.path.exists(file_path):
+                continue
+            os.replace(file_path, os.path.join(self.quarantine_dir, file_name))
+            manifest.forget(stock_code)
+            moved.append(stock_code)
+        return moved
+
+
+# 使用示例：检查全部股价数据并保存报告
+if __name__ == '__main__':
+    scanner = IntegrityScanner('resource/stock_price')
+    summary, issues = scanner.scan()
+    print(summary[['股票代码', '状态', 'K线数', '价格小数位', 'missing_day', 'precision_loss', 'price_jump']])
+    print(issues.groupby('检查项')['K线数'].sum())
+    scanner.write_report(summary, issues, 'resource/integrity')
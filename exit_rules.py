@@ -0,0 +1,267 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+
+
+def _first_reaching(values, seg, seg_end, query_seg, thresholds):
+    """
+    分段查找：每个查询在所属分段中第一个values >= threshold的位置
+    对值的排名做分段累计最大值，排名为整数，分段偏移后比较没有浮点误差
+    :param values: 各分段首尾相接的一维数组
+    :param seg: 每个元素所属的分段号，从0开始递增
+    :param seg_end: 每个分段的结束位置（不含）
+    :param query_seg: 每个查询的分段号
+    :param thresholds: 每个查询的阈值
+    :return: 每个查询的位置，没有满足条件的元素时为该分段的结束位置
+    """
+    uniq, rank = np.unique(values, return_inverse=True)
+    width = len(uniq) + 1
+    running = np.maximum.accumulate(rank.astype(np.int64) + seg * width)
+    target = np.searchsorted(uniq, thresholds, side='left') + query_seg * width
+    position = np.searchsorted(running, target, side='left')
+    return np.minimum(position, seg_end[query_seg])
+
+
+def _segment_cummax(values, seg):
+    """分段累计最大值，每个分段从头重新计算"""
+    uniq, rank = np.unique(values, return_inverse=True)
+    width = len(uniq) + 1
+    running = np.maximum.accumulate(rank.astype(np.int64) + seg * width)
+    return uniq[running - seg * width]
+
+
+class ExitRule(ABC):
+    """
+    平仓规则基类，levels可以是一个数或数组，数组中每个值对应一组参数，
+    同一次回测中所有规则的数组长度必须相同或为1
+    """
+    name = ''
+
+    def __init__(self, levels):
+        self.levels = np.atleast_1d(np.asarray(levels, dtype=np.float64))
+
+    @abstractmethod
+    def first_exit(self, window, query_seg, levels):
+        """
+        查找每组参数在持仓期内第一次触发的位置
+        :param window: 持仓窗口，见apply_exit_rules
+        :param query_seg: 每个查询所在的窗口编号
+        :param levels: 每个查询的参数
+        :return: 触发位置，未触发时为窗口结束位置
+        """
+        pass
+
+
+class TrailingStop(ExitRule):
+    """移动止损：收盘价从持仓以来的最高收盘价回撤超过levels（如0.1表示10%）时卖出"""
+    name = 'trailing_stop'
+
+    def first_exit(self, window, query_seg, levels):
+        running_max = _segment_cummax(window['close'], window['seg'])
+        drawdown = np.where(window['is_entry'], -np.inf, 1 - window['close'] / running_max)
+        return _first_reaching(drawdown, window['seg'], window['seg_end'], query_seg, levels)
+
+
+class StopLoss(ExitRule):
+    """固定止损：收盘价低于买入价格超过levels时卖出"""
+    name = 'stop_loss'
+
+    def first_exit(self, window, query_seg, levels):
+        loss = np.where(window['is_entry'], -np.inf, 1 - window['close'] / window['entry_price'])
+        return _first_reaching(loss, window['seg'], window['seg_end'], query_seg, levels)
+
+
+class TakeProfit(ExitRule):
+    """止盈：收盘价高于买入价格超过levels时卖出"""
+    name = 'take_profit'
+
+    def first_exit(self, window, query_seg, levels):
+        gain = np.where(window['is_entry'], -np.inf, window['close'] / window['entry_price'] - 1)
+        return _first_reaching(gain, window['seg'], window['seg_end'], query_seg, levels)
+
+
+class MaxHoldingBars(ExitRule):
+    """最长持有：持有levels根K线后卖出"""
+    name = 'max_holding_bars'
+
+    def first_exit(self, window, query_seg, levels):
+        position = window['seg_start'][query_seg] + np.maximum(levels, 1).astype(np.int64)
+        return np.minimum(position, window['seg_end'][query_seg])
+
+
+class MonthExit(ExitRule):
+    """按时间卖出：持仓期间遇到levels月份（1~12）的第一根K线时卖出，如在分红除权月之前离场"""
+    name = 'month_exit'
+
+    def first_exit(self, window, query_seg, levels):
+        month = window['month']
+        month_start = np.r_[True, month[1:] != month[:-1]] & ~window['is_entry']
+        result = window['seg_end'][query_seg].copy()
+        for value in np.unique(levels):
+            hit = np.where(month_start & (month == value), 1.0, 0.0)
+            selected = levels == value
+            result[selected] = _first_reaching(hit, window['seg'], window['seg_end'],
+                                               query_seg[selected], np.ones(selected.sum()))
+        return result
+
+
+def exit_rule_settings(rules) -> pd.DataFrame:
+    """
+    每组参数的取值
+    :param rules: ExitRule列表
+    :return: DataFrame，每行对应一个run_id
+    """
+    count = max([len(rule.levels) for rule in rules] + [1])
+    settings = pd.DataFrame({'run_id': np.arange(count)})
+    for rule in rules:
+        if len(rule.levels) not in (1, count):
+            raise ValueError(f"{rule.name}的参数个数{len(rule.levels)}与其他规则的{count}不一致")
+        settings[rule.name] = np.broadcast_to(rule.levels, count)
+    return settings
+
+
+def range_max(values):
+    """稀疏表，返回查询[left, right]区间最大值的函数"""
+    table = [values]
+    width = 1
+    while width * 2 <= len(values):
+        table.append(np.maximum(table[-1][:-width], table[-1][width:]))
+        width *= 2
+
+    def query(left, right):
+        level = np.floor(np.log2(right - left + 1)).astype(np.int64)
+        result = np.empty(len(left))
+        for k in np.unique(level):
+            selected = level == k
+            result[selected] = np.maximum(table[k][left[selected]], table[k][right[selected] - (1 << k) + 1])
+        return result
+    return query
+
+
+def apply_exit_rules(signals, rules, price_column='收盘') -> pd.DataFrame:
+    """
+    在策略信号的基础上叠加平仓规则，所有参数组同时计算。
+    买入信号出现且空仓时以收盘价买入，卖出信号或任一规则触发时以当根收盘价卖出，
+    规则与卖出信号在同一根K线触发时记为信号卖出。
+    每一步为所有参数组各找到下一笔交易，相同买入点的参数组共用一个持仓窗口，
+    窗口内的累计最高价、收益率通过分段累计最大值一次计算，步数等于单组参数的最多交易笔数。
+    :param signals: DataFrame，包含'日期'、price_column和'SIGNAL'列，如策略_generate_signals的结果
+    :param rules: ExitRule列表，为空时结果与只按信号交易一致
+    :param price_column: 价格列
+    :return: DataFrame，交易记录，run_id对应exit_rule_settings的行，可直接用于get_batch_performance_summary
+    """
+    settings = exit_rule_settings(rules)
+    count = len(settings)
+    close = signals[price_column].to_numpy(dtype=np.float64)
+    dates = signals['日期'].to_numpy()
+    signal = signals['SIGNAL'].to_numpy()
+    months = pd.DatetimeIndex(signals['日期']).month.to_numpy()
+    n = len(close)
+    level_arrays = [np.broadcast_to(rule.levels, count) for rule in rules]
+
+    # next_buy[i]为i及之后第一个买入信号的位置，next_sell同理，没有时为n
+    positions = np.arange(n)
+    next_buy = np.minimum.accumulate(np.where(signal == 1, positions, n)[::-1])[::-1]
+    next_sell = np.minimum.accumulate(np.where(signal == -1, positions, n)[::-1])[::-1]
+    next_buy, next_sell = np.r_[next_buy, n], np.r_[next_sell, n, n]
+
+    search_from = np.zeros(count, dtype=np.int64)
+    trades = []
+    while True:
+        entry = next_buy[np.minimum(search_from, n)]
+        active = np.flatnonzero(entry < n)
+        if len(active) == 0:
+            break
+        # 相同买入点的参数组共用一个窗口：[买入K线, 卖出信号K线或最后一根K线]
+        unique_entries, query_seg = np.unique(entry[active], return_inverse=True)
+        signal_exit = next_sell[unique_entries + 1]
+        window_end = np.minimum(signal_exit, n - 1)
+        lengths = window_end - unique_entries + 1
+        seg_end = np.cumsum(lengths)
+        seg_start = seg_end - lengths
+        seg = np.repeat(np.arange(len(unique_entries)), lengths)
+        bars = np.arange(seg_end[-1]) - np.repeat(seg_start, lengths) + np.repeat(unique_entries, lengths)
+        window = {
+            'seg': seg,
+            'seg_start': seg_start,
+            'seg_end': seg_end,
+            'close': close[bars],
+            'month': months[bars],
+            'entry_price': np.repeat(close[unique_entries], lengths),
+            'is_entry': np.zeros(len(bars), dtype=bool),
+        }
+        window['is_entry'][seg_start] = True
+
+        exit_position = seg_end[query_seg].copy()
+        reason = np.full(len(active), 'signal', dtype=object)
+        for rule, levels in zip(rules, level_arrays):
+            hit = rule.first_exit(window, query_seg, levels[active])
+            earlier = hit < exit_position
+            exit_position[earlier] = hit[earlier]
+            reason[earlier] = rule.name
+        # 规则与卖出信号在同一根K线触发时记为信号卖出
+        at_signal = (exit_position == seg_end[query_seg] - 1) & (signal_exit[query_seg] < n)
+        reason[at_signal] = 'signal'
+
+        closed = exit_position < seg_end[query_seg]
+        closed |= signal_exit[query_seg] < n
+        exit_position = np.minimum(exit_position, seg_end[query_seg] - 1)
+        exit_bar = bars[exit_position]
+        runs = active[closed]
+        trades.append((runs, entry[runs], exit_bar[closed], reason[closed]))
+        search_from[:] = n
+        search_from[runs] = exit_bar[closed] + 1
+
+    columns = ['run_id', '买入日期', '买入价格', '卖出日期', '卖出价格', '收益率', '最大收益率', '回撤率',
+               '持有K线数', '卖出原因']
+    if not trades:
+        return pd.DataFrame(columns=columns)
+    run_ids = np.concatenate([t[0] for t in trades])
+    entries = np.concatenate([t[1] for t in trades])
+    exits = np.concatenate([t[2] for t in trades])
+    reasons = np.concatenate([t[3] for t in trades])
+    order = np.lexsort((entries, run_ids))
+    run_ids, entries, exits, reasons = run_ids[order], entries[order], exits[order], reasons[order]
+
+    entry_price, exit_price = close[entries], close[exits]
+    max_price = range_max(close)(entries, exits)
+    return pd.DataFrame({
+        'run_id': run_ids,
+        '买入日期': dates[entries],
+        '买入价格': entry_price,
+        '卖出日期': dates[exits],
+        '卖出价格': exit_price,
+        '收益率': (exit_price / entry_price - 1) * 100,
+        '最大收益率': (max_price / entry_price - 1) * 100,
+        '回撤率': (exit_price / max_price - 1) * 100,
+        '持有K线数': exits - entries,
+        '卖出原因': reasons,
+    }, columns=columns)
+
+
+def backtest_with_exits(strategy, stock_data, rules, start_date=None, end_date=None):
+    """
+    用策略的买卖信号叠加平仓规则回测
+    :param strategy: 策略对象
+    :param stock_data: StockData对象
+    :param rules: ExitRule列表
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :return: (signals, trades, settings)
+    """
+    processed_df = strategy._process_data(stock_data, start_date, end_date)
+    signals = strategy._generate_signals(processed_df)
+    return signals, apply_exit_rules(signals, rules), exit_rule_settings(rules)
+
+
+# 使用示例：周线MA策略叠加100组移动止损参数
+if __name__ == '__main__':
+    from stock_data import StockData
+    from strategy_analyzer import get_batch_performance_summary
+    from strategy_generator import MAStrategy
+
+    stock_data = StockData('601288', '农业银行', offline=True)
+    rules = [TrailingStop(np.linspace(0.01, 0.3, 100)), StopLoss(0.1)]
+    signals, trades, settings = backtest_with_exits(MAStrategy(0.99, 1.03, 'W', 10), stock_data, rules)
+    summary = settings.join(get_batch_performance_summary(trades, run_ids=settings['run_id']), on='run_id')
+    print(summary.sort_values('total_return', ascending=False).head(10))
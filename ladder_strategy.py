@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import numpy as np
+import pandas as pd
+from exit_rules import range_max
+
+
+class _CrossingIndex:
+    """
+    稀疏表：查询从某根K线开始第一次 >= 或 <= 某个价位的位置，每次查询O(log n)，
+    引擎只在有成交的K线上停下，不需要逐根K线检查全部价位。NaN永远不触发。
+    """
+
+    def __init__(self, values):
+        self.n = len(values)
+        nan = np.isnan(values)
+        self._max = [np.where(nan, -np.inf, values)]
+        self._min = [np.where(nan, np.inf, values)]
+        width = 1
+        while width * 2 <= self.n:
+            self._max.append(np.maximum(self._max[-1][:-width], self._max[-1][width:]))
+            self._min.append(np.minimum(self._min[-1][:-width], self._min[-1][width:]))
+            width *= 2
+
+    def next_at_least(self, start, level):
+        """start及之后第一个 >= level 的位置，没有时返回n"""
+        pos = start
+        for k in range(len(self._max) - 1, -1, -1):
+            table = self._max[k]
+            # 跳过整段都低于level的区间
+            if pos < len(table) and table[pos] < level:
+                pos += 1 << k
+        return min(pos, self.n)
+
+    def next_at_most(self, start, level):
+        """start及之后第一个 <= level 的位置，没有时返回n"""
+        pos = start
+        for k in range(len(self._min) - 1, -1, -1):
+            table = self._min[k]
+            if pos < len(table) and table[pos] > level:
+                pos += 1 << k
+        return min(pos, self.n)
+
+
+def ladder_settings(spacing, max_lots) -> pd.DataFrame:
+    """
+    梯度参数的全部组合
+    :param spacing: 档位间距，一个数或数组
+    :param max_lots: 最多持有的档数，一个数或数组
+    :return: DataFrame，每行对应一个run_id
+    """
+    combos = list(itertools.product(np.atleast_1d(spacing), np.atleast_1d(max_lots)))
+    return pd.DataFrame({
+        'run_id': np.arange(len(combos)),
+        'spacing': [float(s) for s, _ in combos],
+        'max_lots': [int(k) for _, k in combos],
+    })
+
+
+def _free_lot(sells):
+    """未被持有的最小档位编号"""
+    held = {lot for _, lot, _ in sells}
+    return next(lot for lot in itertools.count(1) if lot not in held)
+
+
+def _run_ladder(index, values, spacing, max_lots, profit, anchor):
+    """
+    单组参数的梯度交易，只在触发价位的K线上处理事件。
+    待成交的买入价位放在大顶堆中，已持有各档的卖出价位放在小顶堆中，每次成交O(log K)。
+    :return: [(档位, 买入K线, 卖出K线)]，最后仍持有的档位卖出K线为-1
+    """
+    lots = []
+    sells = []
+    n = len(values)
+    if anchor == 'ma':
+        # 第k档在 收盘/MA <= 1 - k×spacing 时买入，回升profit后卖出，卖出后该档重新挂单
+        buys = [(-(1 - k * spacing), k) for k in range(1, max_lots + 1)]
+        heapq.heapify(buys)
+        pos = 0
+    else:
+        # 以第一根K线收盘价为参考，每次成交后在成交价下方spacing处挂下一档买单，
+        # 档位在成交时取未被持有的最小编号，与同时持有的其他档不重复
+        valid = np.flatnonzero(~np.isnan(values))
+        if len(valid) == 0:
+            return lots
+        pos = int(valid[0]) + 1
+        buys = [(-values[valid[0]] * (1 - spacing), 0)]
+
+    while pos < n:
+        next_sell = index.next_at_least(pos, sells[0][0]) if sells else n
+        next_buy = index.next_at_most(pos, -buys[0][0]) if buys and len(sells) < max_lots else n
+        bar = min(next_sell, next_buy)
+        if bar >= n:
+            break
+        value = values[bar]
+        while sells and sells[0][0] <= value:
+            _, lot, entry = heapq.heappop(sells)
+            lots.append((lot, entry, bar))
+            if anchor == 'ma':
+                heapq.heappush(buys, (-(1 - lot * spacing), lot))
+            else:
+                buys = [(-value * (1 - spacing), 0)]
+        while buys and len(sells) < max_lots and -buys[0][0] >= value:
+            neg_level, lot = heapq.heappop(buys)
+            if anchor == 'ma':
+                heapq.heappush(sells, (-neg_level + profit, lot, bar))
+            else:
+                heapq.heappush(sells, (value * (1 + profit), _free_lot(sells), bar))
+                buys = [(-value * (1 - spacing), 0)]
+        pos = bar + 1
+
+    lots.extend((lot, entry, -1) for _, lot, entry in sells)
+    return lots
+
+
+def ladder_lots(values, settings, anchor='ma', profit=None):
+    """
+    对所有参数组运行梯度交易，稀疏表只构建一次，所有参数组共用
+    :param values: 触发价位所比较的序列，anchor为'ma'时为收盘/MA，为'last_fill'时为收盘价
+    :param settings: ladder_settings的结果
+    :param anchor: 'ma'或'last_fill'
+    :param profit: 每档的止盈幅度，默认等于spacing
+    :return: (run_id, 档位, 买入K线, 卖出K线)数组，按run_id、买入K线、档位排序，最后仍持有的卖出K线为-1
+    """
+    if anchor not in ('ma', 'last_fill'):
+        raise ValueError("anchor必须是'ma'或'last_fill'")
+    index = _CrossingIndex(values)
+    rows = []
+    for run_id, spacing, max_lots in settings[['run_id', 'spacing', 'max_lots']].itertuples(index=False):
+        run_profit = spacing if profit is None else profit
+        for lot, entry, exit_bar in _run_ladder(index, values, spacing, max_lots, run_profit, anchor):
+            rows.append((run_id, lot, entry, exit_bar))
+    if not rows:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    run_ids, lots, entries, exits = (np.asarray(col, dtype=np.int64) for col in zip(*rows))
+    order = np.lexsort((lots, entries, run_ids))
+    return run_ids[order], lots[order], entries[order], exits[order]
+
+
+def _lot_trades(signals, run_ids, lots, entries, exits) -> pd.DataFrame:
+    """将ladder_lots的结果转换为交易记录，最后仍持有的档位不计入"""
+    close = signals['收盘'].to_numpy(dtype=np.float64)
+    ratio = signals['收盘/MA'].to_numpy(dtype=np.float64)
+    dates = signals['日期'].to_numpy()
+    closed = exits >= 0
+    run_ids, lots, entries, exits = run_ids[closed], lots[closed], entries[closed], exits[closed]
+
+    columns = ['run_id', '档位', '买入日期', '买入价格', '买入时收盘/MA指标', '卖出日期', '卖出价格',
+               '卖出时收盘/MA指标', '收益率', '最大收益率', '回撤率']
+    if len(entries) == 0:
+        return pd.DataFrame(columns=columns)
+    entry_price, exit_price = close[entries], close[exits]
+    max_price = range_max(close)(entries, exits)
+    return pd.DataFrame({
+        'run_id': run_ids,
+        '档位': lots,
+        '买入日期': dates[entries],
+        '买入价格': entry_price,
+        '买入时收盘/MA指标': ratio[entries],
+        '卖出日期': dates[exits],
+        '卖出价格': exit_price,
+        '卖出时收盘/MA指标': ratio[exits],
+        '收益率': (exit_price / entry_price - 1) * 100,
+        '最大收益率': (max_price / entry_price - 1) * 100,
+        '回撤率': (exit_price / max_price - 1) * 100,
+    }, columns=columns)
+
+
+def _trigger_values(signals, anchor):
+    return signals['收盘/MA' if anchor == 'ma' else '收盘'].to_numpy(dtype=np.float64)
+
+
+def apply_ladder(signals, settings, anchor='ma', profit=None) -> pd.DataFrame:
+    """
+    梯度交易的交易记录，每档一笔，最后仍持有的档位不计入
+    :param signals: DataFrame，包含'日期'、'收盘'和'收盘/MA'列
+    :param settings: ladder_settings的结果
+    :param anchor: 'ma'时价位为收盘/MA的 1 - k×spacing，'last_fill'时价位相对上一次成交价
+    :param profit: 每档的止盈幅度，默认等于spacing
+    :return: DataFrame，字段与单仓位策略的交易记录一致，另有run_id和档位列，可直接用于get_batch_performance_summary
+    """
+    values = _trigger_values(signals, anchor)
+    return _lot_trades(signals, *ladder_lots(values, settings, anchor, profit))
+
+
+class LadderStrategy:
+    """
+    分档做差价：价格每下跌一档买入一份，每份在各自的止盈价位卖出，最多同时持有max_lots份。
+    价位可以相对MA（收盘/MA跌破 1 - k×spacing 买入第k档），也可以相对上一次成交价。
+    """
+
+    def __init__(self, spacing=0.02, max_lots=5, anchor='ma', profit=None, period='W', ma_period=10):
+        """
+        :param spacing: 档位间距，如0.02表示每跌2%买入一档，可以是数组，用于sweep
+        :param max_lots: 最多持有的档数，可以是数组，用于sweep
+        :param anchor: 'ma'或'last_fill'
+        :param profit: 每档的止盈幅度，默认等于spacing；anchor为'ma'时以收盘/MA计
+        :param period: 周期, 'D'表示日线，'W'表示周线，'M'表示月线
+        :param ma_period: MA周期
+        """
+        self.spacing = spacing
+        self.max_lots = max_lots
+        self.anchor = anchor
+        self.profit = profit
+        self.period = period
+        self.ma_period = ma_period
+        self.new_feature_columns = [f'MA{ma_period}']
+        self.new_indicator_columns = ['收盘/MA']
+
+    def _process_data(self, stock_data, start_date=None, end_date=None):
+        processed_stock = (stock_data
+            .filter_by_date(start_date, end_date)
+            .aggregate_by_period(self.period)
+            .calculate_ma([self.ma_period]))
+
+        df = processed_stock.df.copy()
+        df['收盘/MA'] = df['收盘'] / df[f'MA{self.ma_period}']
+        return df
+
+    def apply_strategy(self, stock_data, start_date=None, end_date=None):
+        """
+        运行单组参数（spacing和max_lots为数组时取第一个值）
+        :param stock_data: StockData对象
+        :return: (processed_df, 包含'持仓档数'列的DataFrame, trades)
+        """
+        processed_df = self._process_data(stock_data, start_date, end_date)
+        settings = ladder_settings(self.spacing, self.max_lots).iloc[:1]
+        values = _trigger_values(processed_df, self.anchor)
+        run_ids, lots, entries, exits = ladder_lots(values, settings, self.anchor, self.profit)
+        trades = _lot_trades(processed_df, run_ids, lots, entries, exits).drop(columns='run_id')
+        # 每根K线收盘后持有的档数：买入K线起+1，卖出K线起-1
+        n = len(values)
+        changes = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(changes, entries, 1)
+        np.add.at(changes, np.where(exits < 0, n, exits), -1)
+        holdings = processed_df[['日期', '收盘', '收盘/MA']].copy()
+        holdings['持仓档数'] = np.cumsum(changes)[:n]
+        return processed_df, holdings, trades
+
+    def sweep(self, stock_data, start_date=None, end_date=None):
+        """
+        对spacing和max_lots的全部组合回测，指标只计算一次
+        :return: (settings, trades)，trades可直接用于get_batch_performance_summary
+        """
+        processed_df = self._process_data(stock_data, start_date, end_date)
+        settings = ladder_settings(self.spacing, self.max_lots)
+        return settings, apply_ladder(processed_df, settings, self.anchor, self.profit)
+
+
+# 使用示例：周线收盘/MA10每跌一档买入一份，扫描档位间距和档数
+if __name__ == '__main__':
+    from stock_data import StockData
+    from strategy_analyzer import get_batch_performance_summary
+
+    stock_data = StockData('601288', '农业银行', offline=True)
+    _, holdings, trades = LadderStrategy(0.02, 5).apply_strategy(stock_data, '2014-01-01')
+    print(trades.tail(10))
+    print(f"最多同时持有{holdings['持仓档数'].max()}档")
+
+    strategy = LadderStrategy(spacing=np.linspace(0.01, 0.05, 9), max_lots=[1, 2, 3, 5, 8])
+    settings, trades = strategy.sweep(stock_data, '2014-01-01')
+    summary = settings.join(get_batch_performance_summary(trades, run_ids=settings['run_id']), on='run_id')
+    print(summary.sort_values('total_return', ascending=False).head(10))
@@ -1,158 +1,182 @@
-from strategy_analyzer import get_performance_summary
-from strategy_generator import MAStrategy, KDJStrategy, MACDStrategy
-from stock_data import StockData
-from chart import TradeChart, IndicatorDistributionChart
+import time
+
+_START_TIME = time.perf_counter()
+
 import argparse
+import os
+import sys
+from strategy_analyzer import get_performance_summary, get_signal_performance
+from strategy_generator import MAStrategy, KDJStrategy, MACDStrategy, ADXStrategy
+from stock_data import StockData
 
+# 基础模块的导入耗时，matplotlib和akshare只在绘图和下载时才导入
+BASE_IMPORT_SECONDS = time.perf_counter() - _START_TIME
 
-class TestMAArgs:
-    """用于测试的参数类"""
-    def __init__(self):
-        self.stock_code = '601288'
-        self.stock_name = '农业银行'
-        # self.stock_code = '600900'
-        # self.stock_name = '长江电力'
-        self.start_date = '2014-01-01'
-        self.end_date = None
-        self.ratio1 = 1.00
-        self.ratio2 = 1.03
-        self.period = 'W'
-        self.ma_period = 10
-
-
-class TestKDJArgs:
-    """用于测试的参数类"""
-    def __init__(self):
-        self.stock_code = '601288'
-        self.stock_name = '农业银行'
-        self.start_date = '2014-01-01'
-        self.end_date = None
-        self.n = 9
-        self.m1 = 3
-        self.m2 = 3
-        self.period = 'W'
-
-
-class TestMACDArgs:
-    """用于测试的参数类"""
-    def __init__(self):
-        self.stock_code = '601288'
-        self.stock_name = '农业银行'
-        self.start_date = '2014-01-01'
-        self.end_date = None
-        self.fast_period = 12
-        self.slow_period = 26
-        self.signal_period = 9
-        self.period = 'W'
-
-def parse_args():
-    parser = argparse.ArgumentParser(description='股票交易策略分析工具')
-    
-    # 必需参数
-    parser.add_argument('--stock-code', 
-                       type=str, 
-                       required=True,
-                       help='股票代码，例如: 601288')
-    
-    parser.add_argument('--stock-name', 
-                       type=str, 
-                       required=True,
-                       help='股票名称，例如: 农业银行')
-    
-    # 可选参数
-    parser.add_argument('--start-date', 
-                       type=str, 
-                       default='2018-01-01',
-                       help='开始日期，格式：YYYY-MM-DD，默认：2018-01-01')
-    
-    parser.add_argument('--end-date', 
-                       type=str, 
-                       default=None,
-                       help='结束日期，格式：YYYY-MM-DD，默认：None（至今）')
-    
-    parser.add_argument('--ratio1', 
-                       type=float, 
-                       default=1.00,
-                       help='买入阈值，默认：1.00')
-    
-    parser.add_argument('--ratio2', 
-                       type=float, 
-                       default=1.05,
-                       help='卖出阈值，默认：1.05')
-    
-    parser.add_argument('--period', 
-                       type=str, 
+DEFAULT_STOCK_CODES = {
+    '601398': '工商银行',
+    '601939': '建设银行',
+    '601288': '农业银行',
+    '601988': '中国银行',
+    '601328': '交通银行',
+}
+
+
+def build_strategy(args):
+    if args.strategy == 'ma':
+        return MAStrategy(args.ratio1, args.ratio2, args.period, args.ma_period)
+    if args.strategy == 'kdj':
+        return KDJStrategy(args.n, args.m1, args.m2, args.period)
+    if args.strategy == 'adx':
+        return ADXStrategy(args.adx_period, args.adx_threshold, args.period)
+    return MACDStrategy(args.fast_period, args.slow_period, args.signal_period, args.period)
+
+
+def add_strategy_arguments(parser):
+    parser.add_argument('--strategy',
+                       type=str,
+                       choices=['ma', 'kdj', 'macd', 'adx'],
+                       default='ma',
+                       help='策略，默认：ma')
+
+    parser.add_argument('--period',
+                       type=str,
                        choices=['D', 'W', 'M'],
                        default='W',
                        help='周期，D=日线，W=周线，M=月线，默认：W')
-    
-    parser.add_argument('--ma-period', 
-                       type=int, 
-                       default=5,
-                       help='移动平均周期，默认：5')
-    
-    parser.add_argument('--indicator-name',
-                       type=str,
-                       default=None,
-                       help='指标名称，默认：根据ma-period自动生成')
-    
-    args = parser.parse_args()
-    
-    # 如果没有提供indicator_name，则自动生成
-    if args.indicator_name is None:
-        args.indicator_name = f'当前价格/MA{args.ma_period}'
-    
-    return args
-
-
-def test_ma():
-    args = TestMAArgs()
-    strategy = MAStrategy(args.ratio1, args.ratio2, args.period, args.ma_period)
-    stock_data = StockData(args.stock_code, args.stock_name)
-
-    df, signals, trades = strategy.apply_strategy(stock_data, args.start_date, args.end_date)
-    
-    print("\n交易记录：")
-    print(trades)
-    
-    # 打印策略表现
-    print("\n策略表现：")
-    summary = get_performance_summary(trades)
-    print(f"总交易次数: {summary['total_trades']}")
-    print(f"胜率: {summary['win_rate']:.2f}%")
-    print(f"平均收益率: {summary['avg_return']:.2f}%")
-    print(f"总收益率: {summary['total_return']:.2f}%")
-    print(f"最大单笔收益: {summary['max_return']:.2f}%")
-    print(f"最小单笔收益: {summary['min_return']:.2f}%")
-    print(f"平均持仓周数: {summary['avg_hold_weeks']:.1f}")
-    print(f"平均回撤率: {summary['avg_drawdown']:.2f}%")
-    print(f"最大回撤率: {summary['max_drawdown']:.2f}%")
 
-    # 绘制交易图表
-    trade_chart = TradeChart(df, trades, strategy.new_indicator_columns, args).plot()
-    trade_chart.show()
+    parser.add_argument('--ratio1',
+                       type=float,
+                       default=1.00,
+                       help='MA策略买入阈值，默认：1.00')
 
-    new_indicators = strategy.new_indicator_columns
-    distribution_chart = IndicatorDistributionChart(df, new_indicators[0], args).plot()
-    # (IndicatorDistributionChart(df, new_indicators[0], args)
-    #             .plot_histogram()
-    #             .add_statistics()
-    #             .set_chart_properties())
-    distribution_chart.show()
-
-def test_kdj():
-    args = TestKDJArgs()
-    strategy = KDJStrategy(args.n, args.m1, args.m2, args.period)
-    stock_data = StockData(args.stock_code, args.stock_name)
-
-    df, signals, trades = strategy.apply_strategy(stock_data, args.start_date, args.end_date)
-    
-    print("\n交易记录：")
-    print(trades)
-    
-    # 打印策略表现
-    print("\n策略表现：")
-    summary = get_performance_summary(trades)
+    parser.add_argument('--ratio2',
+                       type=float,
+                       default=1.03,
+                       help='MA策略卖出阈值，默认：1.03')
+
+    parser.add_argument('--ma-period',
+                       type=int,
+                       default=10,
+                       help='移动平均周期，默认：10')
+
+    parser.add_argument('--n', type=int, default=9, help='KDJ的RSV周期，默认：9')
+    parser.add_argument('--m1', type=int, default=3, help='KDJ的K值周期，默认：3')
+    parser.add_argument('--m2', type=int, default=3, help='KDJ的D值周期，默认：3')
+    parser.add_argument('--fast-period', type=int, default=12, help='MACD快速EMA周期，默认：12')
+    parser.add_argument('--slow-period', type=int, default=26, help='MACD慢速EMA周期，默认：26')
+    parser.add_argument('--signal-period', type=int, default=9, help='MACD信号线周期，默认：9')
+    parser.add_argument('--adx-period', type=int, default=14, help='ADX和DI的周期，默认：14')
+    parser.add_argument('--adx-threshold', type=float, default=20, help='ADX策略买入时ADX的最低值，默认：20')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='股票交易策略分析工具')
+    parser.add_argument('--timing',
+                       action='store_true',
+                       help='打印导入耗时和总耗时')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # 回测
+    backtest = subparsers.add_parser('backtest', help='回测单只股票的交易策略')
+    backtest.add_argument('--stock-code',
+                         type=str,
+                         default='601288',
+                         help='股票代码，默认：601288')
+
+    backtest.add_argument('--stock-name',
+                         type=str,
+                         default='农业银行',
+                         help='股票名称，默认：农业银行')
+
+    backtest.add_argument('--start-date',
+                         type=str,
+                         default='2014-01-01',
+                         help='开始日期，格式：YYYY-MM-DD，默认：2014-01-01')
+
+    backtest.add_argument('--end-date',
+                         type=str,
+                         default=None,
+                         help='结束日期，格式：YYYY-MM-DD，默认：None（至今）')
+
+    backtest.add_argument('--offline',
+                         action='store_true',
+                         help='离线模式，只使用本地数据，从不下载')
+
+    backtest.add_argument('--cache-dir',
+                         type=str,
+                         default=None,
+                         help='回测结果缓存目录，提供时复用数据和参数都未变化的结果')
+
+    backtest.add_argument('--no-plot',
+                         action='store_true',
+                         help='不绘图，不导入matplotlib')
+
+    backtest.add_argument('--save-dir',
+                         type=str,
+                         default=None,
+                         help='图表保存目录，提供时保存图表而不显示')
+    add_strategy_arguments(backtest)
+
+    # 扫描
+    scan = subparsers.add_parser('scan', help='扫描全市场的最新交易信号')
+    scan.add_argument('--data-dir',
+                     type=str,
+                     default='resource/stock_price',
+                     help='股价数据目录，默认：resource/stock_price')
+
+    scan.add_argument('--panel-dir',
+                     type=str,
+                     default=None,
+                     help='面板目录，提供时从内存映射面板读取')
+
+    scan.add_argument('--recent-bars',
+                     type=int,
+                     default=1,
+                     help='检查最近几根K线上的信号，默认：1')
+
+    scan.add_argument('--workers',
+                     type=int,
+                     default=None,
+                     help='进程数，默认：CPU核数')
+    add_strategy_arguments(scan)
+
+    # 数据检查
+    check = subparsers.add_parser('check', help='检查股价数据的完整性')
+    check.add_argument('--data-dir',
+                      type=str,
+                      default='resource/stock_price',
+                      help='股价数据目录，默认：resource/stock_price')
+
+    check.add_argument('--report-dir',
+                      type=str,
+                      default='resource/integrity',
+                      help='报告目录，默认：resource/integrity')
+
+    check.add_argument('--quarantine',
+                      action='store_true',
+                      help='将有错误的文件移动到数据目录下的quarantine目录')
+
+    check.add_argument('--workers',
+                      type=int,
+                      default=None,
+                      help='进程数，默认：CPU核数')
+
+    # 下载
+    download = subparsers.add_parser('download', help='下载股价数据')
+    download.add_argument('--stock-codes',
+                         type=str,
+                         nargs='+',
+                         default=list(DEFAULT_STOCK_CODES),
+                         help='股票代码列表，默认：五大国有银行')
+
+    download.add_argument('--force',
+                         action='store_true',
+                         help='强制更新，即使数据已是最新')
+
+    return parser.parse_args(argv)
+
+
+def print_summary(summary, metrics):
     print(f"总交易次数: {summary['total_trades']}")
     print(f"胜率: {summary['win_rate']:.2f}%")
     print(f"平均收益率: {summary['avg_return']:.2f}%")
@@ -162,67 +186,136 @@ def test_kdj():
     print(f"平均持仓周数: {summary['avg_hold_weeks']:.1f}")
     print(f"平均回撤率: {summary['avg_drawdown']:.2f}%")
     print(f"最大回撤率: {summary['max_drawdown']:.2f}%")
+    print(f"净值最大回撤: {metrics['max_drawdown']:.2f}%")
+    print(f"年化收益率: {metrics['annual_return']:.2f}%")
+    print(f"夏普比率: {metrics['sharpe']:.2f}")
+    print(f"索提诺比率: {metrics['sortino']:.2f}")
+    print(f"持仓时间占比: {metrics['exposure']:.2f}%")
+    if metrics['open_position']:
+        print(f"未平仓浮动收益: {metrics['open_return']:.2f}%")
+
+
+def plot_backtest(args, strategy, df, trades):
+    # matplotlib导入较慢，只在绘图时导入
+    from chart import TradeChart, IndicatorDistributionChart
+
+    def render(chart, file_name):
+        with chart:
+            if args.save_dir:
+                os.makedirs(args.save_dir, exist_ok=True)
+                chart.save(os.path.join(args.save_dir, file_name))
+            else:
+                chart.show()
 
     new_indicators = strategy.new_indicator_columns
-    # 绘制交易图表
     trade_chart = (TradeChart(df, trades, new_indicators, args)
                 .plot_price_line()
                 .plot_trade_points()
                 .set_price_chart_properties()
-                .plot_indicator_line()
-                .plot_indicator_points()
-                .set_indicator_chart_properties())
-
-    trade_chart.show()
+                .plot_indicator_line())
+    if args.strategy == 'ma':
+        trade_chart.plot_threshold_lines()
+    (trade_chart
+        .plot_indicator_points()
+        .set_indicator_chart_properties())
+    render(trade_chart, 'trade_chart.png')
 
     distribution_chart = (IndicatorDistributionChart(df, new_indicators[0], args)
-                .plot_histogram()
-                .add_statistics()
-                .set_chart_properties())
-    distribution_chart.show()
-
-def test_macd():
-    args = TestMACDArgs()
-    strategy = MACDStrategy(args.fast_period, args.slow_period, args.signal_period, args.period)
-    stock_data = StockData(args.stock_code, args.stock_name)
-
-    df, signals, trades = strategy.apply_strategy(stock_data, args.start_date, args.end_date)
-    
+                .plot_histogram())
+    if args.strategy == 'ma':
+        distribution_chart.plot_threshold_lines()
+    (distribution_chart
+        .add_statistics()
+        .set_chart_properties())
+    render(distribution_chart, 'distribution_chart.png')
+
+
+def run_backtest(args):
+    strategy = build_strategy(args)
+    stock_data = StockData(args.stock_code, args.stock_name, offline=args.offline)
+
+    if args.cache_dir:
+        from result_cache import BacktestCache
+
+        cache = BacktestCache(args.cache_dir)
+        df, signals, trades, summary = cache.apply_strategy(strategy, stock_data, args.start_date, args.end_date)
+        cache.flush()
+    else:
+        df, signals, trades = strategy.apply_strategy(stock_data, args.start_date, args.end_date)
+        summary = get_performance_summary(trades)
+
     print("\n交易记录：")
     print(trades)
-    
+
     # 打印策略表现
     print("\n策略表现：")
-    summary = get_performance_summary(trades)
-    print(f"总交易次数: {summary['total_trades']}")
-    print(f"胜率: {summary['win_rate']:.2f}%")
-    print(f"平均收益率: {summary['avg_return']:.2f}%")
-    print(f"总收益率: {summary['total_return']:.2f}%")
-    print(f"最大单笔收益: {summary['max_return']:.2f}%")
-    print(f"最小单笔收益: {summary['min_return']:.2f}%")
-    print(f"平均持仓周数: {summary['avg_hold_weeks']:.1f}")
-    print(f"平均回撤率: {summary['avg_drawdown']:.2f}%")
-    print(f"最大回撤率: {summary['max_drawdown']:.2f}%")
+    _, metrics = get_signal_performance(signals, args.period)
+    print_summary(summary, metrics)
 
-    new_indicators = strategy.new_indicator_columns
-    # 绘制交易图表
-    trade_chart = (TradeChart(df, trades, new_indicators, args)
-                .plot_price_line()
-                .plot_trade_points()
-                .set_price_chart_properties()
-                .plot_indicator_line()
-                .plot_indicator_points()
-                .set_indicator_chart_properties())
+    if not args.no_plot:
+        plot_backtest(args, strategy, df, trades)
 
-    trade_chart.show()
 
-    distribution_chart = (IndicatorDistributionChart(df, new_indicators[0], args)
-                .plot_histogram()
-                .add_statistics()
-                .set_chart_properties())
-    distribution_chart.show()
+def run_scan(args):
+    from signal_scanner import SignalScanner
+
+    scanner = SignalScanner([build_strategy(args)], args.data_dir, args.panel_dir,
+                            recent_bars=args.recent_bars, max_workers=args.workers)
+    result = scanner.scan()
+    if len(result) == 0:
+        print("没有扫描到信号")
+    else:
+        print(result.to_string(index=False))
+
+
+def run_check(args):
+    from data_integrity import CHECKS, IntegrityScanner
+
+    scanner = IntegrityScanner(args.data_dir, max_workers=args.workers)
+    summary, issues = scanner.scan()
+    print(summary[['股票代码', '状态', 'K线数', '开始日期', '结束日期', '价格小数位']].to_string(index=False))
+    if not summary['日历检查'].all():
+        print("\n警告：没有交易所日历，未检查缺失的交易日和非交易日")
+    counts = summary.set_index('股票代码')[list(CHECKS)]
+    if counts.to_numpy().any():
+        print("\n问题K线数：")
+        print(counts.loc[:, counts.sum() > 0])
+    summary_path, issues_path = scanner.write_report(summary, issues, args.report_dir)
+    print(f"\n报告已保存：{summary_path}，{issues_path}")
+    if args.quarantine:
+        moved = scanner.quarantine(summary)
+        print(f"已隔离：{', '.join(moved)}" if moved else "没有需要隔离的文件")
+    return not (summary['状态'] == 'error').any()
+
+
+def run_download(args):
+    from stock_data_downloader import StockDownloader
+
+    stock_codes = {code: DEFAULT_STOCK_CODES.get(code, '') for code in args.stock_codes}
+    results = StockDownloader().download_multiple_stocks(stock_codes, force_update=args.force)
+    for code, success in results.items():
+        status = "成功" if success else "失败"
+        print(f"股票 {code} ({stock_codes[code]}) 下载{status}")
+    return all(results.values())
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    commands = {'backtest': run_backtest, 'scan': run_scan, 'check': run_check, 'download': run_download}
+    try:
+        result = commands[args.command](args)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"错误：{e}")
+        return 1
+
+    if args.timing:
+        heavy_modules = [name for name in ('matplotlib', 'akshare') if name in sys.modules]
+        print(f"\n基础模块导入耗时: {BASE_IMPORT_SECONDS * 1000:.1f} ms")
+        print(f"已导入的重型模块: {', '.join(heavy_modules) if heavy_modules else '无'}")
+        print(f"总耗时: {(time.perf_counter() - _START_TIME) * 1000:.1f} ms")
+    return 0 if result is not False else 1
 
 
-# 使用示例
+# 使用示例: python main.py backtest --strategy macd --no-plot
 if __name__ == '__main__':
-    test_macd()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from stock_data import StockData
+
+
+class PartitionedPriceStore:
+    """
+    按股票和年份分区的压缩列式股价存储，目录结构为 root/股票代码/年份.npz，
+    每个分区中每列单独压缩保存，读取时只打开日期范围覆盖的年份，只解压需要的列。
+    """
+
+    def __init__(self, root: str = "resource/price_store"):
+        """
+        :param root: 存储根目录
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _symbol_dir(self, stock_code: str) -> str:
+        return os.path.join(self.root, stock_code)
+
+    def _partition_path(self, stock_code: str, year: int) -> str:
+        return os.path.join(self._symbol_dir(stock_code), f"{year}.npz")
+
+    def _meta_path(self, stock_code: str) -> str:
+        return os.path.join(self._symbol_dir(stock_code), 'meta.json')
+
+    @staticmethod
+    def _tmp_path(path: str) -> str:
+        # 多个进程或线程可能同时写同一只股票，临时文件名各不相同
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def symbols(self) -> list:
+        """已保存的股票代码列表"""
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(self._meta_path(name)))
+
+    def years(self, stock_code: str) -> list:
+        """股票已保存的年份分区列表"""
+        directory = self._symbol_dir(stock_code)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(name[:-len('.npz')]) for name in os.listdir(directory) if name.endswith('.npz'))
+
+    def _load_meta(self, stock_code: str) -> dict:
+        meta_path = self._meta_path(stock_code)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"存储中没有股票 {stock_code} 的数据")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _build_meta(df: pd.DataFrame) -> dict:
+        constants = {}
+        for col in df.columns:
+            # 每行都相同的列（如股票代码）只保存一次
+            if col != '日期' and len(df) > 0 and (df[col] == df[col].iloc[0]).all():
+                value = df[col].iloc[0]
+                constants[col] = value.item() if hasattr(value, 'item') else value
+        return {
+            'columns': list(df.columns),
+            'dtypes': {col: str(df[col].dtype) for col in df.columns if col != '日期'},
+            'constants': constants,
+        }
+
+    def _save_meta(self, stock_code: str, meta: dict):
+        tmp_path = self._tmp_path(self._meta_path(stock_code))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(stock_code))
+
+    def _write_partition(self, stock_code: str, year: int, df: pd.DataFrame, meta: dict):
+        arrays = {'日期': pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]').astype(np.int32)}
+        for col in meta['columns']:
+            if col != '日期' and col not in meta['constants']:
+                arrays[col] = df[col].to_numpy()
+        path = self._partition_path(stock_code, year)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def _read_partition(self, stock_code: str, year: int, columns: list) -> dict:
+        with np.load(self._partition_path(stock_code, year)) as data:
+            return {col: data[col] for col in columns if col in data.files}
+
+    def write(self, stock_code: str, df: pd.DataFrame):
+        """
+        覆盖保存一只股票的全部数据。新分区逐个替换旧分区，写完后才删除不再有数据的年份，
+        写入中断或同时读取时不会看到被截断的历史
+        :param stock_code: 股票代码
+        :param df: 原始行情DataFrame，必须包含'日期'列
+        """
+        df = df.copy()
+        df['日期'] = pd.to_datetime(df['日期'])
+        df = df.sort_values('日期').reset_index(drop=True)
+        os.makedirs(self._symbol_dir(stock_code), exist_ok=True)
+        old_years = self.years(stock_code)
+        meta = self._build_meta(df)
+        new_years = set()
+        for year, part in df.groupby(df['日期'].dt.year):
+            self._write_partition(stock_code, int(year), part, meta)
+            new_years.add(int(year))
+        # 分区写完后才保存元数据，新股票在有数据之后才出现在symbols中
+        self._save_meta(stock_code, meta)
+        for year in old_years:
+            if year not in new_years:
+                os.remove(self._partition_path(stock_code, year))
+
+    def append(self, stock_code: str, df: pd.DataFrame):
+        """
+        追加新数据，只重写新数据所在的年份分区，日期重复时以新数据为准
+        :param stock_code: 股票代码
+        :param df: 新的行情DataFrame
+        """
+        if not os.path.exists(self._meta_path(stock_code)):
+            self.write(stock_code, df)
+            return
+        meta = self._load_meta(stock_code)
+        df = df.copy()
+        df['日期'] = pd.to_datetime(df['日期'])
+        changed = [col for col, value in meta['constants'].items() if col in df.columns and (df[col] != value).any()]
+        if changed or list(df.columns) != meta['columns']:
+            # 列结构或常量列发生变化时重写全部分区
+            merged = pd.concat([self.read(stock_code), df], ignore_index=True)
+            self.write(stock_code, merged.drop_duplicates('日期', keep='last'))
+            return
+        for year, part in df.groupby(df['日期'].dt.year):
+            year = int(year)
+            if os.path.exists(self._partition_path(stock_code, year)):
+                existing = self.read(stock_code, f"{year}-01-01", f"{year}-12-31")
+                part = pd.concat([existing, part], ignore_index=True)
+                part = part.drop_duplicates('日期', keep='last')
+            part = part.sort_values('日期').reset_index(drop=True)
+            self._write_partition(stock_code, year, part, meta)
+
+    def read(self, stock_code: str, start_date=None, end_date=None, columns: list = None) -> pd.DataFrame:
+        """
+        读取日期范围内的数据，只打开范围覆盖的年份分区
+        :param stock_code: 股票代码
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :param columns: 读取的列，默认为全部列
+        :return: 与原始CSV列顺序一致的DataFrame
+        """
+        meta = self._load_meta(stock_code)
+        columns = [col for col in (columns or meta['columns']) if col in meta['columns']]
+        if '日期' not in columns:
+            columns = ['日期'] + columns
+        start = pd.Timestamp(start_date) if start_date else None
+        end = pd.Timestamp(end_date) if end_date else None
+        years = [year for year in self.years(stock_code)
+                 if (start is None or year >= start.year) and (end is None or year <= end.year)]
+
+        parts = [self._read_partition(stock_code, year, columns) for year in years]
+        stored = [col for col in columns if col not in meta['constants']]
+        data = {col: np.concatenate([part[col] for part in parts]) if parts
+                else np.array([], dtype=meta['dtypes'].get(col, 'int32')) for col in stored}
+        df = pd.DataFrame({'日期': pd.to_datetime(data['日期'].astype('datetime64[D]'))})
+        for col in columns:
+            if col == '日期':
+                continue
+            if col in meta['constants']:
+                df[col] = pd.Series([meta['constants'][col]] * len(df), dtype=meta['dtypes'][col])
+            else:
+                df[col] = data[col]
+
+        mask = np.ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= (df['日期'] >= start).to_numpy()
+        if end is not None:
+            mask &= (df['日期'] <= end).to_numpy()
+        return df[mask].reset_index(drop=True)
+
+    def get_stock_data(self, stock_code: str, name: str = '', start_date=None, end_date=None) -> StockData:
+        """
+        读取日期范围内的数据并创建紧凑模式的StockData对象
+        :param stock_code: 股票代码
+        :param name: 股票名称
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :return: StockData对象
+        """
+        df = self.read(stock_code, start_date, end_date)
+        return StockData.from_columns(stock_code, name, StockData.compact_columns(df))
+
+    def last_date(self, stock_code: str):
+        """股票最后一根K线的日期，没有数据时返回None"""
+        years = self.years(stock_code)
+        if not years:
+            return None
+        days = self._read_partition(stock_code, years[-1], ['日期'])['日期']
+        return pd.Timestamp(days.max().astype('datetime64[D]')) if len(days) else None
+
+    def import_csv(self, data_dir: str = "resource/stock_price") -> list:
+        """
+        从CSV目录导入全部股票
+        :param data_dir: CSV数据目录
+        :return: 导入的股票代码列表
+        """
+        imported = []
+        for file_name in sorted(os.listdir(data_dir)):
+            if not file_name.endswith('.csv'):
+                continue
+            stock_code = file_name[:-len('.csv')]
+            df = pd.read_csv(os.path.join(data_dir, file_name), dtype={'股票代码': str})
+            self.write(stock_code, df)
+            imported.append(stock_code)
+        return imported
+
+    def export_csv(self, stock_code: str, file_path: str):
+        """
+        导出为原有的CSV格式
+        :param stock_code: 股票代码
+        :param file_path: CSV文件路径
+        """
+        df = self.read(stock_code)
+        df['日期'] = df['日期'].dt.strftime('%Y-%m-%d')
+        df.to_csv(file_path, index=False, encoding='utf-8')
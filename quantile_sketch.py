@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from stock_processor import StockDataProcessor
+
+# 全市场汇总使用的股票代码
+UNIVERSE = '*'
+
+
+class TDigest:
+    """
+    可合并的t-digest分位数草图，用有限个质心近似一组数值的分布，
+    两端质心更小，10%/90%这类尾部分位数误差更低。
+    """
+
+    def __init__(self, compression: float = 200):
+        """
+        :param compression: 压缩参数，质心数量不超过约compression个，越大越精确
+        """
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._cumulative = None
+
+    @property
+    def count(self) -> float:
+        self._flush()
+        return float(self.weights.sum())
+
+    def update(self, values):
+        """
+        加入一批数值，NaN会被忽略
+        :param values: 数值数组
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buffer.append(values)
+        self._cumulative = None
+        if sum(len(b) for b in self._buffer) > 10 * self.compression:
+            self._flush()
+        return self
+
+    def merge(self, other: 'TDigest'):
+        """将另一个草图合并到当前草图"""
+        other._flush()
+        if len(other.means) == 0:
+            return self
+        self._flush()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]),
+                       np.concatenate([self.weights, other.weights]))
+        return self
+
+    @classmethod
+    def merge_all(cls, digests, compression: float = None) -> 'TDigest':
+        """
+        一次合并多个草图，不修改输入
+        :param digests: TDigest列表
+        :param compression: 结果的压缩参数，默认与第一个草图相同
+        :return: 新的TDigest
+        """
+        digests = list(digests)
+        result = cls(compression or (digests[0].compression if digests else 200))
+        parts = []
+        for digest in digests:
+            digest._flush()
+            if len(digest.means) > 0:
+                parts.append(digest)
+        if parts:
+            result.min = min(d.min for d in parts)
+            result.max = max(d.max for d in parts)
+            result._compress(np.concatenate([d.means for d in parts]),
+                             np.concatenate([d.weights for d in parts]))
+        return result
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        values = np.concatenate(self._buffer)
+        self._buffer = []
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # 按k1尺度函数 k(q) = δ/(2π)·asin(2q-1) 分组，每组跨度不超过一个k单位
+        q_start = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_start - 1)
+        group = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        group_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / group_weights
+        self.weights = group_weights
+        self._cumulative = None
+
+    def _prepare(self):
+        self._flush()
+        if self._cumulative is None:
+            # 每个质心的权重中点作为插值节点，两端用最小值和最大值
+            mid = np.cumsum(self.weights) - self.weights / 2
+            self._cumulative = (np.r_[0, mid, self.weights.sum()], np.r_[self.min, self.means, self.max])
+        return self._cumulative
+
+    def quantile(self, q):
+        """
+        估算分位数
+        :param q: 0~1之间的数或数组
+        :return: 分位数，草图为空时返回NaN
+        """
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        positions, values = self._prepare()
+        result = np.interp(np.asarray(q, dtype=np.float64) * positions[-1], positions, values)
+        return result if np.ndim(q) else float(result)
+
+    def cdf(self, x):
+        """
+        估算小于等于x的比例
+        :param x: 数值或数组
+        :return: 0~1之间的比例
+        """
+        if self.count == 0:
+            return np.full(np.shape(x), np.nan) if np.ndim(x) else np.nan
+        positions, values = self._prepare()
+        result = np.interp(x, values, positions) / positions[-1]
+        return result if np.ndim(x) else float(result)
+
+
+class QuantileSketchStore:
+    """
+    按股票、周期、指标和年份保存的t-digest草图集合，随新K线增量更新并持久化，
+    查询最近N年的分位数时只合并对应年份的草图，全市场的草图在更新时同步汇总。
+    """
+
+    def __init__(self, data_dir: str = "resource/stock_price", compression: float = 200):
+        """
+        :param data_dir: 股价数据目录，草图保存在其中的sketches子目录
+        :param compression: 新建草图的压缩参数
+        """
+        self.sketch_dir = os.path.join(data_dir, 'sketches')
+        self.compression = compression
+        # {(周期, 指标): {股票代码: {年份: TDigest}}}
+        self._sketches = {}
+        # {(周期, 指标): {股票代码: 已加入的最后一个周期的日期}}
+        self._last_dates = {}
+        self._merged = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _file_name(period: str, indicator: str) -> str:
+        return f"{period}_{indicator.replace('/', '_')}.npz"
+
+    def _load(self):
+        if not os.path.isdir(self.sketch_dir):
+            return
+        for file_name in os.listdir(self.sketch_dir):
+            if not file_name.endswith('.npz'):
+                continue
+            with np.load(os.path.join(self.sketch_dir, file_name)) as data:
+                meta = json.loads(str(data['meta']))
+                offsets = data['offsets']
+                means, weights, bounds = data['means'], data['weights'], data['bounds']
+            key = (meta['period'], meta['indicator'])
+            sketches = self._sketches.setdefault(key, {})
+            for i, (stock_code, year) in enumerate(meta['entries']):
+                digest = TDigest(meta['compression'])
+                digest.means = means[offsets[i]:offsets[i + 1]]
+                digest.weights = weights[offsets[i]:offsets[i + 1]]
+                digest.min, digest.max = bounds[i]
+                sketches.setdefault(stock_code, {})[int(year)] = digest
+            self._last_dates[key] = meta['last_dates']
+
+    def save(self):
+        """将全部草图保存到磁盘，每个周期和指标一个文件"""
+        os.makedirs(self.sketch_dir, exist_ok=True)
+        with self._lock:
+            for (period, indicator), sketches in self._sketches.items():
+                entries, means, weights, bounds = [], [], [], []
+                for stock_code, years in sketches.items():
+                    for year, digest in years.items():
+                        digest._flush()
+                        entries.append((stock_code, year))
+                        means.append(digest.means)
+                        weights.append(digest.weights)
+                        bounds.append((digest.min, digest.max))
+                meta = {
+                    'period': period,
+                    'indicator': indicator,
+                    'compression': self.compression,
+                    'entries': entries,
+                    'last_dates': self._last_dates.get((period, indicator), {}),
+                }
+                path = os.path.join(self.sketch_dir, self._file_name(period, indicator))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                             offsets=np.cumsum([0] + [len(m) for m in means]),
+                             means=np.concatenate(means) if means else np.empty(0),
+                             weights=np.concatenate(weights) if weights else np.empty(0),
+                             bounds=np.array(bounds, dtype=np.float64).reshape(-1, 2))
+                os.replace(tmp_path, path)
+
+    def add_values(self, stock_code: str, period: str, indicator: str, dates, values) -> int:
+        """
+        加入一只股票已完成周期的指标值，日期不晚于已加入的最后日期的值会被忽略
+        :param stock_code: 股票代码
+        :param period: 周期，'D'、'W'或'M'
+        :param indicator: 指标名称，如'收盘/MA10'
+        :param dates: 周期日期序列
+        :param values: 指标值序列
+        :return: 实际加入的数量
+        """
+        dates = pd.to_datetime(pd.Series(dates)).reset_index(drop=True)
+        values = np.asarray(values, dtype=np.float64)
+        key = (period, indicator)
+        with self._lock:
+            last_dates = self._last_dates.setdefault(key, {})
+            if stock_code in last_dates:
+                keep = (dates > pd.Timestamp(last_dates[stock_code])).to_numpy()
+                dates, values = dates[keep].reset_index(drop=True), values[keep]
+            if len(dates) == 0:
+                return 0
+            sketches = self._sketches.setdefault(key, {})
+            years = dates.dt.year.to_numpy()
+            for year in np.unique(years):
+                part = values[years == year]
+                for code in (stock_code, UNIVERSE):
+                    digest = sketches.setdefault(code, {}).setdefault(int(year), TDigest(self.compression))
+                    digest.update(part)
+            last_dates[stock_code] = dates.iloc[-1].strftime('%Y-%m-%d')
+            self._merged = {}
+        return int(np.count_nonzero(~np.isnan(values)))
+
+    def update(self, stock_data, period: str = 'W', ma_period: int = 10) -> int:
+        """
+        用StockData的数据更新'收盘/MA'指标的草图，只加入已完成的周期，
+        最后一个周线或月线可能还会变化，等下一个周期出现后再加入
+        :param stock_data: StockData对象，不会被修改
+        :param period: 周期，'D'、'W'或'M'
+        :param ma_period: MA周期
+        :return: 实际加入的数量
+        """
+        df = StockDataProcessor.aggregate_by_period(stock_data.df, period)
+        df = StockDataProcessor.calculate_ma(df, [ma_period])
+        if period != 'D':
+            df = df.iloc[:-1]
+        ratio = df['收盘'] / df[f'MA{ma_period}']
+        return self.add_values(stock_data.stock_code, period, f'收盘/MA{ma_period}', df['日期'], ratio)
+
+    def years(self, stock_code: str = UNIVERSE, period: str = 'W', indicator: str = '收盘/MA10') -> list:
+        """已有草图的年份列表"""
+        return sorted(self._sketches.get((period, indicator), {}).get(stock_code, {}))
+
+    def sketch(self, stock_code: str = UNIVERSE, period: str = 'W', indicator: str = '收盘/MA10',
+               years: int = None, end_year: int = None) -> TDigest:
+        """
+        合并一段年份的草图，结果会被缓存到下一次更新
+        :param stock_code: 股票代码，默认为全市场
+        :param period: 周期
+        :param indicator: 指标名称
+        :param years: 最近的年数，默认为全部年份
+        :param end_year: 截止年份，默认为最后一个有数据的年份
+        :return: TDigest
+        """
+        cache_key = (stock_code, period, indicator, years, end_year)
+        with self._lock:
+            merged = self._merged.get(cache_key)
+            if merged is None:
+                by_year = self._sketches.get((period, indicator), {}).get(stock_code, {})
+                selected = sorted(by_year)
+                if selected:
+                    last = end_year if end_year is not None else selected[-1]
+                    first = last - years + 1 if years else selected[0]
+                    selected = [year for year in selected if first <= year <= last]
+                merged = TDigest.merge_all([by_year[year] for year in selected], self.compression)
+                merged._prepare()
+                self._merged[cache_key] = merged
+        return merged
+
+    def quantile(self, q, stock_code: str = UNIVERSE, period: str = 'W', indicator: str = '收盘/MA10',
+                 years: int = None, end_year: int = None):
+        """
+        查询分位数，例如最近5年周线收盘/MA10的第10和第90百分位：
+        store.quantile([0.1, 0.9], '601288', 'W', '收盘/MA10', years=5)
+        :param q: 0~1之间的数或数组
+        :return: 分位数
+        """
+        return self.sketch(stock_code, period, indicator, years, end_year).quantile(q)
+
+
+# 使用示例
+if __name__ == '__main__':
+    from stock_data import StockData
+
+    stock_codes = {
+        '601398': '工商银行',
+        '601939': '建设银行',
+        '601288': '农业银行',
+        '601988': '中国银行',
+        '601328': '交通银行',
+    }
+    store = QuantileSketchStore()
+    for code, name in stock_codes.items():
+        store.update(StockData(code, name, offline=True), 'W', 10)
+    store.save()
+
+    for code in list(stock_codes) + [UNIVERSE]:
+        low, high = store.quantile([0.1, 0.9], code, 'W', '收盘/MA10', years=5)
+        print(f"{code} 最近5年周线收盘/MA10 第10百分位：{low:.4f}，第90百分位：{high:.4f}")
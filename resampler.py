@@ -0,0 +1,260 @@
+import re
+import numpy as np
+import pandas as pd
+
+# A股交易时段（自零点起的分钟数）：上午9:30-11:30，下午13:00-15:00
+A_SHARE_SESSIONS = ((570, 690), (780, 900))
+
+# 输出列的顺序，与行情CSV一致，最后是成交量加权均价
+OUTPUT_COLUMNS = ['股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率', '均价']
+SUM_COLUMNS = ['成交量', '成交额', '换手率']
+
+_PERIOD_PATTERN = re.compile(r'^(\d*)(min|D|W|M|Q|Y)$')
+
+
+def parse_period(period: str):
+    """
+    解析周期字符串
+    :param period: 如'60min'、'D'、'W'、'2W'、'M'、'Q'、'Y'
+    :return: (单位, 倍数)，季度和年转换为3个月和12个月
+    """
+    match = _PERIOD_PATTERN.match(period)
+    if match is None or match.group(1) in ('0', '00'):
+        raise ValueError(f"不支持的周期：{period}，应为'60min'、'D'、'W'、'2W'、'M'、'Q'、'Y'等形式")
+    count = int(match.group(1) or 1)
+    unit = match.group(2)
+    if unit == 'Q':
+        return 'M', count * 3
+    if unit == 'Y':
+        return 'M', count * 12
+    if unit == 'D' and count != 1:
+        raise ValueError("日线周期不支持倍数，请使用交易日数量固定的周线或月线")
+    return unit, count
+
+
+class Resampler:
+    """
+    流式K线重采样器：逐块输入按时间排序的分钟线或日线，一次遍历同时输出多个周期。
+    每个周期只保留最后一根未完成的K线，已完成的K线在update时立即返回，
+    因此内存占用只与块大小有关。日线及以上周期由块内先聚合出的日线部分结果继续聚合。
+    """
+
+    def __init__(self, periods, label: str = 'period_end', lot_size: int = 100,
+                 sessions=A_SHARE_SESSIONS):
+        """
+        :param periods: 输出周期列表，如['60min', 'D', 'W', 'Q']
+        :param label: 'period_end'时日线以上周期以自然周期末（周五、月末）为日期，
+                      'session'时以周期内最后一个实际交易日为日期
+        :param lot_size: 成交量的单位股数，没有'均价'列时用成交额/(成交量×lot_size)计算均价
+        :param sessions: 交易时段，分钟线按时段开盘时间对齐，如60分钟线为10:30、11:30、14:00、15:00
+        """
+        if label not in ('period_end', 'session'):
+            raise ValueError("label必须是'period_end'或'session'")
+        self.periods = list(dict.fromkeys(periods))
+        self.specs = {period: parse_period(period) for period in self.periods}
+        self.label = label
+        self.lot_size = lot_size
+        self.sessions = sessions
+        self._time_column = None
+        self._columns = None
+        self._pending = {period: None for period in self.periods}
+        self._prev_close = {period: np.nan for period in self.periods}
+
+    def _bucket_ids(self, unit, count, ns, days):
+        if unit == 'min':
+            minutes = (ns // 60_000_000_000) % 1440
+            # 时段之外的K线按自然分钟对齐
+            labels = -(-minutes // count) * count
+            lower = -1
+            for start, end in self.sessions:
+                # 上一时段收盘之后至本时段收盘的K线（含集合竞价）属于本时段，按本时段开盘时间对齐
+                in_session = (minutes > lower) & (minutes <= end)
+                offset = np.maximum(-(-(minutes - start) // count), 1)
+                labels = np.where(in_session, np.minimum(start + offset * count, end), labels)
+                lower = end
+            return days * 1440 + labels
+        if unit == 'D':
+            return days
+        if unit == 'W':
+            # 1970-01-03是周六，周六至周五为一周
+            return (days - 2) // 7 // count
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return months // count
+
+    def _period_end(self, unit, count, ids):
+        if unit == 'min':
+            return (ids // 1440).astype('datetime64[D]') + (ids % 1440).astype('timedelta64[m]')
+        if unit == 'D':
+            return ids.astype('datetime64[D]')
+        if unit == 'W':
+            return ((ids * count + count - 1) * 7 + 8).astype('datetime64[D]')
+        last_month = (ids * count + count).astype('datetime64[M]')
+        return last_month.astype('datetime64[D]') - np.timedelta64(1, 'D')
+
+    @staticmethod
+    def _reduce(rows: dict, ids: np.ndarray) -> dict:
+        """按连续相同的ids聚合部分结果，部分结果本身可以再次聚合"""
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)] - 1
+        result = {'_id': ids[starts]}
+        for col, values in rows.items():
+            if col == '_id':
+                continue
+            if col in ('开盘', '股票代码', '_first'):
+                result[col] = values[starts]
+            elif col in ('收盘', '_last'):
+                result[col] = values[ends]
+            elif col == '最高':
+                result[col] = np.fmax.reduceat(values, starts)
+            elif col == '最低':
+                result[col] = np.fmin.reduceat(values, starts)
+            else:
+                result[col] = np.add.reduceat(values, starts)
+        return result
+
+    @staticmethod
+    def _concat(first: dict, second: dict) -> dict:
+        return {col: np.concatenate([first[col], second[col]]) for col in second}
+
+    def _prepare(self, chunk: pd.DataFrame) -> dict:
+        if self._time_column is None:
+            self._time_column = '时间' if '时间' in chunk.columns else '日期'
+            self._columns = [col for col in OUTPUT_COLUMNS if col in chunk.columns]
+            if '成交量' in chunk.columns and ('均价' in chunk.columns or '成交额' in chunk.columns):
+                self._columns = [col for col in OUTPUT_COLUMNS if col in self._columns or col == '均价']
+        times = pd.to_datetime(chunk[self._time_column]).to_numpy().astype('datetime64[ns]')
+        rows = {'_first': times, '_last': times}
+        for col in ('股票代码', '开盘', '收盘', '最高', '最低'):
+            if col in chunk.columns:
+                rows[col] = chunk[col].to_numpy()
+        for col in SUM_COLUMNS:
+            if col in chunk.columns:
+                rows[col] = np.nan_to_num(chunk[col].to_numpy())
+        if '均价' in self._columns:
+            volume = rows['成交量'].astype(np.float64)
+            if '均价' in chunk.columns:
+                rows['_turnover_value'] = np.nan_to_num(chunk['均价'].to_numpy(dtype=np.float64)) * volume
+            else:
+                rows['_turnover_value'] = rows['成交额'] / self.lot_size
+        return rows
+
+    def _finish(self, period: str, state: dict) -> pd.DataFrame:
+        """将聚合状态转换为输出DataFrame，并计算依赖前一根K线收盘价的字段"""
+        unit, count = self.specs[period]
+        if self.label == 'session' and unit != 'min':
+            labels = state['_last'].astype('datetime64[D]')
+        else:
+            labels = self._period_end(unit, count, state['_id'])
+        df = pd.DataFrame({'时间' if unit == 'min' else '日期': pd.to_datetime(labels)})
+        prev_close = np.r_[self._prev_close[period], state['收盘'][:-1]].astype(np.float64) \
+            if '收盘' in state else None
+        for col in self._columns:
+            if col in state:
+                df[col] = state[col]
+            elif col == '均价':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    df[col] = state['_turnover_value'] / state['成交量']
+            elif prev_close is not None and col == '涨跌额':
+                df[col] = state['收盘'] - prev_close
+            elif prev_close is not None and col == '涨跌幅':
+                df[col] = (state['收盘'] / prev_close - 1) * 100
+            elif prev_close is not None and col == '振幅' and '最高' in state and '最低' in state:
+                df[col] = (state['最高'] - state['最低']) / prev_close * 100
+        if len(df) > 0 and '收盘' in state:
+            self._prev_close[period] = float(state['收盘'][-1])
+        return df
+
+    def update(self, chunk: pd.DataFrame) -> dict:
+        """
+        输入下一块按时间排序的K线
+        :param chunk: 包含'时间'（分钟线）或'日期'（日线）列及开高低收、成交量等列的DataFrame
+        :return: {周期: 本块中已完成的K线DataFrame}
+        """
+        if len(chunk) == 0:
+            return {period: pd.DataFrame() for period in self.periods}
+        rows = self._prepare(chunk)
+        if self._time_column == '日期' and any(unit == 'min' for unit, _ in self.specs.values()):
+            raise ValueError("日线数据不能重采样为分钟线")
+        ns = rows['_first'].astype(np.int64)
+        days = ns // 86_400_000_000_000
+        daily = None
+        completed = {}
+        for period in self.periods:
+            unit, count = self.specs[period]
+            if unit == 'min' or self._time_column == '日期':
+                source, source_days = rows, days
+            else:
+                # 分钟线输入时，日线以上周期由本块的日线部分结果继续聚合
+                if daily is None:
+                    daily = self._reduce(rows, days)
+                source, source_days = daily, daily['_id']
+            state = self._reduce(source, self._bucket_ids(unit, count, ns if source is rows else None, source_days))
+            pending = self._pending[period]
+            if pending is not None:
+                if pending['_id'][0] == state['_id'][0]:
+                    state = self._reduce(self._concat(pending, state), np.r_[pending['_id'], state['_id']])
+                else:
+                    state = self._concat(pending, state)
+            self._pending[period] = {col: values[-1:] for col, values in state.items()}
+            completed[period] = self._finish(period, {col: values[:-1] for col, values in state.items()})
+        return completed
+
+    def flush(self) -> dict:
+        """
+        输出每个周期最后一根未完成的K线
+        :return: {周期: DataFrame}
+        """
+        result = {}
+        for period in self.periods:
+            pending = self._pending[period]
+            self._pending[period] = None
+            if pending is None:
+                result[period] = pd.DataFrame()
+            else:
+                result[period] = self._finish(period, pending)
+        return result
+
+
+def resample(df: pd.DataFrame, periods, label: str = 'period_end', lot_size: int = 100) -> dict:
+    """
+    一次遍历将K线重采样为多个周期
+    :param df: 按时间排序的分钟线或日线DataFrame
+    :param periods: 周期列表
+    :param label: 日期标签方式，见Resampler
+    :param lot_size: 成交量的单位股数
+    :return: {周期: DataFrame}
+    """
+    resampler = Resampler(periods, label, lot_size)
+    parts = resampler.update(df)
+    tails = resampler.flush()
+    return {period: pd.concat([parts[period], tails[period]], ignore_index=True) for period in resampler.periods}
+
+
+def resample_csv(file_path: str, periods, chunksize: int = 200_000, label: str = 'period_end',
+                 lot_size: int = 100) -> dict:
+    """
+    分块读取分钟线CSV并重采样，任意时刻只有一块原始数据在内存中
+    :param file_path: 按时间排序的分钟线或日线CSV文件
+    :param periods: 周期列表
+    :param chunksize: 每块的行数
+    :param label: 日期标签方式，见Resampler
+    :param lot_size: 成交量的单位股数
+    :return: {周期: DataFrame}
+    """
+    resampler = Resampler(periods, label, lot_size)
+    parts = {period: [] for period in resampler.periods}
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        for period, bars in resampler.update(chunk).items():
+            parts[period].append(bars)
+    for period, bars in resampler.flush().items():
+        parts[period].append(bars)
+    return {period: pd.concat(frames, ignore_index=True) for period, frames in parts.items()}
+
+
+# 使用示例
+if __name__ == '__main__':
+    daily = pd.read_csv('resource/stock_price/601288.csv')
+    bars = resample(daily, ['W', '2W', 'M', 'Q'])
+    for period, df in bars.items():
+        print(f"{period}: {len(df)}根K线")
+        print(df.tail(3))
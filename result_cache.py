@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import zlib
+from stock_data_downloader import file_lock
+from strategy_analyzer import get_performance_summary
+
+
+class BacktestCache:
+    def __init__(self, cache_dir: str = "resource/cache/backtest", max_bytes: int = 512 * 1024 * 1024):
+        """
+        初始化回测结果缓存，以输入数据、策略参数和日期范围的哈希为键。
+        命中时只在内存中更新访问时间，put、clear和flush时才写入索引，多个进程可以共用同一个缓存目录
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存占用的最大字节数，超出时淘汰最久未使用的结果
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._dirty = False
+
+    @staticmethod
+    def make_key(stock_data, strategy, start_date=None, end_date=None) -> str:
+        """
+        生成缓存键
+        :param stock_data: StockData对象，使用其数据内容的哈希
+        :param strategy: 策略对象，使用其类名和参数
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :return: 十六进制字符串
+        """
+        strategy_type = type(strategy)
+        params = sorted((name, repr(value)) for name, value in vars(strategy).items())
+        payload = json.dumps({
+            'data': stock_data.data_hash(),
+            'strategy': f"{strategy_type.__module__}.{strategy_type.__qualname__}",
+            'params': params,
+            'start_date': None if start_date is None else str(start_date),
+            'end_date': None if end_date is None else str(end_date),
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    @staticmethod
+    def _tmp_path(path: str) -> str:
+        # 多个进程或线程可能同时写入，临时文件名各不相同
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self._index_path):
+            return {}
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_index(self):
+        """与其他进程写入的索引合并后保存，结果文件已被删除的条目不再保留"""
+        with file_lock(self._index_path + '.lock'):
+            merged = self._load_index()
+            for key, entry in self._index.items():
+                if key in merged:
+                    entry = dict(entry, last_access=max(entry['last_access'], merged[key]['last_access']))
+                merged[key] = entry
+            self._index = {key: entry for key, entry in merged.items()
+                           if os.path.exists(self._get_file_path(key))}
+            self._evict()
+            tmp_path = self._tmp_path(self._index_path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, self._index_path)
+        self._dirty = False
+
+    def flush(self):
+        """保存命中时更新的访问时间，供其他进程按最近使用淘汰"""
+        if self._dirty:
+            self._save_index()
+
+    def get(self, key: str):
+        """
+        读取缓存的结果
+        :param key: 缓存键
+        :return: (processed_df, signals, trades, summary)，未命中时返回None
+        """
+        if key not in self._index:
+            self.misses += 1
+            return None
+        try:
+            with open(self._get_file_path(key), 'rb') as f:
+                result = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            # 已被其他进程淘汰
+            self.misses += 1
+            return None
+        self._index[key]['last_access'] = time.time()
+        self._dirty = True
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result):
+        """
+        保存结果，并在超出容量时淘汰最久未使用的结果
+        :param key: 缓存键
+        :param result: (processed_df, signals, trades, summary)
+        """
+        data = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        file_path = self._get_file_path(key)
+        tmp_path = self._tmp_path(file_path)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+        self._index[key] = {'size': len(data), 'last_access': time.time()}
+        self._save_index()
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)['size']
+            file_path = self._get_file_path(key)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def apply_strategy(self, strategy, stock_data, start_date=None, end_date=None):
+        """
+        带缓存地执行策略，命中时不会处理stock_data
+        :param strategy: 策略对象
+        :param stock_data: StockData对象
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :return: (processed_df, signals, trades, summary)
+        """
+        key = self.make_key(stock_data, strategy, start_date, end_date)
+        result = self.get(key)
+        if result is None:
+            processed_df, signals, trades = strategy.apply_strategy(stock_data, start_date, end_date)
+            result = (processed_df, signals, trades, get_performance_summary(trades))
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        """清空缓存"""
+        for key in list(self._index):
+            file_path = self._get_file_path(key)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self._index = {}
+        self._save_index()
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        :return: 命中次数、未命中次数、命中率、缓存条数和占用字节数
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups * 100 if lookups else 0,
+            'entries': len(self._index),
+            'bytes': sum(entry['size'] for entry in self._index.values()),
+        }
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+from stock_processor import StockDataProcessor
+from strategy_analyzer import PERIODS_PER_YEAR, get_performance_summary, get_equity_metrics
+
+
+def align_members(stock_data_list, period='W', start_date=None, end_date=None, fields=('收盘',)):
+    """
+    将多只股票按周期聚合后对齐为 (日期, 股票) 矩阵，缺失的K线为NaN
+    :param stock_data_list: StockData列表，不会被修改
+    :param period: 周期，见StockDataProcessor.aggregate_by_period
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param fields: 需要对齐的字段
+    :return: (日期DatetimeIndex, 股票代码列表, {字段: 矩阵})
+    """
+    frames = []
+    for stock_data in stock_data_list:
+        df = StockDataProcessor.filter_by_date(stock_data.df, start_date, end_date)
+        df = StockDataProcessor.aggregate_by_period(df, period)
+        days = pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]').astype(np.int64)
+        frames.append((days, df))
+
+    dates = np.unique(np.concatenate([days for days, _ in frames])) if frames else np.empty(0, dtype=np.int64)
+    matrices = {field: np.full((len(dates), len(frames)), np.nan) for field in fields}
+    for s, (days, df) in enumerate(frames):
+        positions = np.searchsorted(dates, days)
+        for field in fields:
+            matrices[field][positions, s] = df[field].to_numpy(dtype=np.float64)
+    symbols = [stock_data.stock_code for stock_data in stock_data_list]
+    return pd.DatetimeIndex(dates.astype('datetime64[D]')), symbols, matrices
+
+
+def ma_discount_score(fields, ma_period):
+    """收盘价低于MA的幅度，1 - 收盘/MA，越大表示越便宜"""
+    ma = pd.DataFrame(fields['收盘']).rolling(window=ma_period).mean().to_numpy()
+    return 1 - fields['收盘'] / ma
+
+
+class RotationStrategy:
+    """
+    横截面轮动策略：把成员股票对齐为 (日期, 股票) 矩阵，每根K线对所有股票的得分排序，
+    每隔rebalance_every根K线以收盘价调仓到得分最高的top_n只股票（等权），其余时间持有不动。
+    排序、调仓、净值和换手都是整块矩阵运算，计算量与成员数量成线性关系。
+    """
+
+    def __init__(self, period='W', ma_period=10, top_n=1, rebalance_every=1, score='ma_discount',
+                 min_score=None, cost_rate=0.0):
+        """
+        :param period: 周期，'D'、'W'、'M'等
+        :param ma_period: 'ma_discount'得分使用的MA周期
+        :param top_n: 持有的股票数量
+        :param rebalance_every: 每隔多少根K线调仓一次，周线时1表示每周轮动
+        :param score: 得分，越大越优先持有，可以是：
+                      'ma_discount'：1 - 收盘/MA，选最低于MA的股票；
+                      函数：score(fields, dates, symbols)返回 (日期, 股票) 矩阵；
+                      DataFrame：以日期为索引、股票代码为列，如股息率，按日期向前填充对齐
+        :param min_score: 得分低于该值的股票不持有，None表示不限制
+        :param cost_rate: 单边交易成本，按换手扣除，如0.001表示0.1%
+        """
+        if top_n < 1 or rebalance_every < 1:
+            raise ValueError("top_n和rebalance_every必须大于0")
+        self.period = period
+        self.ma_period = ma_period
+        self.top_n = top_n
+        self.rebalance_every = rebalance_every
+        self.score = score
+        self.min_score = min_score
+        self.cost_rate = cost_rate
+
+    def _calculate_scores(self, dates, symbols, fields):
+        if isinstance(self.score, str):
+            if self.score != 'ma_discount':
+                raise ValueError(f"不支持的得分：{self.score}")
+            return ma_discount_score(fields, self.ma_period)
+        if isinstance(self.score, pd.DataFrame):
+            frame = self.score.copy()
+            frame.index = pd.to_datetime(frame.index)
+            frame = frame.sort_index().reindex(columns=symbols)
+            return frame.reindex(dates, method='ffill').to_numpy(dtype=np.float64)
+        return np.asarray(self.score(fields, dates, symbols), dtype=np.float64)
+
+    def select(self, scores, close):
+        """
+        按得分选出每根K线的目标持仓，停牌（收盘价为NaN）或得分无效的股票不参与排序
+        :param scores: 得分矩阵 (日期, 股票)
+        :param close: 收盘价矩阵 (日期, 股票)
+        :return: 目标权重矩阵 (日期, 股票)，每行之和为1，没有可选股票时为0（空仓）
+        """
+        bars, count = scores.shape
+        valid = np.isfinite(scores) & np.isfinite(close)
+        if self.min_score is not None:
+            valid &= scores >= self.min_score
+        ranked = np.where(valid, scores, -np.inf)
+        top_n = min(self.top_n, count)
+        if top_n == 1:
+            chosen = np.argmax(ranked, axis=1).reshape(-1, 1)
+        else:
+            chosen = np.argpartition(-ranked, top_n - 1, axis=1)[:, :top_n]
+        rows = np.arange(bars).reshape(-1, 1)
+        selected = np.zeros((bars, count), dtype=bool)
+        selected[rows, chosen] = valid[rows, chosen]
+        held = selected.sum(axis=1, keepdims=True)
+        return np.divide(selected, held, out=np.zeros((bars, count)), where=held > 0)
+
+    def simulate(self, close, targets):
+        """
+        模拟调仓：调仓K线以收盘价换到目标权重，两次调仓之间持仓随价格漂移
+        :param close: 收盘价矩阵 (日期, 股票)
+        :param targets: 目标权重矩阵 (日期, 股票)，只使用调仓K线的行
+        :return: (每根K线收盘后的权重矩阵, 净值数组, 换手数组)，换手为调仓时权重变化的绝对值之和
+        """
+        bars, count = close.shape
+        # 停牌期间按最近的收盘价估值
+        filled = pd.DataFrame(close).ffill().to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.nan_to_num(filled / np.r_[filled[:1], filled[:-1]] - 1)
+        growth = np.cumprod(1 + returns, axis=0)
+
+        bar_idx = np.arange(bars)
+        rebalance = bar_idx % self.rebalance_every == 0
+        # 每根K线收盘后所属的调仓K线，以及收盘前（上一根K线收盘后）所属的调仓K线
+        segment = np.maximum.accumulate(np.where(rebalance, bar_idx, 0))
+        prev_segment = np.r_[0, segment[:-1]]
+
+        def drifted(seg):
+            target = targets[seg]
+            values = target * growth / growth[seg]
+            cash = 1 - target.sum(axis=1)
+            total = values.sum(axis=1) + cash
+            return values / total.reshape(-1, 1)
+
+        weights = drifted(segment)
+        before = drifted(prev_segment)
+        before[0] = 0
+        turnover = np.where(rebalance, np.abs(weights - before).sum(axis=1), 0.0)
+
+        held_returns = np.zeros(bars)
+        held_returns[1:] = (weights[:-1] * returns[1:]).sum(axis=1)
+        equity = np.cumprod((1 + held_returns) * (1 - self.cost_rate * turnover))
+        return weights, equity, turnover
+
+    @staticmethod
+    def holding_trades(dates, symbols, close, weights):
+        """
+        将每只股票的连续持有区间转换为交易记录，字段与单只股票策略的交易记录一致，
+        最后仍在持有的区间不计入
+        :param dates: 日期
+        :param symbols: 股票代码列表
+        :param close: 收盘价矩阵 (日期, 股票)
+        :param weights: 权重矩阵 (日期, 股票)
+        :return: DataFrame，交易记录
+        """
+        columns = ['股票代码', '买入日期', '买入价格', '卖出日期', '卖出价格', '收益率', '最大收益率', '回撤率',
+                   '持有K线数']
+        bars, count = close.shape
+        # 按股票展开为一维，每只股票的K线后面补一个空仓位置，使持有到最后的区间不会与下一只股票相连
+        width = bars + 1
+        held = np.zeros((count, width), dtype=bool)
+        held[:, :bars] = weights.T > 0
+        flat_close = np.full((count, width), np.nan)
+        flat_close[:, :bars] = pd.DataFrame(close).ffill().to_numpy().T
+        flat_close = flat_close.ravel()
+        change = np.diff(np.r_[False, held.ravel()].astype(np.int8))
+        entries = np.flatnonzero(change == 1)
+        exits = np.flatnonzero(change == -1)
+        # 在补位处才结束的区间是最后仍在持有的仓位
+        closed = exits % width < bars
+        entries, exits = entries[closed], exits[closed]
+        if len(entries) == 0:
+            return pd.DataFrame(columns=columns)
+
+        bounds = np.ravel(np.column_stack([entries, exits + 1]))
+        max_price = np.fmax.reduceat(flat_close, bounds)[::2]
+        entry_price, exit_price = flat_close[entries], flat_close[exits]
+        stock_idx, entry_bar, exit_bar = entries // width, entries % width, exits % width
+        dates = pd.DatetimeIndex(dates).strftime('%Y-%m-%d').to_numpy()
+        trades = pd.DataFrame({
+            '股票代码': np.asarray(symbols)[stock_idx],
+            '买入日期': dates[entry_bar],
+            '买入价格': entry_price,
+            '卖出日期': dates[exit_bar],
+            '卖出价格': exit_price,
+            '收益率': (exit_price / entry_price - 1) * 100,
+            '最大收益率': (max_price / entry_price - 1) * 100,
+            '回撤率': (exit_price / max_price - 1) * 100,
+            '持有K线数': exit_bar - entry_bar,
+        }, columns=columns)
+        return trades.sort_values(['买入日期', '股票代码'], kind='stable').reset_index(drop=True)
+
+    def apply_matrix(self, dates, symbols, fields):
+        """
+        在已对齐的矩阵上运行策略，可直接使用StockPanel.field的结果
+        :param dates: 日期
+        :param symbols: 股票代码列表
+        :param fields: {字段: (日期, 股票) 矩阵}，至少包含'收盘'
+        :return: 结果字典，包含scores、weights、equity、turnover（按日期索引）、trades和metrics
+        """
+        dates = pd.DatetimeIndex(dates)
+        fields = {field: np.asarray(values, dtype=np.float64) for field, values in fields.items()}
+        close = fields['收盘']
+        scores = self._calculate_scores(dates, symbols, fields)
+        targets = self.select(scores, close)
+        weights, equity, turnover = self.simulate(close, targets)
+        trades = self.holding_trades(dates, symbols, close, weights)
+
+        positions = weights.sum(axis=1)
+        metrics = get_equity_metrics(equity, positions, period=self.period)
+        # 换手按权重变化计算，完全换到另一只股票记为2，与单只股票策略买卖各记1一致
+        years = max(len(dates) - 1, 1) / PERIODS_PER_YEAR.get(self.period, 52)
+        metrics['turnover'] = float(turnover.sum())
+        metrics['annual_turnover'] = metrics['turnover'] / years
+        metrics['switches'] = int((turnover > 0).sum())
+        metrics.update({f'trade_{key}': value for key, value in get_performance_summary(trades).items()})
+        return {
+            'scores': pd.DataFrame(scores, index=dates, columns=symbols),
+            'weights': pd.DataFrame(weights, index=dates, columns=symbols),
+            'equity': pd.Series(equity, index=dates, name='净值'),
+            'turnover': pd.Series(turnover, index=dates, name='换手'),
+            'trades': trades,
+            'metrics': metrics,
+        }
+
+    def apply_strategy(self, stock_data_list, start_date=None, end_date=None):
+        """
+        对一组股票运行轮动策略
+        :param stock_data_list: StockData列表
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :return: 结果字典，见apply_matrix
+        """
+        dates, symbols, fields = align_members(stock_data_list, self.period, start_date, end_date)
+        return self.apply_matrix(dates, symbols, fields)
+
+
+# 使用示例：每周持有最低于周线MA10的国有大行
+if __name__ == '__main__':
+    from stock_data import StockData
+
+    stock_codes = {
+        '601398': '工商银行',
+        '601939': '建设银行',
+        '601288': '农业银行',
+        '601988': '中国银行',
+        '601328': '交通银行',
+    }
+    members = [StockData(code, name, offline=True) for code, name in stock_codes.items()]
+    strategy = RotationStrategy(period='W', ma_period=10, top_n=1, cost_rate=0.001)
+    result = strategy.apply_strategy(members, start_date='2015-01-01')
+    for key, value in result['metrics'].items():
+        print(f"{key}: {value}")
+    print(result['trades'].tail(10))
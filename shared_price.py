@@ -0,0 +1,127 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from stock_data import StockData
+from strategy_analyzer import get_performance_summary
+
+# 各列在共享内存块中按8字节对齐
+_ALIGNMENT = 8
+
+# 工作进程中已附加的共享内存和列数组
+_worker_blocks = []
+_worker_columns = {}
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13之前没有track参数，进程池的工作进程与发布者共用同一个resource_tracker
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_columns(handle: dict):
+    """
+    附加到已发布的共享内存，返回零拷贝的列数组
+    :param handle: SharedPriceArrays.publish返回的描述
+    :return: (SharedMemory, 列名到numpy数组的字典)，使用期间必须保留SharedMemory的引用
+    """
+    block = _attach_block(handle['block'])
+    columns = {}
+    for col, dtype, offset, length in handle['columns']:
+        columns[col] = np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        columns[col].flags.writeable = False
+    return block, columns
+
+
+class SharedPriceArrays:
+    def __init__(self):
+        """
+        将已加载的股价数组发布到共享内存，每只股票一个共享内存块，工作进程附加后零拷贝读取
+        """
+        self._blocks = {}
+        self.handles = {}
+
+    def publish(self, stock_data: StockData) -> dict:
+        """
+        发布一只股票的日期和价格数组
+        :param stock_data: StockData对象
+        :return: 可序列化的描述，包含共享内存名称和各列的类型、偏移和长度
+        """
+        if stock_data.stock_code in self.handles:
+            return self.handles[stock_data.stock_code]
+        columns = stock_data.to_columns()
+        layout = []
+        offset = 0
+        for col, values in columns.items():
+            values = np.ascontiguousarray(values)
+            layout.append((col, values.dtype.str, offset, len(values)))
+            offset += -(-values.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (col, dtype, start, length), values in zip(layout, columns.values()):
+            target = np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf, offset=start)
+            target[:] = values
+
+        handle = {
+            'block': block.name,
+            'stock_code': stock_data.stock_code,
+            'name': stock_data.name,
+            'columns': layout,
+        }
+        self._blocks[stock_data.stock_code] = block
+        self.handles[stock_data.stock_code] = handle
+        return handle
+
+    def close(self):
+        """释放全部共享内存"""
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _init_worker(handles):
+    for stock_code, handle in handles.items():
+        block, columns = attach_columns(handle)
+        _worker_blocks.append(block)
+        _worker_columns[stock_code] = (handle['name'], columns)
+
+
+def _run_task(task):
+    strategy_cls, stock_code, params, start_date, end_date, return_trades = task
+    name, columns = _worker_columns[stock_code]
+    stock_data = StockData.from_columns(stock_code, name, columns)
+    _, _, trades = strategy_cls(*params).apply_strategy(stock_data, start_date, end_date)
+    summary = get_performance_summary(trades)
+    return stock_code, params, summary, trades if return_trades else None
+
+
+def run_parallel_backtests(shared: SharedPriceArrays, strategy_cls, tasks, start_date=None, end_date=None,
+                           max_workers: int = None, return_trades: bool = False) -> list:
+    """
+    在进程池中执行回测，价格数组通过共享内存传递，任务只包含股票代码和参数元组
+    :param shared: 已发布股价数据的SharedPriceArrays
+    :param strategy_cls: 策略类，如MAStrategy
+    :param tasks: (股票代码, 参数元组)列表，参数按策略构造函数的位置参数顺序
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param max_workers: 进程数，默认为CPU核数
+    :param return_trades: 是否返回交易记录
+    :return: (股票代码, 参数元组, 表现摘要, 交易记录或None)列表，顺序与tasks一致
+    """
+    payloads = [(strategy_cls, stock_code, tuple(params), start_date, end_date, return_trades)
+                for stock_code, params in tasks]
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(payloads) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(shared.handles,)) as executor:
+        return list(executor.map(_run_task, payloads, chunksize=chunksize))
@@ -0,0 +1,143 @@
+import inspect
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from stock_data import StockData
+from stock_panel import StockPanel
+
+# 每个策略周期大约包含的交易日数
+TRADING_DAYS_PER_PERIOD = {'D': 1, 'W': 5, 'M': 23}
+
+_panel_cache = {}
+
+
+def read_csv_tail(file_path: str, n_rows: int, block_size: int = 1 << 16) -> pd.DataFrame:
+    """
+    只读取CSV文件的表头和最后n_rows行
+    :param file_path: CSV文件路径
+    :param n_rows: 读取的行数
+    :param block_size: 从文件末尾向前读取的块大小
+    :return: DataFrame
+    """
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        header_end = f.tell()
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > header_end and tail.count(b'\n') <= n_rows:
+            step = min(block_size, position - header_end)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+    lines = tail.splitlines()[-n_rows:] if n_rows > 0 else []
+    return pd.read_csv(io.BytesIO(header + b'\n'.join(lines)))
+
+
+def _load_tail(stock_code, name, source, rows):
+    kind, path = source
+    if kind == 'panel':
+        if path not in _panel_cache:
+            _panel_cache[path] = StockPanel(path)
+        return _panel_cache[path].get_stock_data(stock_code, name, last_rows=rows)
+    df = read_csv_tail(os.path.join(path, f"{stock_code}.csv"), rows)
+    return StockData.from_columns(stock_code, name, StockData.compact_columns(df), path)
+
+
+def _strategy_label(strategy) -> str:
+    """
+    策略的名称和构造参数，如MAStrategy(ratio1=0.98,ratio2=1.03,period=W,ma_period=10)，
+    同一策略类的不同参数在结果中可以区分
+    """
+    names = [name for name in inspect.signature(type(strategy).__init__).parameters
+             if name != 'self' and hasattr(strategy, name)]
+    params = ','.join(f"{name}={getattr(strategy, name)}" for name in names)
+    return f"{type(strategy).__name__}({params})"
+
+
+def _scan_symbol(task):
+    stock_code, name, strategies, source, recent_bars, tolerance = task
+    results = []
+    for strategy in strategies:
+        period = getattr(strategy, 'period', 'D')
+        days_per_bar = TRADING_DAYS_PER_PERIOD.get(period, 1)
+        # 多取一个周期，避免最早的不完整周期影响预热
+        rows = (strategy.lookback_bars(tolerance) + recent_bars + 1) * days_per_bar
+        try:
+            stock_data = _load_tail(stock_code, name, source, rows)
+            signals = strategy._generate_signals(strategy._process_data(stock_data))
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            print(f"扫描股票 {stock_code} 时发生错误：{e}")
+            continue
+        recent = signals.iloc[-recent_bars:]
+        recent = recent[recent['SIGNAL'] != 0]
+        if len(recent) == 0:
+            continue
+        strength = strategy.signal_strength(recent)
+        latest = recent.iloc[-1]
+        indicator = strategy.new_indicator_columns[0]
+        results.append({
+            '股票代码': stock_code,
+            '股票名称': name,
+            '策略': _strategy_label(strategy),
+            '日期': latest['日期'],
+            '收盘': latest['收盘'],
+            'SIGNAL': int(latest['SIGNAL']),
+            '指标': indicator,
+            '指标值': latest[indicator],
+            '信号强度': float(pd.Series(strength).iloc[-1]),
+        })
+    return results
+
+
+class SignalScanner:
+    def __init__(self, strategies, data_dir: str = "resource/stock_price", panel_dir: str = None,
+                 recent_bars: int = 1, tolerance: float = 1e-4, max_workers: int = None):
+        """
+        初始化全市场最新信号扫描器，只读取每个策略预热所需的最近K线
+        :param strategies: 策略对象列表，需实现lookback_bars
+        :param data_dir: CSV数据目录
+        :param panel_dir: 面板目录，提供时从内存映射面板读取
+        :param recent_bars: 检查最近几根K线（按策略周期计）上的信号
+        :param tolerance: 指数移动平均允许的初始值残留权重
+        :param max_workers: 进程数，为1时在当前进程中扫描
+        """
+        self.strategies = list(strategies)
+        self.source = ('panel', panel_dir) if panel_dir else ('csv', data_dir)
+        self.recent_bars = recent_bars
+        self.tolerance = tolerance
+        self.max_workers = max_workers
+
+    def _default_universe(self):
+        kind, path = self.source
+        if kind == 'panel':
+            return {code: '' for code in StockPanel(path).symbols}
+        return {f[:-len('.csv')]: '' for f in sorted(os.listdir(path)) if f.endswith('.csv')}
+
+    def scan(self, stock_codes: dict = None) -> pd.DataFrame:
+        """
+        扫描股票的最新信号
+        :param stock_codes: 股票代码字典，格式为 {code: name}，默认扫描数据目录中的全部股票
+        :return: DataFrame，按日期从新到旧、买入信号优先、信号强度从大到小排序
+        """
+        if stock_codes is None:
+            stock_codes = self._default_universe()
+        tasks = [(code, name, self.strategies, self.source, self.recent_bars, self.tolerance)
+                 for code, name in stock_codes.items()]
+
+        if self.max_workers == 1 or len(tasks) <= 1:
+            batches = map(_scan_symbol, tasks)
+            rows = [row for batch in batches for row in batch]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                chunksize = max(1, len(tasks) // ((self.max_workers or os.cpu_count() or 1) * 4))
+                rows = [row for batch in executor.map(_scan_symbol, tasks, chunksize=chunksize)
+                        for row in batch]
+
+        columns = ['股票代码', '股票名称', '策略', '日期', '收盘', 'SIGNAL', '指标', '指标值', '信号强度']
+        result = pd.DataFrame(rows, columns=columns)
+        if len(result) == 0:
+            return result
+        result = result.sort_values(['日期', 'SIGNAL', '信号强度'], ascending=[False, False, False])
+        return result.reset_index(drop=True)
@@ -1,29 +1,231 @@
+import hashlib
+import numpy as np
 import pandas as pd
 import os
 from stock_processor import StockDataProcessor
 from stock_data_downloader import StockDownloader
 
+# 紧凑模式读取的列及其存储类型，其余列（股票代码、振幅、涨跌幅、涨跌额、换手率）不读取
+# day: 以1970-01-01为起点的int32天数; price: 可无损还原时为float32，否则为float64
+COMPACT_SCHEMA = {
+    '日期': 'day',
+    '开盘': 'price',
+    '收盘': 'price',
+    '最高': 'price',
+    '最低': 'price',
+    '成交量': 'int32',
+    '成交额': 'float64',
+}
+# 价格的小数位数，float32价格按此位数还原
+PRICE_DECIMALS = 3
+
+
 class StockData:
-    def __init__(self, stock_code: str, name: str, data_dir: str = "resource/stock_price", force_update: bool = False):
+    def __init__(self, stock_code: str, name: str, data_dir: str = "resource/stock_price", force_update: bool = False,
+                 compact: bool = False, offline: bool = False, store=None):
         """
         初始化股票数据对象
         :param stock_code: 股票代码
         :param name: 股票名称
         :param data_dir: 数据存储目录
         :param force_update: 是否强制更新数据
+        :param compact: 是否使用紧凑模式，只按COMPACT_SCHEMA保存必要的列，使用df时才还原为DataFrame
+        :param offline: 离线模式，只使用本地数据，从不下载
+        :param store: PartitionedPriceStore，提供时通过分区存储下载和读取，不使用data_dir中的CSV
         """
         self.stock_code = stock_code
         self.name = name
         self.data_dir = data_dir
+        self._columns = None
+        self._df = None
         
         # 下载或更新数据
-        downloader = StockDownloader(self.data_dir)
-        if force_update or not downloader.is_data_fresh(self.stock_code):
+        downloader = StockDownloader(self.data_dir, offline=offline, store=store)
+        if offline:
+            if not downloader.is_data_exists(self.stock_code):
+                raise FileNotFoundError(f"离线模式下没有股票 {self.stock_code} 的本地数据")
+        elif force_update or not downloader.is_data_fresh(self.stock_code):
             success = downloader.download_stock_data(self.stock_code, force_update)
             if not success:
                 raise FileNotFoundError(f"无法获取股票 {self.stock_code} 的数据")
             
-        self.df = self._load_data_from_csv()
+        if store is not None:
+            df = store.read(self.stock_code)
+            if compact:
+                self._columns = self.compact_columns(df)
+            else:
+                self.df = df
+        elif compact:
+            self._columns = self._load_compact_from_csv()
+        else:
+            self.df = self._load_data_from_csv()
+
+    @classmethod
+    def from_columns(cls, stock_code: str, name: str, columns: dict, data_dir: str = None):
+        """
+        由已加载的列数组创建紧凑模式的股票数据对象，不读取文件也不下载，数组不会被复制
+        :param stock_code: 股票代码
+        :param name: 股票名称
+        :param columns: 列名到numpy数组的字典，'日期'为int32天数，其余列名与COMPACT_SCHEMA一致
+        :param data_dir: 数据存储目录
+        :return: StockData对象
+        """
+        missing_columns = [col for col in ['日期', '开盘', '最高', '最低', '收盘'] if col not in columns]
+        if missing_columns:
+            raise ValueError(f"缺少必要的列：{missing_columns}")
+        stock = cls.__new__(cls)
+        stock.stock_code = stock_code
+        stock.name = name
+        stock.data_dir = data_dir
+        stock._columns = dict(columns)
+        stock._df = None
+        return stock
+
+    @property
+    def df(self) -> pd.DataFrame:
+        if self._df is None and self._columns is not None:
+            self._df = self._decode_columns(self._columns)
+        return self._df
+
+    @df.setter
+    def df(self, value):
+        self._df = value
+
+    @property
+    def is_compact(self) -> bool:
+        return self._columns is not None
+
+    def release(self):
+        """紧凑模式下丢弃已还原或处理过的DataFrame，恢复为原始的紧凑数据"""
+        if self._columns is None:
+            raise ValueError("只有紧凑模式的数据可以释放DataFrame")
+        self._df = None
+        return self
+
+    def memory_usage(self) -> int:
+        """
+        统计当前对象占用的内存
+        :return: 字节数，包括紧凑数据和已还原的DataFrame
+        """
+        total = 0
+        if self._columns is not None:
+            total += sum(np.asarray(values).nbytes for values in self._columns.values())
+        if self._df is not None:
+            total += int(self._df.memory_usage(deep=True).sum())
+        return total
+
+    def to_columns(self) -> dict:
+        """
+        获取紧凑的列数组，紧凑模式下直接返回原数组，否则由当前df转换
+        :return: 列名到numpy数组的字典
+        """
+        if self._columns is not None and self._df is None:
+            return dict(self._columns)
+        return self.compact_columns(self.df)
+
+    def data_hash(self) -> str:
+        """
+        计算当前数据内容的哈希，作为数据版本，用于缓存回测结果。
+        总是对compact_columns格式的列数组计算，同样的数据不论是否已还原df、是否为紧凑模式，哈希都相同
+        :return: 十六进制字符串
+        """
+        digest = hashlib.sha256()
+        columns = self._canonical_columns()
+        for col in sorted(columns):
+            values = np.ascontiguousarray(columns[col])
+            digest.update(col.encode('utf-8'))
+            digest.update(str(values.dtype).encode('utf-8'))
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    def _canonical_columns(self) -> dict:
+        """与compact_columns(self.df)相同的列数组，紧凑模式下不还原df"""
+        if self._df is not None or self._columns is None:
+            return self.compact_columns(self.df)
+        # 逐列按_decode_columns还原再按compact_columns转换：去掉收盘价缺失的行，只保留COMPACT_SCHEMA中的列
+        raw = self._columns
+        valid = ~np.isnan(np.asarray(raw['收盘'], dtype=np.float64))
+        days = np.asarray(raw['日期'])[valid].astype(np.int32)
+        order = np.argsort(days, kind='stable')
+        columns = {'日期': days[order]}
+        for col, kind in COMPACT_SCHEMA.items():
+            if col == '日期' or col not in raw:
+                continue
+            values = np.asarray(raw[col])[valid][order]
+            if kind == 'price' and values.dtype == np.float32:
+                values = np.round(values.astype(np.float64), PRICE_DECIMALS)
+            columns[col] = self._compact_values(kind, values)
+        return columns
+
+    def _load_compact_from_csv(self) -> dict:
+        file_path = os.path.join(self.data_dir, f"{self.stock_code}.csv")
+
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"找不到股票{self.stock_code}的数据文件：{file_path}")
+
+        try:
+            df = pd.read_csv(file_path, usecols=lambda col: col in COMPACT_SCHEMA)
+        except pd.errors.EmptyDataError:
+            raise ValueError(f"数据文件 {file_path} 是空的")
+        except pd.errors.ParserError:
+            raise ValueError(f"数据文件 {file_path} 格式不正确")
+
+        required_columns = ['日期', '开盘', '最高', '最低', '收盘']
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"数据文件缺少必要的列：{missing_columns}")
+
+        return self.compact_columns(df)
+
+    @staticmethod
+    def compact_columns(df: pd.DataFrame) -> dict:
+        """
+        按COMPACT_SCHEMA将原始行情DataFrame转换为紧凑的列数组，并按日期排序
+        :param df: 包含'日期'及价格列的DataFrame
+        :return: 列名到numpy数组的字典
+        """
+        days = pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]').astype(np.int32)
+        order = np.argsort(days, kind='stable')
+        columns = {'日期': days[order]}
+        for col, kind in COMPACT_SCHEMA.items():
+            if col == '日期' or col not in df.columns:
+                continue
+            columns[col] = StockData._compact_values(kind, df[col].to_numpy()[order])
+        return columns
+
+    @staticmethod
+    def _compact_values(kind: str, values: np.ndarray) -> np.ndarray:
+        if kind == 'price':
+            values = values.astype(np.float64)
+            narrow = values.astype(np.float32)
+            # 只有float32能按小数位数无损还原时才降精度
+            restored = np.round(narrow.astype(np.float64), PRICE_DECIMALS)
+            if np.array_equal(restored, values, equal_nan=True):
+                values = narrow
+        elif kind == 'int32':
+            if np.issubdtype(values.dtype, np.integer) and \
+                    (len(values) == 0 or np.abs(values).max() <= np.iinfo(np.int32).max):
+                values = values.astype(np.int32)
+        else:
+            values = values.astype(kind)
+        return values
+
+    @staticmethod
+    def _decode_columns(columns: dict) -> pd.DataFrame:
+        data = {'日期': pd.to_datetime(np.asarray(columns['日期']).astype('datetime64[D]'))}
+        for col, values in columns.items():
+            if col == '日期':
+                continue
+            values = np.asarray(values)
+            if COMPACT_SCHEMA.get(col) == 'price':
+                values = values.astype(np.float64)
+                if np.asarray(columns[col]).dtype == np.float32:
+                    values = np.round(values, PRICE_DECIMALS)
+            data[col] = values
+        df = pd.DataFrame(data)
+        # 去掉收盘价缺失的行，对齐的面板数据中停牌日期的价格为NaN
+        df = df[df['收盘'].notna()]
+        return df.reset_index(drop=True)
     
     def _load_data_from_csv(self) -> pd.DataFrame:
         file_path = os.path.join(self.data_dir, f"{self.stock_code}.csv")
@@ -69,6 +271,10 @@ class StockData:
     def aggregate_by_period(self, period='D'):
         self.df = StockDataProcessor.aggregate_by_period(self.df, period)
         return self
+
+    def calculate_indicators(self, ma_periods=(), kdj=None, macd=None, adx=None):
+        self.df = StockDataProcessor.calculate_indicators(self.df, ma_periods, kdj, macd, adx)
+        return self
     
     def __str__(self) -> str:
         return f"股票代码：{self.stock_code}\n" \
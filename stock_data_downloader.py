@@ -1,37 +1,270 @@
+import json
 import os
+import threading
 import time
 import random
-import akshare as ak
+from contextlib import contextmanager
 from datetime import datetime
+import numpy as np
+import pandas as pd
+from trading_calendar import TradingCalendar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 增量下载时多取的已保存K线的天数，用于核对前复权价格的基准是否因除权而变化
+ADJUST_CHECK_DAYS = 30
+
+# 文件锁只在进程之间互斥，同一进程内的线程另外用线程锁互斥
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    跨线程、跨进程的排他文件锁
+    :param lock_path: 锁文件路径
+    :return: 以读写模式打开的锁文件
+    """
+    lock_path = os.path.abspath(lock_path)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(lock_path, threading.Lock())
+    with thread_lock:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            try:
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_csv(df: pd.DataFrame, file_path: str):
+    """先写入临时文件再重命名，读取方不会看到写了一半的文件"""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_csv(tmp_path, index=False, encoding='utf-8')
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_last_date(file_path: str):
+    """读取行情CSV文件最后一行的日期，文件为空时返回None"""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if len(lines) == 0 or (size <= 4096 and len(lines) == 1):
+        return None
+    return lines[-1].split(b',')[0].decode('utf-8')
+
+
+class PriceManifest:
+    def __init__(self, data_dir: str = "resource/stock_price", store=None):
+        """
+        股价数据清单，记录每只股票已保存的最后一根K线的日期，
+        以及最近一次下载时已确认到的交易日（数据源在节假日等情况下没有新的K线）
+        :param data_dir: 数据存储目录，清单保存为其中的manifest.json
+        :param store: PartitionedPriceStore，提供时清单中没有的股票从分区存储而不是CSV读取最后日期
+        """
+        self.path = os.path.join(data_dir, 'manifest.json')
+        self.lock_path = os.path.join(data_dir, '.locks', 'manifest.lock')
+        self.data_dir = data_dir
+        self.store = store
+        self.last_dates = {}
+        self.checked_days = {}
+        self.reload()
+
+    def reload(self):
+        """重新读取清单文件，获取其他进程的更新"""
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if 'last_dates' in data:
+                self.last_dates = data['last_dates']
+                self.checked_days = data.get('checked_through', {})
+            else:
+                # 旧格式的清单只有股票代码到最后日期的映射
+                self.last_dates = data
+                self.checked_days = {}
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'last_dates': self.last_dates, 'checked_through': self.checked_days}, f,
+                      ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, stock_code: str):
+        """
+        获取股票最后一根K线的日期，清单中没有但文件存在时读取文件末尾并记录
+        :param stock_code: 股票代码
+        :return: 日期字符串，没有数据时返回None
+        """
+        return self.get_many([stock_code])[stock_code]
+
+    def _read_last_date(self, stock_code: str):
+        if self.store is not None:
+            return self.store.last_date(stock_code)
+        file_path = os.path.join(self.data_dir, f"{stock_code}.csv")
+        return read_last_date(file_path) if os.path.exists(file_path) else None
+
+    def get_many(self, stock_codes) -> dict:
+        """
+        获取多只股票最后一根K线的日期，清单中没有的股票读取文件末尾（或分区存储）后一次写入清单
+        :param stock_codes: 股票代码列表
+        :return: {股票代码: 日期字符串}，没有数据时为None
+        """
+        found = {}
+        for stock_code in stock_codes:
+            if stock_code in self.last_dates:
+                continue
+            last_date = self._read_last_date(stock_code)
+            if last_date is not None:
+                found[stock_code] = last_date
+        if found:
+            self.record_many(found)
+        return {stock_code: self.last_dates.get(stock_code) for stock_code in stock_codes}
+
+    def checked_through(self, stock_code: str):
+        """最近一次下载时已确认到的交易日，没有记录时返回None"""
+        return self.checked_days.get(stock_code)
+
+    def record(self, stock_code: str, last_date=None, checked_through=None):
+        """
+        记录股票最后一根K线的日期和已确认到的交易日，为None的项不修改
+        :param stock_code: 股票代码
+        :param last_date: 最后一根K线的日期
+        :param checked_through: 已确认数据源没有更新K线的交易日
+        """
+        self.record_many({} if last_date is None else {stock_code: last_date},
+                         {} if checked_through is None else {stock_code: checked_through})
+
+    def record_many(self, last_dates: dict, checked_through: dict = None):
+        """一次记录多只股票，整个清单只写入一次"""
+        # 先合并其他进程写入的记录，再整体替换清单文件
+        with file_lock(self.lock_path):
+            self.reload()
+            for stock_code, last_date in last_dates.items():
+                self.last_dates[stock_code] = pd.Timestamp(last_date).strftime('%Y-%m-%d')
+            for stock_code, day in (checked_through or {}).items():
+                self.checked_days[stock_code] = pd.Timestamp(day).strftime('%Y-%m-%d')
+            self.save()
+
+    def forget(self, stock_code: str):
+        """删除股票的记录，例如文件被隔离后，下次使用时重新下载"""
+        with file_lock(self.lock_path):
+            self.reload()
+            removed = self.last_dates.pop(stock_code, None) is not None
+            removed = self.checked_days.pop(stock_code, None) is not None or removed
+            if removed:
+                self.save()
+
 
 class StockDownloader:
-    def __init__(self, data_dir: str = "resource/stock_price"):
+    def __init__(self, data_dir: str = "resource/stock_price", offline: bool = False,
+                 calendar: TradingCalendar = None, store=None):
+        """
+        :param data_dir: 数据存储目录
+        :param offline: 离线模式，只使用本地数据，从不下载
+        :param calendar: 交易日历，默认使用本地交易日历
+        :param store: PartitionedPriceStore，提供时只下载最后一根K线之后的数据并追加到分区存储，不写CSV；
+                      前复权基准变化时重新下载全部历史。清单保存在存储目录中，与CSV的清单互不影响
+        """
         self.data_dir = data_dir
+        self.offline = offline
+        self.store = store
+        self._calendar = calendar
+        self._manifest = None
         self._ensure_directory_exists()
         
     def _ensure_directory_exists(self):
         """确保数据目录存在"""
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
+
+    @property
+    def calendar(self) -> TradingCalendar:
+        if self._calendar is None:
+            self._calendar = TradingCalendar(data_dir=self.data_dir)
+            if not self.offline:
+                self._calendar.ensure_covers()
+        return self._calendar
+
+    @property
+    def manifest(self) -> PriceManifest:
+        if self._manifest is None:
+            if self.store is not None:
+                self._manifest = PriceManifest(self.store.root, self.store)
+            else:
+                self._manifest = PriceManifest(self.data_dir)
+        return self._manifest
     
     def _get_file_path(self, stock_code: str) -> str:
         """获取股票数据文件路径"""
         return os.path.join(self.data_dir, f"{stock_code}.csv")
+
+    def _get_lock_path(self, stock_code: str) -> str:
+        """获取股票下载锁文件路径，锁文件中记录最近一次下载完成的时间戳"""
+        return os.path.join(self.data_dir, '.locks', f"{stock_code}.lock")
     
     def is_data_exists(self, stock_code: str) -> bool:
         """检查股票数据是否已经存在"""
+        if self.store is not None:
+            return self.store.last_date(stock_code) is not None
         file_path = self._get_file_path(stock_code)
         return os.path.exists(file_path)
     
-    def is_data_fresh(self, stock_code: str, max_days_old: int = 1) -> bool:
-        """检查数据是否足够新鲜（默认1天）"""
-        if not self.is_data_exists(stock_code):
-            return False
-            
-        file_path = self._get_file_path(stock_code)
-        file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-        days_old = (datetime.now() - file_mtime).days
-        return days_old <= max_days_old
+    def is_data_fresh(self, stock_code: str, max_days_old: int = 0, now: datetime = None) -> bool:
+        """
+        检查数据是否足够新鲜：最后一根K线是否为最近一个已收盘的交易日
+        :param stock_code: 股票代码
+        :param max_days_old: 允许落后的交易日数
+        :param now: 当前时间，默认为系统时间
+        """
+        return stock_code not in self.stale_stocks([stock_code], max_days_old, now)
+
+    def stale_stocks(self, stock_codes, max_days_old: int = 0, now: datetime = None) -> list:
+        """
+        根据清单一次判断多只股票的数据是否需要更新
+        :param stock_codes: 股票代码列表
+        :param max_days_old: 允许落后的交易日数
+        :param now: 当前时间，默认为系统时间
+        :return: 需要更新的股票代码列表
+        """
+        required_day = self.calendar.latest_completed_trading_day(now)
+        for _ in range(max_days_old):
+            required_day = self.calendar.previous_trading_day(required_day, inclusive=False)
+        required = required_day.strftime('%Y-%m-%d')
+        stale = []
+        for stock_code, last_date in self.manifest.get_many(stock_codes).items():
+            if last_date is None:
+                stale.append(stock_code)
+                continue
+            checked = self.manifest.checked_through(stock_code)
+            if max(last_date, checked or last_date) < required:
+                stale.append(stock_code)
+        return stale
     
     def download_stock_data(self, stock_code: str, force_update: bool = False) -> bool:
         """
@@ -40,32 +273,104 @@ class StockDownloader:
         :param force_update: 是否强制更新，即使数据已存在
         :return: 下载是否成功
         """
-        if not force_update and self.is_data_fresh(stock_code):
+        if self.offline:
+            if not self.is_data_exists(stock_code):
+                print(f"离线模式下没有股票 {stock_code} 的本地数据")
+                return False
             return True
-        
+
+        requested_at = time.time()
+        # 同一只股票同时只有一个调用方下载，其他调用方等待后直接使用下载结果
+        with file_lock(self._get_lock_path(stock_code)) as lock_file:
+            # 等锁期间其他进程可能已经更新了清单
+            self._manifest = None
+            if not force_update and self.is_data_fresh(stock_code):
+                return True
+            lock_file.seek(0)
+            completed_at = lock_file.read().strip()
+            if force_update and completed_at and float(completed_at) >= requested_at:
+                # 等锁期间已有其他调用方完成了强制更新
+                return True
+            if not self._download(stock_code, force_update):
+                return False
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(time.time()))
+            lock_file.flush()
+
+        # 添加随机延时，避免请求过于频繁
+        time.sleep(random.uniform(3, 10))
+        return True
+
+    @staticmethod
+    def _fetch(stock_code: str, start_date: str) -> pd.DataFrame:
+        # akshare导入较慢，只在真正下载时导入
+        import akshare as ak
+
+        return ak.stock_zh_a_hist(
+            symbol=stock_code,
+            start_date=start_date,
+            end_date=datetime.now().strftime('%Y%m%d'),
+            adjust='qfq',  # 前复权
+            period='daily'
+        )
+
+    def _same_adjustment(self, stock_code: str, df: pd.DataFrame, last_date) -> bool:
+        """
+        核对新下载数据与已保存数据重叠部分的收盘价。前复权价格在每次除权后整体重算，
+        不一致时新K线与已保存的K线不在同一复权基准上，不能直接追加
+        """
+        dates = pd.to_datetime(df['日期'])
+        if not (dates > last_date).any():
+            # 没有新的K线，不追加，已保存的数据仍在同一基准上
+            return True
+        stored = self.store.read(stock_code, dates.min(), last_date, columns=['收盘'])
+        fetched = pd.DataFrame({'日期': dates, '收盘': df['收盘'].to_numpy(dtype=float)})
+        overlap = stored.merge(fetched, on='日期', suffixes=('_已保存', '_新'))
+        if len(overlap) == 0:
+            # 重叠区间内没有K线（如长期停牌），无法核对
+            return False
+        return bool(np.allclose(overlap['收盘_已保存'], overlap['收盘_新'], rtol=0, atol=1e-6))
+
+    def _download(self, stock_code: str, force_update: bool) -> bool:
+        """从数据源下载并保存，调用方需持有该股票的下载锁"""
         try:
             # 设置下载参数
             start_date = '20140101'  # 可以通过参数配置
-            end_date = datetime.now().strftime('%Y%m%d')
-            
+            last_date = None
+            if self.store is not None and not force_update:
+                last_date = self.store.last_date(stock_code)
+                if last_date is not None:
+                    start_date = (last_date - pd.Timedelta(days=ADJUST_CHECK_DAYS)).strftime('%Y%m%d')
+
             print(f"正在下载股票 {stock_code} 的历史行情数据...")
-            stock_price_df = ak.stock_zh_a_hist(
-                symbol=stock_code,
-                start_date=start_date,
-                end_date=end_date,
-                adjust='qfq',  # 前复权
-                period='daily'
-            )
-            
+            stock_price_df = self._fetch(stock_code, start_date)
+
             # 保存数据
-            file_path = self._get_file_path(stock_code)
-            stock_price_df.to_csv(file_path, index=False, encoding='utf-8')
+            if self.store is not None and last_date is not None:
+                if not self._same_adjustment(stock_code, stock_price_df, last_date):
+                    print(f"股票 {stock_code} 的复权价格已变化，重新下载全部历史")
+                    stock_price_df = self._fetch(stock_code, '20140101')
+                    if len(stock_price_df) > 0:
+                        self.store.write(stock_code, stock_price_df)
+                else:
+                    new_bars = stock_price_df[pd.to_datetime(stock_price_df['日期']) > last_date]
+                    if len(new_bars) > 0:
+                        self.store.append(stock_code, new_bars)
+            elif len(stock_price_df) > 0:
+                if self.store is not None:
+                    self.store.write(stock_code, stock_price_df)
+                else:
+                    atomic_write_csv(stock_price_df, self._get_file_path(stock_code))
+            # 记录已确认到的交易日，数据源在这一天没有K线（如日历未覆盖的节假日）时不再重复下载
+            checked = self.calendar.latest_completed_trading_day()
+            if len(stock_price_df) > 0:
+                self.calendar.extend(stock_price_df['日期'])
+                self.manifest.record(stock_code, stock_price_df['日期'].iloc[-1], checked)
+            elif self.manifest.get(stock_code) is not None:
+                self.manifest.record(stock_code, checked_through=checked)
             
             print(f"下载完成股票 {stock_code} 的历史行情数据")
-            
-            # 添加随机延时，避免请求过于频繁
-            time.sleep(random.uniform(3, 10))
-            
             return True
             
         except Exception as e:
@@ -80,13 +385,18 @@ class StockDownloader:
         :return: 下载结果字典
         """
         results = {}
+        stale = set(stock_codes if force_update else self.stale_stocks(stock_codes))
         for stock_code in stock_codes:
-            success = self.download_stock_data(stock_code, force_update)
-            results[stock_code] = success
+            if stock_code in stale:
+                # 不强制更新时已有数据的股票只下载最近的K线并追加
+                results[stock_code] = self.download_stock_data(stock_code, force_update=force_update)
+            else:
+                results[stock_code] = True
         return results
 
 
 if __name__ == '__main__':
+    import akshare as ak
     print("akshare版本:", ak.__version__)
     
     # 测试数据下载
@@ -1,15 +1,156 @@
+import gzip
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import time
 import random
-import akshare as ak
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+def parse_company_page(html: str):
+    """
+    从同花顺F10页面中提取公司基本信息
+    :param html: 页面HTML
+    :return: 公司信息字典，页面中没有公司信息时返回None
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    # 提取公司名称和代码
+    div_name_code = soup.find('div', class_="code fl")
+    if div_name_code is None:
+        return None
+
+    titles = div_name_code.find_all('h1')
+    if len(titles) < 2:
+        return None
+    company_name = titles[0].text.strip()
+    stock_code_found = titles[1].text.strip()
+
+    # 提取公司详细信息
+    company_info = soup.find('table', class_="m_table m_table_db mt10")
+    if not company_info:
+        return None
+    data = {
+        '公司名称': company_name,
+        '股票代码': stock_code_found
+    }
+
+    for tr in company_info.find_all('tr'):
+        for td in tr.find_all('td'):
+            content = td.get_text().strip()
+            feature_name = content.split("：")[0]
+            feature_info = content[(len(feature_name)+1):]
+            feature_value = feature_info.strip().split("\n")[0].strip()
+            data[feature_name] = feature_value
+    if data['公司名称'] == '' or data['股票代码'] == '':
+        return None
+    return data
+
+
+def _parse_cached_page(task):
+    stock_code, page_path, output_path, encoding = task
+    try:
+        with gzip.open(page_path, 'rb') as f:
+            data = parse_company_page(f.read().decode(encoding, errors='replace'))
+    except (OSError, ValueError) as e:
+        print(f"解析公司 {stock_code} 的页面时发生错误：{e}")
+        return stock_code, False
+    if data is None:
+        return stock_code, False
+    pd.DataFrame([data]).to_csv(output_path, index=False, encoding='utf-8')
+    return stock_code, True
+
+
+# 抓取状态的有效期（天），过期后重新抓取
+CRAWL_TTL_DAYS = {
+    'success': 30,
+    'not_found': 90,
+    'error': 1,
+}
+
+
+class CrawlManifest:
+    def __init__(self, path: str = "resource/company_pages/crawl_manifest.json", ttl_days: dict = None):
+        """
+        全市场抓取清单，记录每个代码的抓取状态（success、not_found、error）和时间
+        :param path: 清单文件路径
+        :param ttl_days: 各状态的有效期（天），默认CRAWL_TTL_DAYS
+        """
+        self.path = path
+        self.ttl_days = dict(CRAWL_TTL_DAYS, **(ttl_days or {}))
+        self.entries = {}
+        self._dirty = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
+
+    def needs_crawl(self, stock_code: str, now: datetime = None) -> bool:
+        """
+        判断代码是否需要抓取：没有记录或记录已过期
+        :param stock_code: 股票代码
+        :param now: 当前时间，默认为系统时间
+        """
+        entry = self.entries.get(stock_code)
+        if entry is None:
+            return True
+        now = now or datetime.now()
+        age = now - datetime.fromisoformat(entry['updated_at'])
+        return age.total_seconds() > self.ttl_days.get(entry['status'], 0) * 86400
+
+    def record(self, stock_code: str, status: str, error: str = None, checkpoint_every: int = 20):
+        """
+        记录抓取结果，每checkpoint_every条保存一次
+        :param stock_code: 股票代码
+        :param status: 'success'、'not_found'或'error'
+        :param error: 错误信息
+        :param checkpoint_every: 保存间隔
+        """
+        previous = self.entries.get(stock_code, {})
+        self.entries[stock_code] = {
+            'status': status,
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'attempts': previous.get('attempts', 0) + 1,
+            'error': error,
+        }
+        self._dirty += 1
+        if self._dirty >= checkpoint_every:
+            self.save()
+
+    def counts(self) -> dict:
+        """各状态的代码数量"""
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return counts
 
 
 class CompanyInfoDownloader:
-    def __init__(self, data_dir: str = "resource/company_info"):
+    def __init__(self, data_dir: str = "resource/company_info", page_dir: str = "resource/company_pages"):
+        """
+        :param data_dir: 解析后的公司信息目录
+        :param page_dir: 原始页面缓存目录，保存压缩的页面和抓取元数据
+        """
         self.data_dir = data_dir
+        self.page_dir = page_dir
         self._ensure_directory_exists()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -17,78 +158,212 @@ class CompanyInfoDownloader:
         
     def _ensure_directory_exists(self):
         """确保数据目录存在"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
+        for directory in (self.data_dir, self.page_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
     
     def _get_file_path(self, stock_code: str) -> str:
         """获取公司信息文件路径"""
         return os.path.join(self.data_dir, f"{stock_code}.csv")
+
+    def _get_page_path(self, stock_code: str) -> str:
+        """获取原始页面缓存路径"""
+        return os.path.join(self.page_dir, f"{stock_code}.html.gz")
+
+    def _get_page_meta_path(self, stock_code: str) -> str:
+        """获取页面抓取元数据路径"""
+        return os.path.join(self.page_dir, f"{stock_code}.json")
     
     def is_data_exists(self, stock_code: str) -> bool:
         """检查公司信息是否已经存在"""
         file_path = self._get_file_path(stock_code)
         return os.path.exists(file_path)
+
+    def is_page_cached(self, stock_code: str) -> bool:
+        """检查原始页面是否已经缓存"""
+        return os.path.exists(self._get_page_path(stock_code))
+
+    def load_page_meta(self, stock_code: str) -> dict:
+        """
+        加载页面抓取元数据
+        :return: 包含url、fetched_at、status、etag、last_modified、encoding的字典，没有缓存时返回None
+        """
+        meta_path = self._get_page_meta_path(stock_code)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_page_meta(self, stock_code: str, meta: dict):
+        meta_path = self._get_page_meta_path(stock_code)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def fetch_company_page(self, stock_code: str, force_update: bool = False) -> int:
+        """
+        抓取同花顺F10页面并压缩保存原始响应，已缓存时发送条件请求
+        :param stock_code: 股票代码
+        :param force_update: 是否忽略缓存，发送普通请求
+        :return: HTTP状态码，304表示页面未变化
+        """
+        url = f"https://basic.10jqka.com.cn/{stock_code}/"
+        headers = dict(self.headers)
+        meta = self.load_page_meta(stock_code)
+        if meta and not force_update and self.is_page_cached(stock_code):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        print(f"正在抓取公司 {stock_code} 的F10页面...")
+        response = requests.get(url, headers=headers)
+        fetched_at = datetime.now().isoformat(timespec='seconds')
+
+        if response.status_code == 304 and meta:
+            meta['fetched_at'] = fetched_at
+            self._save_page_meta(stock_code, meta)
+            return response.status_code
+
+        if response.status_code == 200:
+            page_path = self._get_page_path(stock_code)
+            tmp_path = page_path + '.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, page_path)
+
+        self._save_page_meta(stock_code, {
+            'url': url,
+            'fetched_at': fetched_at,
+            'status': response.status_code,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'encoding': 'gbk',
+        })
+        return response.status_code
+
+    def load_cached_page(self, stock_code: str) -> str:
+        """
+        读取缓存的原始页面
+        :return: 页面HTML，没有缓存时返回None
+        """
+        if not self.is_page_cached(stock_code):
+            return None
+        meta = self.load_page_meta(stock_code) or {}
+        with gzip.open(self._get_page_path(stock_code), 'rb') as f:
+            return f.read().decode(meta.get('encoding', 'gbk'), errors='replace')
+
+    def parse_company_info(self, stock_code: str) -> bool:
+        """
+        从缓存的页面解析公司信息并保存
+        :param stock_code: 股票代码
+        :return: 解析是否成功
+        """
+        html = self.load_cached_page(stock_code)
+        if html is None:
+            return False
+        data = parse_company_page(html)
+        if data is None:
+            print(f"未找到公司 {stock_code} 的信息")
+            return False
+        df = pd.DataFrame([data])
+        df.to_csv(self._get_file_path(stock_code), index=False, encoding='utf-8')
+        print(f"成功解析公司 {stock_code} ({data['公司名称']}) 的基本信息")
+        return True
+
+    def parse_cached_pages(self, stock_codes: list = None, max_workers: int = None) -> dict:
+        """
+        在进程池中重新解析全部缓存的页面，不访问网络
+        :param stock_codes: 股票代码列表，默认为全部缓存的页面
+        :param max_workers: 进程数，默认为CPU核数
+        :return: 解析结果字典
+        """
+        if stock_codes is None:
+            suffix = '.html.gz'
+            stock_codes = sorted(f[:-len(suffix)] for f in os.listdir(self.page_dir) if f.endswith(suffix))
+        tasks = []
+        for stock_code in stock_codes:
+            if not self.is_page_cached(stock_code):
+                continue
+            meta = self.load_page_meta(stock_code) or {}
+            tasks.append((stock_code, self._get_page_path(stock_code),
+                          self._get_file_path(stock_code), meta.get('encoding', 'gbk')))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return dict(executor.map(_parse_cached_page, tasks, chunksize=max(1, len(tasks) // 64)))
     
-    def download_company_info(self, stock_code: str) -> bool:
+    def _crawl_company(self, stock_code: str, force_update: bool = False, refresh: bool = False):
+        """
+        抓取并解析单个代码
+        :param force_update: 是否忽略页面缓存，发送普通请求
+        :param refresh: 页面已缓存时是否重新验证，发送条件请求，页面未变化时服务器返回304
+        :return: (状态, 错误信息)，状态为'success'、'not_found'或'error'
         """
-        下载单个公司信息
+        try:
+            if force_update or refresh or not self.is_page_cached(stock_code):
+                status = self.fetch_company_page(stock_code, force_update)
+                # 添加随机延时，避免请求过于频繁
+                time.sleep(0.5)
+                if status == 404:
+                    return 'not_found', None
+                if status not in (200, 304):
+                    return 'error', f"状态码：{status}"
+            if self.parse_company_info(stock_code):
+                return 'success', None
+            return 'not_found', None
+        except Exception as e:
+            return 'error', str(e)
+
+    def crawl_companies(self, stock_codes, manifest: CrawlManifest = None, checkpoint_every: int = 20,
+                        force_update: bool = False) -> dict:
+        """
+        按抓取清单批量抓取，可在中断后继续：跳过未过期的成功和不存在的代码，只重试出错或过期的代码
+        :param stock_codes: 股票代码列表
+        :param manifest: 抓取清单，默认保存在page_dir中
+        :param checkpoint_every: 每抓取多少个代码保存一次清单
+        :param force_update: 是否忽略清单和页面缓存，全部重新抓取
+        :return: 本次抓取的 {状态: 数量} 字典，跳过的代码计入'skipped'
+        """
+        if manifest is None:
+            manifest = CrawlManifest(os.path.join(self.page_dir, 'crawl_manifest.json'))
+        results = {'skipped': 0}
+        try:
+            for stock_code in stock_codes:
+                if not force_update and not manifest.needs_crawl(stock_code):
+                    results['skipped'] += 1
+                    continue
+                # 清单过期时用条件请求重新验证已缓存的页面，未变化时只需一次304响应
+                refresh = stock_code in manifest.entries
+                status, error = self._crawl_company(stock_code, force_update, refresh)
+                if error:
+                    print(f"抓取公司 {stock_code} 信息时发生错误：{error}")
+                manifest.record(stock_code, status, error, checkpoint_every)
+                results[status] = results.get(status, 0) + 1
+        finally:
+            manifest.save()
+        return results
+
+    def download_company_info(self, stock_code: str, force_update: bool = False) -> bool:
+        """
+        下载单个公司信息：抓取页面（已缓存时跳过）并解析
         :param stock_code: 股票代码
         :param force_update: 是否强制更新，即使数据已存在
         :return: 下载是否成功
         """
 
-        if self.is_data_exists(stock_code):
+        if not force_update and self.is_data_exists(stock_code):
             print(f"公司 {stock_code} 的信息已存在")
             return True
         try:
-            url = f"https://basic.10jqka.com.cn/{stock_code}/"
-            print(f"正在下载公司 {stock_code} 的基本信息...")
-            
-            response = requests.get(url, headers=self.headers)
-            response.encoding = 'gbk'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 提取公司名称和代码
-            div_name_code = soup.find('div', class_="code fl")
-            if div_name_code is None:
-                print(f"未找到公司 {stock_code} 的信息")
-                return False
-                
-            company_name = div_name_code.find_all('h1')[0].text.strip()
-            stock_code_found = div_name_code.find_all('h1')[1].text.strip()
-            
-            # 提取公司详细信息
-            company_info = soup.find('table', class_="m_table m_table_db mt10")
-            if company_info:
-                data = {
-                    '公司名称': company_name,
-                    '股票代码': stock_code_found
-                }
-                
-                for tr in company_info.find_all('tr'):
-                    for td in tr.find_all('td'):
-                        content = td.get_text().strip()
-                        feature_name = content.split("：")[0]
-                        feature_info = content[(len(feature_name)+1):]
-                        feature_value = feature_info.strip().split("\n")[0].strip()
-                        data[feature_name] = feature_value
-                if data['公司名称'] == '' or data['股票代码'] == '':
-                    print(f"未找到公司 {stock_code} 的信息")
+            if force_update or not self.is_page_cached(stock_code):
+                status = self.fetch_company_page(stock_code, force_update)
+                if status not in (200, 304):
+                    print(f"抓取公司 {stock_code} 的页面失败，状态码：{status}")
                     return False
-                # 保存数据
-                df = pd.DataFrame([data])
-                file_path = self._get_file_path(stock_code)
-                df.to_csv(file_path, index=False, encoding='utf-8')
-                
-                print(f"成功下载公司 {stock_code} ({company_name}) 的基本信息")
-                
                 # 添加随机延时，避免请求过于频繁
                 # time.sleep(random.uniform(2, 5))
                 time.sleep(0.5)
-                
-                return True
-            return False
+            return self.parse_company_info(stock_code)
             
         except Exception as e:
             print(f"下载公司 {stock_code} 信息时发生错误：{e}")
@@ -125,16 +400,23 @@ class CompanyInfoDownloader:
 
 
 if __name__ == '__main__':
+    import sys
+
     downloader = CompanyInfoDownloader()
+    if len(sys.argv) > 1 and sys.argv[1] == 'parse':
+        # 只重新解析缓存的页面，不访问网络: python stock_info_downloader.py parse
+        results = downloader.parse_cached_pages()
+        print(f"解析完成：成功 {sum(results.values())} 个，失败 {len(results) - sum(results.values())} 个")
+        sys.exit(0)
+
     # # SZ
     # for i in range(3044):
     #     stock_code = str(i).zfill(6)
     #     downloader.download_company_info(stock_code)
 
-    # SH
-    for i in range(5400):
-        stock_code = "60" + str(i).zfill(4)
-        downloader.download_company_info(stock_code)
+    # SH，中断后重新运行会跳过已完成和已知不存在的代码
+    stock_codes = ["60" + str(i).zfill(4) for i in range(5400)]
+    print(downloader.crawl_companies(stock_codes))
 
 # # 使用示例
 # stock_code = '000001'  # 平安银行的股票代码
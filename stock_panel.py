@@ -0,0 +1,151 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from stock_data import StockData
+
+# 面板默认保存的字段
+PANEL_FIELDS = ['开盘', '收盘', '最高', '最低', '成交量', '成交额']
+
+
+class StockPanel:
+    """
+    全市场对齐面板，逻辑形状为 (日期, 股票, 字段)，通过numpy.memmap只读打开。
+    磁盘上按 (字段, 股票, 日期) 顺序存放，使每只股票的每个字段都是一段连续内存，
+    读取单只股票时只会访问对应的页面。
+    """
+
+    def __init__(self, panel_dir: str = "resource/stock_panel"):
+        """
+        打开已构建的面板
+        :param panel_dir: 面板目录，由StockPanel.build生成
+        """
+        meta_path = os.path.join(panel_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"找不到面板数据：{meta_path}")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        self.panel_dir = panel_dir
+        self.symbols = meta['symbols']
+        self.fields = meta['fields']
+        self.ranges = {symbol: tuple(bounds) for symbol, bounds in meta['ranges'].items()}
+        self.built_at = meta['built_at']
+        self.dates = np.load(os.path.join(panel_dir, 'dates.npy'), mmap_mode='r')
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+        self._data = np.memmap(os.path.join(panel_dir, 'panel.dat'), dtype=meta['dtype'], mode='r',
+                               shape=(len(self.fields), len(self.symbols), len(self.dates)))
+
+    @staticmethod
+    def build(data_dir: str = "resource/stock_price", panel_dir: str = "resource/stock_panel",
+              fields: list = None, dtype: str = 'float64') -> 'StockPanel':
+        """
+        由CSV股价数据构建对齐的磁盘面板，缺失的K线为NaN
+        :param data_dir: CSV数据目录
+        :param panel_dir: 面板输出目录
+        :param fields: 保存的字段，默认PANEL_FIELDS
+        :param dtype: 面板数据类型
+        :return: 打开的StockPanel
+        """
+        fields = list(fields or PANEL_FIELDS)
+        files = sorted(f for f in os.listdir(data_dir) if f.endswith('.csv'))
+        if not files:
+            raise FileNotFoundError(f"目录 {data_dir} 中没有股价数据")
+
+        frames = {}
+        for file_name in files:
+            symbol = file_name[:-len('.csv')]
+            df = pd.read_csv(os.path.join(data_dir, file_name),
+                             usecols=lambda col: col == '日期' or col in fields)
+            days = pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]').astype(np.int32)
+            frames[symbol] = (days, df)
+
+        dates = np.unique(np.concatenate([days for days, _ in frames.values()])).astype(np.int32)
+        symbols = list(frames)
+
+        os.makedirs(panel_dir, exist_ok=True)
+        tmp_path = os.path.join(panel_dir, 'panel.dat.tmp')
+        data = np.memmap(tmp_path, dtype=dtype, mode='w+', shape=(len(fields), len(symbols), len(dates)))
+        ranges = {}
+        for s, symbol in enumerate(symbols):
+            days, df = frames[symbol]
+            positions = np.searchsorted(dates, days)
+            data[:, s, :] = np.nan
+            for f, field in enumerate(fields):
+                if field in df.columns:
+                    data[f, s, positions] = df[field].to_numpy(dtype=np.float64)
+            ranges[symbol] = [int(positions.min()), int(positions.max()) + 1]
+        data.flush()
+        del data
+
+        np.save(os.path.join(panel_dir, 'dates.npy'), dates)
+        os.replace(tmp_path, os.path.join(panel_dir, 'panel.dat'))
+        meta = {
+            'symbols': symbols,
+            'fields': fields,
+            'dtype': np.dtype(dtype).name,
+            'ranges': ranges,
+            'built_at': pd.Timestamp.now().isoformat(),
+        }
+        with open(os.path.join(panel_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return StockPanel(panel_dir)
+
+    @staticmethod
+    def open_or_build(data_dir: str = "resource/stock_price",
+                      panel_dir: str = "resource/stock_panel") -> 'StockPanel':
+        """
+        打开面板，面板不存在或CSV数据比面板新时重新构建
+        :param data_dir: CSV数据目录
+        :param panel_dir: 面板目录
+        :return: 打开的StockPanel
+        """
+        meta_path = os.path.join(panel_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            built_at = os.path.getmtime(meta_path)
+            csv_files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith('.csv')]
+            if all(os.path.getmtime(path) <= built_at for path in csv_files):
+                return StockPanel(panel_dir)
+        return StockPanel.build(data_dir, panel_dir)
+
+    @property
+    def values(self) -> np.ndarray:
+        """形状为 (日期, 股票, 字段) 的只读视图"""
+        return self._data.transpose(2, 1, 0)
+
+    def field(self, field: str) -> np.ndarray:
+        """
+        获取单个字段的全市场数据
+        :param field: 字段名
+        :return: 形状为 (日期, 股票) 的只读视图
+        """
+        return self._data[self._field_index[field]].T
+
+    def get_stock_data(self, stock_code: str, name: str = '', last_rows: int = None) -> StockData:
+        """
+        获取单只股票的StockData视图，数据不会被复制，直到使用df时才还原为DataFrame
+        :param stock_code: 股票代码
+        :param name: 股票名称
+        :param last_rows: 只取最近的行数，默认取全部
+        :return: 紧凑模式的StockData对象
+        """
+        if stock_code not in self._symbol_index:
+            raise FileNotFoundError(f"面板中没有股票 {stock_code} 的数据")
+        s = self._symbol_index[stock_code]
+        start, end = self.ranges[stock_code]
+        if last_rows is not None:
+            start = max(start, end - last_rows)
+        columns = {'日期': self.dates[start:end]}
+        for f, field in enumerate(self.fields):
+            columns[field] = self._data[f, s, start:end]
+        return StockData.from_columns(stock_code, name, columns)
+
+    def __contains__(self, stock_code) -> bool:
+        return stock_code in self._symbol_index
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __repr__(self) -> str:
+        return f"StockPanel(panel_dir='{self.panel_dir}', symbols={len(self.symbols)}, dates={len(self.dates)})"
@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+from resampler import resample
 
 class StockDataProcessor:
     @staticmethod
@@ -35,20 +37,16 @@ class StockDataProcessor:
         
     @staticmethod
     def aggregate_by_period(df, period='D'):
-        if period not in ['D', 'W', 'M']:
-            raise ValueError("period必须是'D'、'W'或'M'之一")
+        """
+        将日线聚合为更长的周期，成交量、成交额和换手率求和
+        :param df: 日线DataFrame
+        :param period: 'D'、'W'、'2W'、'M'、'Q'等，见resampler.parse_period
+        :return: 以周期末日期为'日期'的DataFrame，只包含df中已有的列
+        """
         if period == 'D':
             return df.copy()
-        rules = {'W': 'W-FRI', 'M': 'M'}
-        resampled = (df.set_index('日期')
-                    .resample(rules[period])
-                    .agg({
-                        '开盘': 'first',
-                        '最高': 'max',
-                        '最低': 'min',
-                        '收盘': 'last',
-                    }))
-        return resampled.dropna().reset_index()
+        resampled = resample(df, [period])[period]
+        return resampled[[col for col in resampled.columns if col in df.columns]]
 
     @staticmethod
     def calculate_macd(df, fast_period=12, slow_period=26, signal_period=9):
@@ -79,4 +77,328 @@ class StockDataProcessor:
         # 计算MACD柱状图（HIST）
         processed_df['MACD_HIST'] = 2 * (processed_df['MACD_DIF'] - processed_df['MACD_DEA'])
         
-        return processed_df
\ No newline at end of file
+        return processed_df
+
+    @staticmethod
+    def rolling_extrema_bank(values, windows, how='max'):
+        """
+        用稀疏表一次计算多个窗口的滚动最大值或最小值
+        
+        参数:
+        values: 一维数组
+        windows: 窗口长度列表
+        how: 'max'或'min'
+        
+        返回:
+        二维数组，形状为(len(values), len(windows))，前window-1行为NaN，与rolling(window).max()/min()一致
+        """
+        values = np.asarray(values, dtype=np.float64)
+        windows = [int(w) for w in windows]
+        reduce = np.fmax if how == 'max' else np.fmin
+        length = len(values)
+        result = np.full((length, len(windows)), np.nan)
+
+        # table[k][i] 为 values[i : i + 2**k] 的极值
+        table = [values]
+        max_window = max(windows, default=1)
+        while 2 ** len(table) <= max_window:
+            prev = table[-1]
+            half = 2 ** (len(table) - 1)
+            table.append(reduce(prev[:-half], prev[half:]) if len(prev) > half else prev[:0])
+
+        for col, window in enumerate(windows):
+            if window < 1 or window > length:
+                continue
+            k = window.bit_length() - 1
+            span = 2 ** k
+            starts = np.arange(length - window + 1)
+            level = table[k]
+            result[window - 1:, col] = reduce(level[starts], level[starts + window - span])
+        # rolling在窗口内存在NaN时结果为NaN
+        nan_count = StockDataProcessor.rolling_sum_bank(np.isnan(values), windows)
+        result[nan_count > 0] = np.nan
+        return result
+
+    @staticmethod
+    def rolling_sum_bank(values, windows):
+        """
+        用一次累加和计算多个窗口的滚动求和
+        
+        参数:
+        values: 一维数组
+        windows: 窗口长度列表
+        
+        返回:
+        二维数组，形状为(len(values), len(windows))，前window-1行为NaN
+        """
+        values = np.asarray(values, dtype=np.float64)
+        cumsum = np.concatenate([[0.0], np.cumsum(values)])
+        result = np.full((len(values), len(windows)), np.nan)
+        for col, window in enumerate(windows):
+            window = int(window)
+            if 1 <= window <= len(values):
+                result[window - 1:, col] = cumsum[window:] - cumsum[:-window]
+        return result
+
+    @staticmethod
+    def ma_bank(values, windows):
+        """
+        用一次累加和计算多个窗口的移动平均
+        
+        参数:
+        values: 一维数组，通常为收盘价
+        windows: MA周期列表
+        
+        返回:
+        二维数组，形状为(len(values), len(windows))，与rolling(window).mean()一致
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = StockDataProcessor.rolling_sum_bank(np.where(valid, values, 0.0), windows)
+        counts = StockDataProcessor.rolling_sum_bank(valid, windows)
+        windows = np.asarray(windows, dtype=np.float64)
+        return np.where(counts == windows, sums / windows, np.nan)
+
+    @staticmethod
+    def ewm_bank(values, alphas):
+        """
+        用一次批量递推计算多个平滑系数的指数移动平均，与ewm(alpha, adjust=False).mean()一致
+        
+        参数:
+        values: 一维数组（所有系数共用）或二维数组，形状为(bars, len(alphas))
+        alphas: 平滑系数列表，span周期对应 2 / (span + 1)
+        
+        返回:
+        二维数组，形状为(bars, len(alphas))
+        """
+        alphas = np.asarray(alphas, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = np.broadcast_to(values.reshape(-1, 1), (len(values), len(alphas)))
+        result = np.empty(values.shape)
+        if len(values) == 0:
+            return result
+
+        decay = 1 - alphas
+        weighted = values[0].copy()
+        result[0] = weighted
+        missing = np.isnan(values)
+        started = np.maximum.accumulate(~missing, axis=0)
+        if not (missing & started).any():
+            # 首个有效值之后没有缺失值时，递推只需一次乘加
+            for i in range(1, len(values)):
+                cur = values[i]
+                weighted = np.where(np.isnan(weighted), cur, decay * weighted + alphas * cur)
+                result[i] = weighted
+            return result
+
+        old_wt = np.ones(len(alphas))
+        for i in range(1, len(values)):
+            cur = values[i]
+            observed = ~np.isnan(cur)
+            started = ~np.isnan(weighted)
+            # 已有均值时，每根K线（包括缺失值）都衰减旧权重
+            old_wt = np.where(started, old_wt * decay, old_wt)
+            update = started & observed
+            blended = (old_wt * weighted + alphas * cur) / (old_wt + alphas)
+            weighted = np.where(update, blended, weighted)
+            old_wt = np.where(update, 1.0, old_wt)
+            first = ~started & observed
+            weighted = np.where(first, cur, weighted)
+            old_wt = np.where(first, 1.0, old_wt)
+            result[i] = weighted
+        return result
+
+    @staticmethod
+    def kdj_bank(df, params):
+        """
+        一次计算多组参数的KDJ指标
+        
+        参数:
+        df: DataFrame，必须包含'最高'、'最低'、'收盘'列
+        params: (n, m1, m2)参数元组列表
+        
+        返回:
+        字典，键为'KDJ_K'、'KDJ_D'、'KDJ_J'，值为形状(bars, len(params))的二维数组，列顺序与params一致
+        """
+        params = [tuple(p) for p in params]
+        close = df['收盘'].to_numpy(dtype=np.float64)
+        ns = sorted({p[0] for p in params})
+        lows = StockDataProcessor.rolling_extrema_bank(df['最低'].to_numpy(dtype=np.float64), ns, 'min')
+        highs = StockDataProcessor.rolling_extrema_bank(df['最高'].to_numpy(dtype=np.float64), ns, 'max')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsv = (close.reshape(-1, 1) - lows) / (highs - lows) * 100
+
+        n_index = [ns.index(p[0]) for p in params]
+        k = StockDataProcessor.ewm_bank(rsv[:, n_index], [1 / p[1] for p in params])
+        d = StockDataProcessor.ewm_bank(k, [1 / p[2] for p in params])
+        return {'KDJ_K': k, 'KDJ_D': d, 'KDJ_J': 3 * k - 2 * d}
+
+    @staticmethod
+    def macd_bank(df, params):
+        """
+        一次计算多组参数的MACD指标，相同周期的EMA只计算一次
+        
+        参数:
+        df: DataFrame，必须包含'收盘'列
+        params: (fast_period, slow_period, signal_period)参数元组列表
+        
+        返回:
+        字典，键为'MACD_DIF'、'MACD_DEA'、'MACD_HIST'，值为形状(bars, len(params))的二维数组，列顺序与params一致
+        """
+        params = [tuple(p) for p in params]
+        spans = sorted({p[0] for p in params} | {p[1] for p in params})
+        emas = StockDataProcessor.ewm_bank(df['收盘'].to_numpy(dtype=np.float64),
+                                           [2 / (span + 1) for span in spans])
+        fast = emas[:, [spans.index(p[0]) for p in params]]
+        slow = emas[:, [spans.index(p[1]) for p in params]]
+        dif = fast - slow
+        dea = StockDataProcessor.ewm_bank(dif, [2 / (p[2] + 1) for p in params])
+        return {'MACD_DIF': dif, 'MACD_DEA': dea, 'MACD_HIST': 2 * (dif - dea)}
+
+    @staticmethod
+    def directional_movement(df):
+        """
+        计算真实波幅和方向变动，ATR、DI和ADX共用
+        
+        参数:
+        df: DataFrame，必须包含'最高'、'最低'、'收盘'列
+        
+        返回:
+        (tr, plus_dm, minus_dm)三个一维数组，第一根K线没有前收盘价，为NaN
+        """
+        high = df['最高'].to_numpy(dtype=np.float64)
+        low = df['最低'].to_numpy(dtype=np.float64)
+        close = df['收盘'].to_numpy(dtype=np.float64)
+        prev_close = np.r_[np.nan, close[:-1]]
+        tr = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+        up = np.r_[np.nan, high[1:] - high[:-1]]
+        down = np.r_[np.nan, low[:-1] - low[1:]]
+        plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+        minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+        plus_dm[:1] = np.nan
+        minus_dm[:1] = np.nan
+        return tr, plus_dm, minus_dm
+
+    @staticmethod
+    def directional_index(atr, plus_smoothed, minus_smoothed):
+        """
+        由平滑后的真实波幅和方向变动计算DI+、DI-和DX
+        
+        返回:
+        (di_plus, di_minus, dx)，DI+与DI-之和为0（没有方向变动）时DX记为0
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            di_plus = 100 * plus_smoothed / atr
+            di_minus = 100 * minus_smoothed / atr
+            total = di_plus + di_minus
+            dx = np.where(total == 0, 0.0, 100 * np.abs(di_plus - di_minus) / total)
+        return di_plus, di_minus, dx
+
+    @staticmethod
+    def ewm_columns(values, alphas):
+        """
+        按列计算指数移动平均，平滑系数相同的列合并为一次ewm调用，结果与逐列ewm(alpha, adjust=False).mean()完全一致
+        
+        参数:
+        values: 二维数组，形状为(bars, len(alphas))
+        alphas: 每列的平滑系数
+        
+        返回:
+        二维数组，形状与values相同
+        """
+        values = np.asarray(values, dtype=np.float64)
+        result = np.empty(values.shape)
+        alphas = np.asarray(alphas, dtype=np.float64)
+        for alpha in np.unique(alphas):
+            cols = np.flatnonzero(alphas == alpha)
+            result[:, cols] = pd.DataFrame(values[:, cols]).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+        return result
+
+    @staticmethod
+    def calculate_indicators(df, ma_periods=(), kdj=None, macd=None, adx=None):
+        """
+        一次计算多种指标：所有只依赖价格的指数平滑（KDJ的K、MACD的快慢EMA、ATR和方向变动）
+        合并为第一轮，依赖第一轮结果的平滑（KDJ的D、MACD的DEA、ADX）合并为第二轮，
+        真实波幅和方向变动只计算一次，结果写入一个预分配的数组，最后只复制一次DataFrame
+        
+        参数:
+        df: DataFrame，必须包含'最高'、'最低'、'收盘'列
+        ma_periods: MA周期列表
+        kdj: (n, m1, m2)，为None时不计算
+        macd: (fast_period, slow_period, signal_period)，为None时不计算
+        adx: ADX周期，同时计算ATR、DI+、DI-，使用Wilder平滑（alpha=1/adx），为None时不计算
+        
+        返回:
+        DataFrame，包含原始数据及指标，列名与calculate_ma、calculate_kdj、calculate_macd一致
+        """
+        ma_periods = list(ma_periods)
+        columns = [f'MA{period}' for period in ma_periods]
+        if kdj:
+            columns += ['KDJ_K', 'KDJ_D', 'KDJ_J']
+        if macd:
+            columns += ['MACD_DIF', 'MACD_DEA', 'MACD_HIST']
+        if adx:
+            columns += ['ATR', 'DI+', 'DI-', 'ADX']
+        index = {name: i for i, name in enumerate(columns)}
+        block = np.full((len(df), len(columns)), np.nan)
+        close = df['收盘'].to_numpy(dtype=np.float64)
+
+        if ma_periods:
+            block[:, :len(ma_periods)] = StockDataProcessor.ma_bank(close, ma_periods)
+
+        # 第一次递推：只依赖价格的指数平滑
+        inputs, alphas = [], []
+        if kdj:
+            n, m1, m2 = kdj
+            low = StockDataProcessor.rolling_extrema_bank(df['最低'].to_numpy(dtype=np.float64), [n], 'min')[:, 0]
+            high = StockDataProcessor.rolling_extrema_bank(df['最高'].to_numpy(dtype=np.float64), [n], 'max')[:, 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inputs.append((close - low) / (high - low) * 100)
+            alphas.append(1 / m1)
+        if macd:
+            inputs += [close, close]
+            alphas += [2 / (macd[0] + 1), 2 / (macd[1] + 1)]
+        if adx:
+            inputs += list(StockDataProcessor.directional_movement(df))
+            alphas += [1 / adx] * 3
+        if inputs:
+            first = StockDataProcessor.ewm_columns(np.column_stack(inputs), alphas)
+
+        # 第二次递推：KDJ的D、MACD的DEA和ADX
+        inputs, alphas = [], []
+        col = 0
+        if kdj:
+            block[:, index['KDJ_K']] = first[:, col]
+            inputs.append(first[:, col])
+            alphas.append(1 / kdj[2])
+            col += 1
+        if macd:
+            block[:, index['MACD_DIF']] = first[:, col] - first[:, col + 1]
+            inputs.append(block[:, index['MACD_DIF']])
+            alphas.append(2 / (macd[2] + 1))
+            col += 2
+        if adx:
+            block[:, index['ATR']] = first[:, col]
+            di_plus, di_minus, dx = StockDataProcessor.directional_index(
+                first[:, col], first[:, col + 1], first[:, col + 2])
+            block[:, index['DI+']] = di_plus
+            block[:, index['DI-']] = di_minus
+            inputs.append(dx)
+            alphas.append(1 / adx)
+        if inputs:
+            second = StockDataProcessor.ewm_columns(np.column_stack(inputs), alphas)
+            col = 0
+            if kdj:
+                block[:, index['KDJ_D']] = second[:, col]
+                block[:, index['KDJ_J']] = 3 * block[:, index['KDJ_K']] - 2 * second[:, col]
+                col += 1
+            if macd:
+                block[:, index['MACD_DEA']] = second[:, col]
+                block[:, index['MACD_HIST']] = 2 * (block[:, index['MACD_DIF']] - second[:, col])
+                col += 1
+            if adx:
+                block[:, index['ADX']] = second[:, col]
+
+        indicators = pd.DataFrame(block, index=df.index, columns=columns)
+        return pd.concat([df.drop(columns=[c for c in columns if c in df.columns]), indicators], axis=1)
@@ -1,9 +1,7 @@
+import heapq
+import itertools
 import pandas as pd
 import numpy as np
-import sys
-import matplotlib.pyplot as plt
-from strategy_generator import MAStrategy
-from chart import setup_chinese_font, TradeChart, IndicatorDistributionChart
 
 
 def get_performance_summary(trades):
@@ -25,8 +23,9 @@ def get_performance_summary(trades):
         }
     win_trades = len(trades[trades['收益率'] > 0])
     total_trades = len(trades)
-    trades['持仓周数'] = ((pd.to_datetime(trades['卖出日期']) - 
-                            pd.to_datetime(trades['买入日期'])).dt.days / 7).round(1)
+    # 不修改调用方传入的trades
+    hold_weeks = ((pd.to_datetime(trades['卖出日期']) -
+                   pd.to_datetime(trades['买入日期'])).dt.days / 7).round(1)
     compound_return = np.prod(1 + trades['收益率'] / 100) - 1
 
     summary = {
@@ -36,10 +35,246 @@ def get_performance_summary(trades):
         'total_return': compound_return * 100,
         'max_return': trades['收益率'].max(),
         'min_return': trades['收益率'].min(),
-        'avg_hold_weeks': trades['持仓周数'].mean(),
+        'avg_hold_weeks': hold_weeks.mean(),
         'avg_drawdown': trades['回撤率'].mean(),
         'max_drawdown': trades['回撤率'].min()
     }
     return summary
 
 
+SUMMARY_METRICS = ['total_trades', 'win_rate', 'avg_return', 'total_return', 'max_return', 'min_return',
+                   'avg_hold_weeks', 'avg_drawdown', 'max_drawdown']
+
+
+def get_batch_performance_summary(trades, run_column='run_id', run_ids=None):
+    """
+    按运行编号分组，一次计算多次回测的交易表现摘要，指标与get_performance_summary一致
+    :param trades: 多次回测的交易记录拼接而成的DataFrame，包含run_column列
+    :param run_column: 运行编号列名
+    :param run_ids: 全部运行编号，没有交易记录的运行按0填充，默认只包含出现在trades中的运行
+    :return: DataFrame，索引为运行编号，列为SUMMARY_METRICS
+    """
+    runs, codes = np.unique(trades[run_column].to_numpy(), return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    returns = trades['收益率'].to_numpy(dtype=np.float64)[order]
+    drawdowns = trades['回撤率'].to_numpy(dtype=np.float64)[order]
+    # 日期只转换一次
+    hold_days = (pd.to_datetime(trades['卖出日期']).to_numpy() -
+                 pd.to_datetime(trades['买入日期']).to_numpy())[order] / np.timedelta64(1, 'D')
+    hold_weeks = np.round(hold_days / 7, 1)
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+    counts = np.diff(np.r_[starts, len(codes)])
+    if len(codes):
+        wins = np.add.reduceat((returns > 0).astype(np.int64), starts)
+        sum_returns = np.add.reduceat(returns, starts)
+        with np.errstate(divide='ignore'):
+            log_growth = np.add.reduceat(np.log1p(returns / 100), starts)
+        max_returns = np.maximum.reduceat(returns, starts)
+        min_returns = np.minimum.reduceat(returns, starts)
+        sum_hold = np.add.reduceat(hold_weeks, starts)
+        sum_drawdown = np.add.reduceat(drawdowns, starts)
+        min_drawdown = np.minimum.reduceat(drawdowns, starts)
+    else:
+        wins = sum_returns = log_growth = max_returns = min_returns = np.array([])
+        sum_hold = sum_drawdown = min_drawdown = np.array([])
+
+    summary = pd.DataFrame({
+        'total_trades': counts,
+        'win_rate': wins / counts * 100,
+        'avg_return': sum_returns / counts,
+        'total_return': np.expm1(log_growth) * 100,
+        'max_return': max_returns,
+        'min_return': min_returns,
+        'avg_hold_weeks': sum_hold / counts,
+        'avg_drawdown': sum_drawdown / counts,
+        'max_drawdown': min_drawdown,
+    }, index=pd.Index(runs, name=run_column))
+    if run_ids is not None:
+        summary = summary.reindex(pd.Index(run_ids, name=run_column), fill_value=0)
+    return summary
+
+
+class TopNRanker:
+    def __init__(self, n, metric='total_return', largest=True, run_column='run_id'):
+        """
+        以有界内存流式保留指标最好的前N次回测
+        :param n: 保留的数量
+        :param metric: 排序指标，如'total_return'、'win_rate'、'max_drawdown'
+        :param largest: 为True时保留指标最大的，为False时保留最小的
+        :param run_column: 结果索引的名称，update时使用get_batch_performance_summary结果的索引名
+        """
+        self.n = n
+        self.metric = metric
+        self.largest = largest
+        self.run_column = run_column
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, run_id, summary):
+        """
+        加入一次回测的摘要
+        :param run_id: 运行编号
+        :param summary: 摘要字典，包含metric
+        """
+        value = summary[self.metric]
+        if value is None or np.isnan(value):
+            return
+        key = value if self.largest else -value
+        # 堆顶为当前保留结果中最差的一个，指标相同时先加入的优先保留
+        item = (key, -next(self._counter), run_id, dict(summary))
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def update(self, summaries):
+        """
+        批量加入摘要
+        :param summaries: get_batch_performance_summary返回的DataFrame
+        """
+        if summaries.index.name is not None:
+            self.run_column = summaries.index.name
+        values = summaries[self.metric].to_numpy(dtype=np.float64)
+        # 只需要考虑批内前N名
+        if len(values) > self.n:
+            keys = values if self.largest else -values
+            keys = np.where(np.isnan(keys), -np.inf, keys)
+            candidates = np.sort(np.lexsort((np.arange(len(keys)), -keys))[:self.n])
+        else:
+            candidates = range(len(values))
+        records = summaries.to_dict('index') if len(values) <= self.n else None
+        for i in candidates:
+            run_id = summaries.index[i]
+            self.push(run_id, records[run_id] if records else summaries.iloc[i].to_dict())
+        return self
+
+    def result(self):
+        """
+        :return: DataFrame，按指标从好到差排序，索引为运行编号
+        """
+        items = sorted(self._heap, reverse=True)
+        return pd.DataFrame([summary for _, _, _, summary in items],
+                            index=pd.Index([run_id for _, _, run_id, _ in items], name=self.run_column))
+
+
+PERIODS_PER_YEAR = {'D': 252, 'W': 52, 'M': 12}
+
+
+def calculate_positions(signal):
+    """
+    根据信号计算每根K线收盘后的持仓状态，与各策略_generate_trades的规则一致：
+    空仓时遇到1买入，持仓时遇到-1卖出，其余信号忽略
+    :param signal: 信号数组，形状为(bars,)或(bars, runs)，取值为1、-1、0
+    :return: 持仓数组(0或1)，形状与signal相同
+    """
+    signal = np.asarray(signal, dtype=np.int8)
+    # 持仓状态等于最近一个非零信号是否为买入信号
+    bars = np.arange(signal.shape[0]).reshape((-1,) + (1,) * (signal.ndim - 1))
+    last_idx = np.maximum.accumulate(np.where(signal != 0, bars, -1), axis=0)
+    last_signal = np.take_along_axis(signal, np.maximum(last_idx, 0), axis=0)
+    return ((last_idx >= 0) & (last_signal == 1)).astype(np.int8)
+
+
+def calculate_equity_curve(close, signal):
+    """
+    计算逐K线的盯市净值曲线，在信号K线的收盘价成交
+    :param close: 收盘价数组，形状为(bars,)或(bars, runs)
+    :param signal: 信号数组，形状为(bars,)或(bars, runs)
+    :return: (持仓数组, 净值数组)，净值从1开始
+    """
+    close = np.asarray(close, dtype=np.float64)
+    positions = calculate_positions(signal)
+    if close.ndim < positions.ndim:
+        close = np.broadcast_to(close.reshape(close.shape + (1,)), positions.shape)
+    bar_returns = np.zeros(positions.shape)
+    bar_returns[1:] = close[1:] / close[:-1] - 1
+    # 上一根K线收盘后的持仓承担本根K线的涨跌
+    held_returns = np.zeros(positions.shape)
+    held_returns[1:] = positions[:-1] * np.nan_to_num(bar_returns[1:])
+    equity = np.cumprod(1 + held_returns, axis=0)
+    return positions, equity
+
+
+def get_equity_metrics(equity, positions=None, close=None, period='W'):
+    """
+    根据净值曲线计算风险指标，支持一次传入多条净值曲线
+    :param equity: 净值数组，形状为(bars,)或(bars, runs)
+    :param positions: 持仓数组，形状与equity相同，用于计算仓位占比、换手和未平仓浮动盈亏
+    :param close: 收盘价数组，与positions一起用于计算未平仓浮动盈亏
+    :param period: 周期, 'D'表示日线，'W'表示周线，'M'表示月线，用于年化
+    :return: 指标字典，equity为一维时值为标量，为二维时值为长度为runs的数组
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    squeeze = equity.ndim == 1
+    if squeeze:
+        equity = equity.reshape(-1, 1)
+    if equity.shape[0] == 0:
+        # 没有K线时按空仓、净值为1计算，各项指标为0
+        equity = np.ones((1, equity.shape[1]))
+        positions = None if positions is None else np.zeros_like(equity)
+        close = None if close is None else np.ones_like(equity)
+    bars = equity.shape[0]
+    periods_per_year = PERIODS_PER_YEAR.get(period, 52)
+
+    returns = np.zeros_like(equity)
+    returns[1:] = equity[1:] / equity[:-1] - 1
+    mean_return = returns[1:].mean(axis=0) if bars > 1 else np.zeros(equity.shape[1])
+    std_return = returns[1:].std(axis=0, ddof=1) if bars > 2 else np.zeros(equity.shape[1])
+    downside = np.sqrt((np.minimum(returns[1:], 0) ** 2).mean(axis=0)) if bars > 1 \
+        else np.zeros(equity.shape[1])
+    annual_factor = np.sqrt(periods_per_year)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std_return > 0, mean_return / std_return * annual_factor, 0.0)
+        sortino = np.where(downside > 0, mean_return / downside * annual_factor, 0.0)
+
+    drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+    total_return = equity[-1] - 1
+    years = max(bars - 1, 1) / periods_per_year
+    annual_return = np.power(np.maximum(equity[-1], 0), 1 / years) - 1
+
+    metrics = {
+        'total_return': total_return * 100,
+        'annual_return': annual_return * 100,
+        'max_drawdown': drawdown.min(axis=0) * 100,
+        'volatility': std_return * annual_factor * 100,
+        'sharpe': sharpe,
+        'sortino': sortino,
+    }
+
+    if positions is not None:
+        positions = np.asarray(positions, dtype=np.float64).reshape(equity.shape)
+        changes = np.abs(np.diff(positions, axis=0, prepend=0))
+        metrics['exposure'] = positions.mean(axis=0) * 100
+        metrics['turnover'] = changes.sum(axis=0)
+        metrics['annual_turnover'] = changes.sum(axis=0) / years
+        metrics['open_position'] = positions[-1].astype(bool)
+        if close is not None:
+            close = np.asarray(close, dtype=np.float64)
+            close = np.broadcast_to(close.reshape(bars, -1), equity.shape)
+            # 未平仓持仓的买入K线为最后一次由空仓转为持仓的位置
+            entries = np.diff(positions, axis=0, prepend=0) > 0
+            bar_idx = np.arange(bars).reshape(-1, 1)
+            entry_idx = np.where(entries, bar_idx, 0).max(axis=0)
+            entry_price = close[entry_idx, np.arange(equity.shape[1])]
+            metrics['open_return'] = np.where(metrics['open_position'],
+                                              (close[-1] / entry_price - 1) * 100, 0.0)
+
+    if squeeze:
+        metrics = {key: value[0].item() for key, value in metrics.items()}
+    return metrics
+
+
+def get_signal_performance(signals, period='W'):
+    """
+    根据策略生成的信号计算盯市净值和风险指标，不修改传入的signals
+    :param signals: 信号, DataFrame，包含'收盘'和'SIGNAL'列
+    :param period: 周期, 'D'表示日线，'W'表示周线，'M'表示月线
+    :return: (净值Series, 指标字典)
+    """
+    close = signals['收盘'].to_numpy(dtype=np.float64)
+    signal = signals['SIGNAL'].to_numpy()
+    positions, equity = calculate_equity_curve(close, signal)
+    metrics = get_equity_metrics(equity, positions, close, period)
+    return pd.Series(equity, index=signals.index, name='净值'), metrics
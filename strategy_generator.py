@@ -1,6 +1,47 @@
 from abc import ABC, abstractmethod
+import math
 import pandas as pd
 import numpy as np
+from resampler import Resampler
+from stock_processor import StockDataProcessor
+
+
+def ewm_warmup_bars(alpha, tolerance=1e-4):
+    """
+    指数移动平均的初始值权重衰减到tolerance以下所需的K线数
+    :param alpha: 平滑系数
+    :param tolerance: 允许的初始值残留权重
+    :return: K线数
+    """
+    if alpha >= 1:
+        return 1
+    return int(math.ceil(math.log(tolerance) / math.log(1 - alpha)))
+
+
+def ewm_continue(values, state, key, **ewm_params):
+    """
+    接续上一块的状态计算adjust=False的指数移动平均，结果与对整段数据计算完全一致
+    :param values: 本块的Series
+    :param state: 状态字典，key对应(最后一个有效输入处的均值, 其后连续NaN的个数)
+    :param key: 状态键
+    :param ewm_params: 传给Series.ewm的参数，如alpha或span
+    :return: 本块的均值Series
+    """
+    last, gap = state.get(key, (None, 0))
+    if last is None:
+        result = values.ewm(adjust=False, **ewm_params).mean()
+    else:
+        # 以上一块的均值作为首个观测值，再补上其后的NaN，使权重衰减与整段计算相同
+        prefix = pd.Series([last] + [np.nan] * gap)
+        result = pd.concat([prefix, values], ignore_index=True).ewm(adjust=False, **ewm_params).mean()
+        result = pd.Series(result.to_numpy()[1 + gap:], index=values.index)
+    observed = np.flatnonzero(values.notna().to_numpy())
+    if len(observed) > 0:
+        state[key] = (result.iloc[observed[-1]], len(values) - 1 - observed[-1])
+    elif last is not None:
+        state[key] = (last, gap + len(values))
+    return result
+
 
 class StrategyBase(ABC):
     def apply_strategy(self, stock_data, start_date=None, end_date=None):
@@ -9,6 +50,93 @@ class StrategyBase(ABC):
         trades = self._generate_trades(signals)
         return processed_df, signals, trades
 
+    def iter_trades_chunked(self, source, start_date=None, end_date=None, chunksize=100_000):
+        """
+        分块执行策略，指标、持仓和最高价的状态跨块延续，内存占用只与块大小有关
+        :param source: 日线CSV文件路径，或按日期排序的DataFrame块的可迭代对象
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :param chunksize: source为文件路径时每块读取的行数
+        :return: 生成器，每块产生该块中完成的交易记录DataFrame
+        """
+        chunks = pd.read_csv(source, chunksize=chunksize) if isinstance(source, str) else source
+        indicator_state = {}
+        trade_state = {}
+        previous = None
+        for bars in self._iter_period_bars(chunks, start_date, end_date):
+            if len(bars) == 0:
+                continue
+            processed = self._process_block(bars, indicator_state)
+            # 判断交叉需要前一根K线，带上上一块的最后一行生成信号后再去掉
+            if previous is None:
+                signals = self._generate_signals(processed)
+            else:
+                signals = self._generate_signals(pd.concat([previous, processed], ignore_index=True)).iloc[1:]
+            previous = processed.iloc[-1:]
+            yield self._generate_trades(signals, trade_state)
+
+    def apply_strategy_chunked(self, source, start_date=None, end_date=None, chunksize=100_000):
+        """
+        分块执行策略，结果与apply_strategy的交易记录一致
+        :param source: 日线CSV文件路径，或按日期排序的DataFrame块的可迭代对象
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :param chunksize: source为文件路径时每块读取的行数
+        :return: DataFrame，交易记录
+        """
+        trades = [block for block in self.iter_trades_chunked(source, start_date, end_date, chunksize)
+                  if len(block) > 0]
+        return pd.concat(trades, ignore_index=True) if trades else pd.DataFrame()
+
+    def _iter_period_bars(self, chunks, start_date=None, end_date=None):
+        """将日线块过滤日期并聚合为策略周期，未完成的周期K线留到下一块"""
+        resampler = None if self.period == 'D' else Resampler([self.period])
+        for chunk in chunks:
+            chunk = chunk.copy()
+            chunk['日期'] = pd.to_datetime(chunk['日期'])
+            chunk = StockDataProcessor.filter_by_date(chunk, start_date, end_date).reset_index(drop=True)
+            yield chunk if resampler is None else resampler.update(chunk)[self.period]
+        if resampler is not None:
+            yield resampler.flush()[self.period]
+
+    @staticmethod
+    def _with_context(bars, state, n_rows):
+        """
+        在本块前拼接上一块最后n_rows根K线，供滚动窗口使用
+        :return: (拼接后的DataFrame, 拼接的行数)
+        """
+        context = state.get('context')
+        combined = bars if context is None else pd.concat([context, bars], ignore_index=True)
+        state['context'] = combined.iloc[max(0, len(combined) - n_rows):] if n_rows > 0 else combined.iloc[:0]
+        return combined, 0 if context is None else len(context)
+
+    @abstractmethod
+    def _process_block(self, bars, state):
+        """
+        分块模式下计算一块K线的指标
+        :param bars: 本块策略周期的K线
+        :param state: 跨块保存的指标状态，由策略自行读写
+        :return: DataFrame，与_process_data结果中对应行一致
+        """
+        pass
+
+    @abstractmethod
+    def lookback_bars(self, tolerance=1e-4):
+        """
+        计算最新信号所需的回看K线数（按策略周期计，包含指标预热）
+        :param tolerance: 指数移动平均允许的初始值残留权重
+        :return: K线数
+        """
+        pass
+
+    def signal_strength(self, signals):
+        """
+        计算信号强度，用于对扫描结果排序，默认为第一个指标列的绝对值
+        :param signals: DataFrame，_generate_signals的结果
+        :return: Series，信号强度
+        """
+        return signals[self.new_indicator_columns[0]].abs()
+
     @abstractmethod
     def _process_data(self, stock_data, start_date=None, end_date=None):
         """
@@ -28,10 +156,11 @@ class StrategyBase(ABC):
         pass
 
     @abstractmethod
-    def _generate_trades(self, signals):
+    def _generate_trades(self, signals, state=None):
         """
         根据信号生成交易记录
         :param signals: DataFrame，包含交易信号
+        :param state: 分块模式下跨块保存的持仓状态字典，函数开始时读取，结束时写回
         :return: DataFrame，包含交易记录
         """
         pass
@@ -54,6 +183,27 @@ class MAStrategy(StrategyBase):
         self.new_feature_columns = [f'MA{ma_period}']
         self.new_indicator_columns = ['收盘/MA']
 
+    @classmethod
+    def from_percentiles(cls, buy_percentile, sell_percentile, period, ma_period, sketches,
+                         stock_code='*', years=None, end_year=None):
+        """
+        以历史分布的百分位数作为买卖阈值创建MA策略
+        :param buy_percentile: 买入百分位数，如10表示收盘/MA低于历史第10百分位时买入
+        :param sell_percentile: 卖出百分位数，如90
+        :param period: 周期
+        :param ma_period: MA周期
+        :param sketches: QuantileSketchStore
+        :param stock_code: 使用哪只股票的分布，默认为全市场
+        :param years: 只使用最近几年的分布，默认为全部年份
+        :param end_year: 截止年份，回测时应不晚于回测开始的年份以免使用未来数据
+        :return: MAStrategy
+        """
+        ratio1, ratio2 = sketches.quantile([buy_percentile / 100, sell_percentile / 100], stock_code,
+                                           period, f'收盘/MA{ma_period}', years, end_year)
+        if np.isnan(ratio1) or np.isnan(ratio2):
+            raise ValueError(f"没有股票 {stock_code} 的{period}周期收盘/MA{ma_period}分布数据")
+        return cls(float(ratio1), float(ratio2), period, ma_period)
+
     def _process_data(self, stock_data, start_date=None, end_date=None):
         processed_stock = (stock_data
             .filter_by_date(start_date, end_date)
@@ -64,6 +214,20 @@ class MAStrategy(StrategyBase):
         df['收盘/MA'] = df['收盘'] / df[f'MA{self.ma_period}']
         return df
 
+    def _process_block(self, bars, state):
+        combined, skip = self._with_context(bars, state, self.ma_period - 1)
+        df = StockDataProcessor.calculate_ma(combined, [self.ma_period]).iloc[skip:].reset_index(drop=True)
+        df['收盘/MA'] = df['收盘'] / df[f'MA{self.ma_period}']
+        return df
+
+    def lookback_bars(self, tolerance=1e-4):
+        return self.ma_period
+
+    def signal_strength(self, signals):
+        # 买入信号越低于ratio1越强，卖出信号越高于ratio2越强
+        ratio = signals['收盘/MA']
+        return np.where(signals['SIGNAL'] == 1, self.ratio1 - ratio, ratio - self.ratio2)
+
     def _generate_signals(self, df):
         signals = pd.DataFrame(index=df.index)
         signals['日期'] = df['日期']
@@ -78,13 +242,15 @@ class MAStrategy(StrategyBase):
         signals.loc[valid_data & (signals['收盘/MA'] > self.ratio2), 'SIGNAL'] = -1
         return signals
 
-    def _generate_trades(self, signals):
+    def _generate_trades(self, signals, state=None):
         """生成交易记录"""
         trades = []
-        position = 0
-        entry_price = 0
-        entry_date = None
-        max_price = 0
+        state = state if state is not None else {}
+        position = state.get('position', 0)
+        entry_price = state.get('entry_price', 0)
+        entry_date = state.get('entry_date')
+        entry_ratio = state.get('entry_ratio')
+        max_price = state.get('max_price', 0)
 
         for idx, row in signals.iterrows():
             if pd.isna(row[f'MA{self.ma_period}']):
@@ -116,6 +282,8 @@ class MAStrategy(StrategyBase):
                         '回撤率': drawdown_pct
                     })
 
+        state.update(position=position, entry_price=entry_price, entry_date=entry_date,
+                     entry_ratio=entry_ratio, max_price=max_price)
         return pd.DataFrame(trades)
 
 
@@ -146,6 +314,22 @@ class KDJStrategy(StrategyBase):
         df['K-D'] = df['KDJ_K'] - df['KDJ_D']
         return df
 
+    def _process_block(self, bars, state):
+        combined, skip = self._with_context(bars, state, self.n - 1)
+        low_list = combined['最低'].rolling(window=self.n).min()
+        high_list = combined['最高'].rolling(window=self.n).max()
+        rsv = ((combined['收盘'] - low_list) / (high_list - low_list) * 100).iloc[skip:].reset_index(drop=True)
+        df = bars.reset_index(drop=True)
+        df['KDJ_K'] = ewm_continue(rsv, state, 'k', alpha=1/self.m1)
+        df['KDJ_D'] = ewm_continue(df['KDJ_K'], state, 'd', alpha=1/self.m2)
+        df['KDJ_J'] = 3 * df['KDJ_K'] - 2 * df['KDJ_D']
+        df['K-D'] = df['KDJ_K'] - df['KDJ_D']
+        return df
+
+    def lookback_bars(self, tolerance=1e-4):
+        # RSV窗口 + K、D两次平滑的预热 + 判断交叉所需的前一根K线
+        return self.n + ewm_warmup_bars(1 / self.m1, tolerance) + ewm_warmup_bars(1 / self.m2, tolerance) + 1
+
     def _generate_signals(self, df):
         """生成交易信号"""
         signals = pd.DataFrame(index=df.index)
@@ -170,13 +354,16 @@ class KDJStrategy(StrategyBase):
         
         return signals
 
-    def _generate_trades(self, signals):
+    def _generate_trades(self, signals, state=None):
         """生成交易记录"""
         trades = []
-        position = 0
-        entry_price = 0
-        entry_date = None
-        max_price = 0
+        state = state if state is not None else {}
+        position = state.get('position', 0)
+        entry_price = state.get('entry_price', 0)
+        entry_date = state.get('entry_date')
+        entry_k = state.get('entry_k')
+        entry_d = state.get('entry_d')
+        max_price = state.get('max_price', 0)
         
         for idx, row in signals.iterrows():
             if pd.isna(row['KDJ_K']) or pd.isna(row['KDJ_D']):
@@ -211,6 +398,8 @@ class KDJStrategy(StrategyBase):
                         '回撤率': drawdown_pct
                     })
                     
+        state.update(position=position, entry_price=entry_price, entry_date=entry_date,
+                     entry_k=entry_k, entry_d=entry_d, max_price=max_price)
         return pd.DataFrame(trades)
 
 
@@ -240,6 +429,20 @@ class MACDStrategy(StrategyBase):
             
         return processed_stock.df.copy()
 
+    def _process_block(self, bars, state):
+        df = bars.reset_index(drop=True)
+        fast_ema = ewm_continue(df['收盘'], state, 'fast', span=self.fast_period)
+        slow_ema = ewm_continue(df['收盘'], state, 'slow', span=self.slow_period)
+        df['MACD_DIF'] = fast_ema - slow_ema
+        df['MACD_DEA'] = ewm_continue(df['MACD_DIF'], state, 'dea', span=self.signal_period)
+        df['MACD_HIST'] = 2 * (df['MACD_DIF'] - df['MACD_DEA'])
+        return df
+
+    def lookback_bars(self, tolerance=1e-4):
+        # 慢速EMA与信号线EMA的预热 + 判断交叉所需的前一根K线
+        slow_warmup = ewm_warmup_bars(2 / (max(self.fast_period, self.slow_period) + 1), tolerance)
+        return slow_warmup + ewm_warmup_bars(2 / (self.signal_period + 1), tolerance) + 1
+
     def _generate_signals(self, df):
         """生成交易信号"""
         signals = pd.DataFrame(index=df.index)
@@ -263,13 +466,17 @@ class MACDStrategy(StrategyBase):
         
         return signals
 
-    def _generate_trades(self, signals):
+    def _generate_trades(self, signals, state=None):
         """生成交易记录"""
         trades = []
-        position = 0
-        entry_price = 0
-        entry_date = None
-        max_price = 0
+        state = state if state is not None else {}
+        position = state.get('position', 0)
+        entry_price = state.get('entry_price', 0)
+        entry_date = state.get('entry_date')
+        entry_dif = state.get('entry_dif')
+        entry_dea = state.get('entry_dea')
+        entry_hist = state.get('entry_hist')
+        max_price = state.get('max_price', 0)
         
         for idx, row in signals.iterrows():
             if pd.isna(row['MACD_DIF']) or pd.isna(row['MACD_DEA']):
@@ -307,4 +514,127 @@ class MACDStrategy(StrategyBase):
                         '回撤率': drawdown_pct
                     })
                     
-        return pd.DataFrame(trades)
\ No newline at end of file
+        state.update(position=position, entry_price=entry_price, entry_date=entry_date,
+                     entry_dif=entry_dif, entry_dea=entry_dea, entry_hist=entry_hist, max_price=max_price)
+        return pd.DataFrame(trades)
+
+
+class ADXStrategy(StrategyBase):
+    def __init__(self, n=14, adx_threshold=20, period='D'):
+        """
+        初始化ADX策略：DI+上穿DI-且ADX不低于阈值（趋势足够强）时买入，DI-上穿DI+时卖出
+        :param n: DI和ADX的周期
+        :param adx_threshold: 买入时ADX的最低值
+        :param period: 周期, 'D'表示日线，'W'表示周线，'M'表示月线
+        """
+        self.n = n
+        self.adx_threshold = adx_threshold
+        self.period = period
+        self.new_feature_columns = ['DI+', 'DI-', 'ADX', 'ATR']
+        self.new_indicator_columns = ['DI+-DI-', 'ADX']
+
+    def _process_data(self, stock_data, start_date=None, end_date=None):
+        """处理数据，计算ATR、DI和ADX指标"""
+        processed_stock = (stock_data
+            .filter_by_date(start_date, end_date)
+            .aggregate_by_period(self.period)
+            .calculate_indicators(adx=self.n))
+
+        df = processed_stock.df.copy()
+        df['DI+-DI-'] = df['DI+'] - df['DI-']
+        return df
+
+    def _process_block(self, bars, state):
+        combined, skip = self._with_context(bars, state, 1)
+        tr, plus_dm, minus_dm = (pd.Series(values[skip:])
+                                 for values in StockDataProcessor.directional_movement(combined))
+        atr = ewm_continue(tr, state, 'tr', alpha=1 / self.n).to_numpy()
+        di_plus, di_minus, dx = StockDataProcessor.directional_index(
+            atr,
+            ewm_continue(plus_dm, state, 'plus_dm', alpha=1 / self.n).to_numpy(),
+            ewm_continue(minus_dm, state, 'minus_dm', alpha=1 / self.n).to_numpy())
+        df = bars.reset_index(drop=True)
+        df['ATR'] = atr
+        df['DI+'] = di_plus
+        df['DI-'] = di_minus
+        df['ADX'] = ewm_continue(pd.Series(dx), state, 'adx', alpha=1 / self.n).to_numpy()
+        df['DI+-DI-'] = df['DI+'] - df['DI-']
+        return df
+
+    def lookback_bars(self, tolerance=1e-4):
+        # 前收盘价 + DI平滑与ADX平滑的预热 + 判断交叉所需的前一根K线
+        return 1 + 2 * ewm_warmup_bars(1 / self.n, tolerance) + 1
+
+    def _generate_signals(self, df):
+        """生成交易信号"""
+        signals = pd.DataFrame(index=df.index)
+        signals['日期'] = df['日期']
+        signals['收盘'] = df['收盘']
+        signals['DI+'] = df['DI+']
+        signals['DI-'] = df['DI-']
+        signals['ADX'] = df['ADX']
+        signals['DI+-DI-'] = df['DI+-DI-']
+
+        signals['SIGNAL'] = 0
+        valid_data = signals['DI+'].notna() & signals['DI-'].notna() & signals['ADX'].notna()
+
+        # DI+从下向上穿过DI-且趋势足够强时买入
+        golden_cross = (df['DI+'] > df['DI-']) & (df['DI+'].shift(1) <= df['DI-'].shift(1))
+        strong_trend = df['ADX'] >= self.adx_threshold
+        # DI-从下向上穿过DI+时卖出
+        death_cross = (df['DI+'] < df['DI-']) & (df['DI+'].shift(1) >= df['DI-'].shift(1))
+
+        signals.loc[valid_data & golden_cross & strong_trend, 'SIGNAL'] = 1
+        signals.loc[valid_data & death_cross, 'SIGNAL'] = -1
+
+        return signals
+
+    def _generate_trades(self, signals, state=None):
+        """生成交易记录"""
+        trades = []
+        state = state if state is not None else {}
+        position = state.get('position', 0)
+        entry_price = state.get('entry_price', 0)
+        entry_date = state.get('entry_date')
+        entry_di = state.get('entry_di')
+        entry_adx = state.get('entry_adx')
+        max_price = state.get('max_price', 0)
+
+        for idx, row in signals.iterrows():
+            if pd.isna(row['DI+']) or pd.isna(row['DI-']) or pd.isna(row['ADX']):
+                continue
+
+            if position == 0 and row['SIGNAL'] == 1:  # 买入
+                position = 1
+                entry_price = row['收盘']
+                entry_date = row['日期']
+                entry_di = row['DI+-DI-']
+                entry_adx = row['ADX']
+                max_price = entry_price
+
+            elif position == 1:  # 持仓期间更新最高价
+                max_price = max(max_price, row['收盘'])
+                if row['SIGNAL'] == -1:  # 卖出
+                    position = 0
+                    exit_price = row['收盘']
+                    profit_pct = (exit_price / entry_price - 1) * 100
+                    max_profit_pct = (max_price / entry_price - 1) * 100
+                    drawdown_pct = (exit_price / max_price - 1) * 100
+
+                    trades.append({
+                        '买入日期': entry_date,
+                        '买入价格': entry_price,
+                        '买入时DI+-DI-指标': entry_di,
+                        '买入时ADX指标': entry_adx,
+                        '卖出日期': row['日期'],
+                        '卖出价格': exit_price,
+                        '卖出时DI+-DI-指标': row['DI+-DI-'],
+                        '卖出时ADX指标': row['ADX'],
+                        '收益率': profit_pct,
+                        '最大收益率': max_profit_pct,
+                        '回撤率': drawdown_pct
+                    })
+
+        state.update(position=position, entry_price=entry_price, entry_date=entry_date,
+                     entry_di=entry_di, entry_adx=entry_adx, max_price=max_price)
+        return pd.DataFrame(trades)
@@ -0,0 +1,519 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+import numpy as np
+import pandas as pd
+from stock_data import StockData
+from strategy_analyzer import get_performance_summary
+
+# 任务状态
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def make_tasks(stock_codes, strategy: str, param_grid: dict, start_date=None, end_date=None) -> list:
+    """
+    将参数网格展开为回测任务
+    :param stock_codes: 股票代码列表
+    :param strategy: 策略名称，见backtest_server.STRATEGIES
+    :param param_grid: {参数名: 取值列表}，取值的全部组合都会回测
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :return: 任务字典列表，task_id从0开始
+    """
+    names = list(param_grid)
+    combos = list(itertools.product(*(param_grid[name] for name in names)))
+    tasks = []
+    for stock_code in stock_codes:
+        for values in combos:
+            tasks.append({
+                'task_id': len(tasks),
+                'stock_code': stock_code,
+                'strategy': strategy,
+                'params': {name: _to_plain(value) for name, value in zip(names, values)},
+                'start_date': start_date,
+                'end_date': end_date,
+            })
+    return tasks
+
+
+def _to_plain(value):
+    """numpy标量转换为可JSON序列化的Python值"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _send(stream, message: dict):
+    stream.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+def _receive(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class SweepCoordinator:
+    """
+    参数扫描的协调端：持有全部任务，工作端通过TCP连接拉取任务并返回结果。
+    协议为每行一个JSON消息：工作端先发送hello说明本地有哪些股票的数据，
+    之后每次发送next（附带上一批的结果）并收到一批任务、wait或done。
+    同一批任务属于同一只股票，优先分配工作端内存中已加载的股票，其次是本地磁盘上有数据、
+    且能处理的工作端最少的股票，使数据只在少数节点上加载。
+    连接断开或租约超时的任务重新排队，超过max_attempts次后记为失败；
+    工作端读取数据失败（文件缺失或损坏）时，该股票不再分配给这个工作端，任务交给其他有数据的工作端重试；
+    策略本身抛出的异常不重试，直接记为失败。
+    已连接的工作端都没有某只股票的数据超过unservable_seconds秒时，该股票剩余的任务记为失败。
+    """
+
+    def __init__(self, tasks, host: str = '127.0.0.1', port: int = 0, lease_seconds: float = 600,
+                 max_attempts: int = 3, batch_size: int = 8, unservable_seconds: float = 60):
+        """
+        :param tasks: make_tasks生成的任务列表
+        :param host: 监听地址，跨机器使用时为'0.0.0.0'
+        :param port: 端口，为0时自动选择
+        :param lease_seconds: 一批任务的租约时长，超时未返回的任务重新分配
+        :param max_attempts: 每个任务最多分配的次数
+        :param batch_size: 每次分配的最多任务数
+        :param unservable_seconds: 有工作端连接、但都没有某只股票的数据时，等待有数据的工作端加入的秒数，
+                                   None表示一直等待
+        """
+        self.tasks = OrderedDict((task['task_id'], task) for task in tasks)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.unservable_seconds = unservable_seconds
+        self._unserved_since = {}
+        self._pending = {}
+        for task_id, task in self.tasks.items():
+            self._pending.setdefault(task['stock_code'], deque()).append(task_id)
+        self._state = {task_id: PENDING for task_id in self.tasks}
+        self._attempts = {task_id: 0 for task_id in self.tasks}
+        self._leases = {}
+        self._results = {}
+        self._errors = {}
+        # 任务最近一次重新排队的原因，最终失败时附在错误信息中
+        self._retry_reasons = {}
+        self._workers = {}
+        self._remaining = len(self.tasks)
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator._serve_worker(self.rfile, self.wfile, self.client_address)
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server((host, port), Handler)
+        self.address = self.server.server_address
+        self._thread = None
+
+    def start(self):
+        """在后台线程中开始接受工作端连接"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _check_hello(hello):
+        """检查hello消息，返回错误信息，合法时返回None"""
+        if not isinstance(hello, dict) or hello.get('type') != 'hello':
+            return "第一条消息必须是hello"
+        worker_id = hello.get('worker_id')
+        if not isinstance(worker_id, str) or not worker_id:
+            return "hello消息缺少worker_id"
+        stocks = hello.get('stocks', [])
+        if not isinstance(stocks, list) or not all(isinstance(code, str) for code in stocks):
+            return "hello消息的stocks必须是股票代码列表"
+        return None
+
+    def _serve_worker(self, rfile, wfile, client_address):
+        worker_id = None
+        try:
+            hello = _receive(rfile)
+            if hello is None:
+                return
+            error = self._check_hello(hello)
+            with self._lock:
+                if error is None and hello['worker_id'] in self._workers:
+                    error = f"工作端 {hello['worker_id']} 已经连接"
+                if error is None:
+                    worker_id = hello['worker_id']
+                    self._workers[worker_id] = {
+                        'address': client_address,
+                        'stocks': set(hello.get('stocks', [])),
+                        'loaded': set(),
+                        'completed': 0,
+                    }
+            if error is not None:
+                _send(wfile, {'type': 'error', 'error': error})
+                return
+            while True:
+                message = _receive(rfile)
+                if message is None:
+                    return
+                if not isinstance(message, dict) or message.get('type') != 'next':
+                    _send(wfile, {'type': 'error', 'error': "消息必须是next"})
+                    return
+                reply = self._handle_next(worker_id, message)
+                _send(wfile, reply)
+                if reply['type'] == 'done':
+                    return
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # 连接断开或消息格式不正确，该工作端的任务重新排队
+            pass
+        finally:
+            if worker_id is not None:
+                self._worker_lost(worker_id)
+
+    def _handle_next(self, worker_id: str, message: dict) -> dict:
+        with self._lock:
+            worker = self._workers[worker_id]
+            worker['loaded'] = set(message.get('loaded', []))
+            for result in message.get('results', []):
+                self._complete(worker_id, result)
+            self._expire_leases()
+            self._fail_unservable()
+            if self._remaining == 0:
+                return {'type': 'done'}
+            batch = self._assign(worker_id)
+            if not batch:
+                # 剩余任务正在其他工作端上运行或本工作端没有对应的数据，稍后再问
+                return {'type': 'wait', 'seconds': 0.2}
+            return {'type': 'tasks', 'tasks': [self.tasks[task_id] for task_id in batch]}
+
+    def _complete(self, worker_id: str, result: dict):
+        task_id = result['task_id']
+        # 租约超时后重新分配的任务可能返回两次，只接受第一次
+        if self._state.get(task_id) in (DONE, FAILED, None):
+            return
+        if 'data_error' in result:
+            # 工作端本地的数据不可用，换一个有数据的工作端重试
+            stock_code = self.tasks[task_id]['stock_code']
+            self._workers[worker_id]['stocks'].discard(stock_code)
+            self._workers[worker_id]['loaded'].discard(stock_code)
+            self._requeue(task_id, f"工作端 {worker_id} 读取数据失败：{result['data_error']}")
+            return
+        self._leases.pop(task_id, None)
+        if 'error' in result:
+            self._state[task_id] = FAILED
+            self._errors[task_id] = result['error']
+        else:
+            self._state[task_id] = DONE
+            self._results[task_id] = (worker_id, result['summary'])
+            self._workers[worker_id]['completed'] += 1
+        self._remaining -= 1
+        if self._remaining == 0:
+            self._finished.notify_all()
+
+    def _requeue(self, task_id: int, reason: str):
+        self._leases.pop(task_id, None)
+        self._retry_reasons[task_id] = reason
+        if self._attempts[task_id] >= self.max_attempts:
+            self._state[task_id] = FAILED
+            self._errors[task_id] = f"{reason}，已尝试{self._attempts[task_id]}次"
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._finished.notify_all()
+            return
+        self._state[task_id] = PENDING
+        self._pending.setdefault(self.tasks[task_id]['stock_code'], deque()).appendleft(task_id)
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        for task_id, (_, deadline) in list(self._leases.items()):
+            if deadline < now:
+                self._requeue(task_id, "租约超时")
+
+    def _fail_unservable(self):
+        """已连接的工作端都没有数据的股票超过unservable_seconds秒后，剩余任务记为失败"""
+        if self.unservable_seconds is None:
+            return
+        now = time.monotonic()
+        held = set().union(*(worker['stocks'] for worker in self._workers.values())) if self._workers else set()
+        for stock_code, queue in self._pending.items():
+            if not queue or not self._workers or stock_code in held:
+                # 还没有工作端连接时等待集群启动，不开始计时
+                self._unserved_since.pop(stock_code, None)
+                continue
+            since = self._unserved_since.setdefault(stock_code, now)
+            if now - since < self.unservable_seconds:
+                continue
+            while queue:
+                task_id = queue.popleft()
+                if self._state[task_id] != PENDING:
+                    continue
+                self._state[task_id] = FAILED
+                self._errors[task_id] = f"没有工作端有股票 {stock_code} 的数据"
+                if task_id in self._retry_reasons:
+                    self._errors[task_id] += f"，{self._retry_reasons[task_id]}"
+                self._remaining -= 1
+            self._unserved_since.pop(stock_code, None)
+        if self._remaining == 0:
+            self._finished.notify_all()
+
+    def _worker_lost(self, worker_id: str):
+        with self._lock:
+            for task_id, (owner, _) in list(self._leases.items()):
+                if owner == worker_id:
+                    self._requeue(task_id, "工作端断开")
+            self._workers.pop(worker_id, None)
+
+    def _assign(self, worker_id: str) -> list:
+        worker = self._workers[worker_id]
+        candidates = [code for code, queue in self._pending.items() if queue and code in worker['stocks']]
+        if not candidates:
+            return []
+
+        def locality(code):
+            holders = sum(1 for other in self._workers.values() if code in other['stocks'])
+            return code not in worker['loaded'], holders, -len(self._pending[code])
+
+        stock_code = min(candidates, key=locality)
+        queue = self._pending[stock_code]
+        batch = []
+        while queue and len(batch) < self.batch_size:
+            task_id = queue.popleft()
+            # 重新排队后原工作端又返回了结果的任务已经完成，不再分配
+            if self._state[task_id] == PENDING:
+                batch.append(task_id)
+        deadline = time.monotonic() + self.lease_seconds
+        for task_id in batch:
+            self._state[task_id] = RUNNING
+            self._attempts[task_id] += 1
+            self._leases[task_id] = (worker_id, deadline)
+        return batch
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        等待全部任务完成或失败
+        :param timeout: 最长等待秒数，None表示一直等待
+        :return: 是否全部结束
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._remaining > 0:
+                # 定期检查租约，没有工作端来拉取任务时超时的任务也能及时失败或重新排队
+                self._expire_leases()
+                self._fail_unservable()
+                left = 1.0 if end is None else min(1.0, end - time.monotonic())
+                if left <= 0:
+                    return False
+                self._finished.wait(left)
+            return True
+
+    def progress(self) -> dict:
+        """各状态的任务数和各工作端完成的任务数"""
+        with self._lock:
+            counts = {state: 0 for state in (PENDING, RUNNING, DONE, FAILED)}
+            for state in self._state.values():
+                counts[state] += 1
+            counts['workers'] = {worker_id: worker['completed'] for worker_id, worker in self._workers.items()}
+            return counts
+
+    def results(self) -> pd.DataFrame:
+        """
+        汇总结果，每个任务一行：股票代码、策略、参数、表现摘要，以及执行的工作端、尝试次数和错误信息
+        """
+        rows = []
+        with self._lock:
+            for task_id, task in self.tasks.items():
+                row = {'task_id': task_id, 'stock_code': task['stock_code'], 'strategy': task['strategy']}
+                row.update(task['params'])
+                row['status'] = self._state[task_id]
+                row['attempts'] = self._attempts[task_id]
+                if task_id in self._results:
+                    worker_id, summary = self._results[task_id]
+                    row['worker_id'] = worker_id
+                    row.update(summary)
+                if task_id in self._errors:
+                    row['error'] = self._errors[task_id]
+                rows.append(row)
+        return pd.DataFrame(rows).set_index('task_id') if rows else pd.DataFrame()
+
+
+class SweepWorker:
+    """
+    参数扫描的工作端：连接协调端，拉取任务并用本地数据运行apply_strategy，
+    按最近使用保留cache_size只股票的紧凑数据，同一只股票的后续任务不再读取磁盘。
+    """
+
+    def __init__(self, host: str, port: int, data_dir: str = "resource/stock_price", stock_codes=None,
+                 worker_id: str = None, cache_size: int = 64):
+        """
+        :param host: 协调端地址
+        :param port: 协调端端口
+        :param data_dir: 本地股价数据目录
+        :param stock_codes: 本工作端处理的股票代码，默认为data_dir中的全部股票
+        :param worker_id: 工作端标识，默认为主机名加进程号
+        :param cache_size: 内存中保留的股票数量
+        """
+        self.host = host
+        self.port = port
+        self.data_dir = data_dir
+        if stock_codes is None:
+            stock_codes = [f[:-len('.csv')] for f in sorted(os.listdir(data_dir)) if f.endswith('.csv')]
+        self.stock_codes = list(stock_codes)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.cache_size = cache_size
+        self._stocks = OrderedDict()
+
+    def _stock_data(self, stock_code: str) -> StockData:
+        base = self._stocks.get(stock_code)
+        if base is None:
+            base = StockData(stock_code, '', self.data_dir, compact=True, offline=True)
+            self._stocks[stock_code] = base
+            while len(self._stocks) > self.cache_size:
+                self._stocks.popitem(last=False)
+        self._stocks.move_to_end(stock_code)
+        # apply_strategy会修改传入的StockData，每次使用共享同一份紧凑数据的新对象
+        return StockData.from_columns(base.stock_code, base.name, base.to_columns())
+
+    def run_task(self, task: dict) -> dict:
+        """
+        执行一个任务，返回结果或错误信息。读取数据失败时返回data_error，协调端会换一个工作端重试，
+        并且不再把该股票分配给本工作端
+        """
+        from backtest_server import STRATEGIES
+        try:
+            stock_data = self._stock_data(task['stock_code'])
+        except (OSError, ValueError, KeyError) as e:
+            if task['stock_code'] in self.stock_codes:
+                self.stock_codes.remove(task['stock_code'])
+            return {'task_id': task['task_id'], 'data_error': f"{type(e).__name__}: {e}"}
+        try:
+            strategy = STRATEGIES[task['strategy']](**task['params'])
+            _, _, trades = strategy.apply_strategy(stock_data, task.get('start_date'), task.get('end_date'))
+            summary = {key: _to_plain(value) for key, value in get_performance_summary(trades).items()}
+            return {'task_id': task['task_id'], 'summary': summary}
+        except Exception as e:
+            return {'task_id': task['task_id'], 'error': f"{type(e).__name__}: {e}"}
+
+    def run(self) -> int:
+        """
+        连接协调端并处理任务，直到协调端返回done或连接断开
+        :return: 完成的任务数
+        """
+        completed = 0
+        with socket.create_connection((self.host, self.port)) as conn:
+            rfile, wfile = conn.makefile('rb'), conn.makefile('wb')
+            _send(wfile, {'type': 'hello', 'worker_id': self.worker_id, 'stocks': self.stock_codes})
+            results = []
+            while True:
+                _send(wfile, {'type': 'next', 'results': results, 'loaded': list(self._stocks)})
+                results = []
+                reply = _receive(rfile)
+                if reply is None or reply['type'] == 'done':
+                    break
+                if reply['type'] == 'error':
+                    raise ConnectionError(f"协调端拒绝了工作端 {self.worker_id}：{reply['error']}")
+                if reply['type'] == 'wait':
+                    time.sleep(reply['seconds'])
+                    continue
+                for task in reply['tasks']:
+                    results.append(self.run_task(task))
+                completed += len(results)
+        return completed
+
+
+def _worker_process(host, port, data_dir, stock_codes, worker_id):
+    SweepWorker(host, port, data_dir, stock_codes, worker_id).run()
+
+
+def run_local_sweep(tasks, workers: int = 4, data_dir: str = "resource/stock_price", stock_codes_by_worker=None,
+                    timeout: float = None, **coordinator_options) -> pd.DataFrame:
+    """
+    在本机启动协调端和多个工作端进程执行扫描，与跨机器运行使用相同的协议
+    :param tasks: make_tasks生成的任务列表
+    :param workers: 工作端进程数
+    :param data_dir: 股价数据目录
+    :param stock_codes_by_worker: 每个工作端可处理的股票代码列表，用于模拟数据只在部分节点上的情况
+    :param timeout: 最长等待秒数
+    :param coordinator_options: 传给SweepCoordinator的其他参数，本机的工作端几秒内就全部连接，
+                                unservable_seconds默认为10
+    :return: SweepCoordinator.results()
+    """
+    coordinator_options.setdefault('unservable_seconds', 10)
+    context = multiprocessing.get_context('spawn')
+    with SweepCoordinator(tasks, **coordinator_options) as coordinator:
+        host, port = coordinator.address
+        processes = []
+        for i in range(workers):
+            stock_codes = stock_codes_by_worker[i] if stock_codes_by_worker else None
+            process = context.Process(target=_worker_process,
+                                      args=(host, port, data_dir, stock_codes, f"local-{i}"), daemon=True)
+            process.start()
+            processes.append(process)
+        end = None if timeout is None else time.monotonic() + timeout
+        # 工作端进程全部退出（如数据目录不存在）时不再等待
+        while not coordinator.wait(1.0) and any(process.is_alive() for process in processes):
+            if end is not None and time.monotonic() > end:
+                break
+        for process in processes:
+            process.join(timeout=5)
+        return coordinator.results()
+
+
+# 使用示例:
+# 协调端：python sweep_cluster.py coordinator --host 0.0.0.0 --port 9000 --strategy ma \
+#         --grid '{"ratio1": [0.97, 0.98, 0.99], "ratio2": [1.02, 1.03], "period": ["W"], "ma_period": [10, 20]}'
+# 工作端：python sweep_cluster.py worker --host 协调端地址 --port 9000
+# 本机测试：python sweep_cluster.py local --workers 4
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='分布式参数扫描')
+    parser.add_argument('mode', choices=['coordinator', 'worker', 'local'], help='运行模式')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='协调端地址，默认：127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000, help='协调端端口，默认：9000')
+    parser.add_argument('--data-dir', type=str, default='resource/stock_price', help='股价数据目录')
+    parser.add_argument('--strategy', type=str, default='ma', help='策略，默认：ma')
+    parser.add_argument('--grid', type=str,
+                        default='{"ratio1": [0.97, 0.98, 0.99], "ratio2": [1.02, 1.03, 1.05], '
+                                '"period": ["W"], "ma_period": [5, 10, 20]}',
+                        help='参数网格JSON')
+    parser.add_argument('--stock-codes', type=str, nargs='+', help='股票代码，默认为数据目录中的全部股票')
+    parser.add_argument('--workers', type=int, default=4, help='local模式的工作端进程数')
+    parser.add_argument('--output', type=str, help='结果CSV文件')
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        count = SweepWorker(args.host, args.port, args.data_dir, args.stock_codes).run()
+        print(f"完成{count}个任务")
+    else:
+        stock_codes = args.stock_codes or [f[:-len('.csv')] for f in sorted(os.listdir(args.data_dir))
+                                           if f.endswith('.csv')]
+        tasks = make_tasks(stock_codes, args.strategy, json.loads(args.grid))
+        if args.mode == 'local':
+            results = run_local_sweep(tasks, args.workers, args.data_dir)
+        else:
+            with SweepCoordinator(tasks, args.host, args.port) as coordinator:
+                print(f"协调端已启动：{args.host}:{coordinator.address[1]}，共{len(tasks)}个任务")
+                coordinator.wait()
+                results = coordinator.results()
+        print(results.sort_values('total_return', ascending=False).head(10))
+        if args.output:
+            results.to_csv(args.output)
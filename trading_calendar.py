@@ -0,0 +1,169 @@
+import os
+import threading
+from datetime import datetime, time as dtime
+import numpy as np
+import pandas as pd
+
+# A股收盘时间，收盘后当天才算作已完成的交易日
+MARKET_CLOSE = dtime(15, 0)
+
+# 本进程中从新浪更新交易日历失败的日期，同一天不再重复尝试
+_failed_update_day = None
+
+# 日历文件中每个交易日的来源：交易所日历（新浪），或由股价数据的日期推断
+EXCHANGE_SOURCE = 'sina'
+PRICE_SOURCE = 'prices'
+
+
+def _to_day(date) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+class TradingCalendar:
+    def __init__(self, path: str = "resource/trading_calendar.csv", data_dir: str = "resource/stock_price"):
+        """
+        初始化本地A股交易日历
+        日历文件不存在时由data_dir中已有股价数据的日期并集生成并保存；
+        超出日历覆盖范围的日期按周一至周五视为交易日。
+        每个交易日记录来源，由股价数据推断的日期不能用来检查股价数据本身缺失的交易日
+        :param path: 交易日历文件，包含'trade_date'列和可选的'source'列
+        :param data_dir: 股价数据目录，用于生成日历
+        """
+        self.path = path
+        self.data_dir = data_dir
+        self.exchange_days = np.empty(0, dtype='datetime64[D]')
+        if os.path.exists(path):
+            df = pd.read_csv(path)
+            days = pd.to_datetime(df['trade_date']).to_numpy().astype('datetime64[D]')
+            # 旧版日历文件没有来源列，视为由股价数据推断
+            if 'source' in df.columns:
+                self.exchange_days = np.unique(days[(df['source'] == EXCHANGE_SOURCE).to_numpy()])
+        else:
+            days = pd.to_datetime(self._collect_price_dates(data_dir)).to_numpy().astype('datetime64[D]')
+        self.days = np.unique(days)
+        if not os.path.exists(path) and len(self.days) > 0:
+            self.save()
+
+    @staticmethod
+    def _collect_price_dates(data_dir):
+        if not os.path.isdir(data_dir):
+            return pd.Series([], dtype=object)
+        dates = [pd.read_csv(os.path.join(data_dir, f), usecols=['日期'])['日期']
+                 for f in os.listdir(data_dir) if f.endswith('.csv')]
+        return pd.concat(dates) if dates else pd.Series([], dtype=object)
+
+    @property
+    def has_exchange_days(self) -> bool:
+        """是否有来自交易所日历的交易日"""
+        return len(self.exchange_days) > 0
+
+    @property
+    def last_covered_day(self):
+        return self.days[-1] if len(self.days) > 0 else None
+
+    def save(self):
+        """保存交易日历"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 多个下载进程可能同时保存，临时文件名各不相同
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        sources = np.where(np.isin(self.days, self.exchange_days), EXCHANGE_SOURCE, PRICE_SOURCE)
+        pd.DataFrame({'trade_date': self.days.astype(str), 'source': sources}).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def extend(self, dates):
+        """
+        将新的交易日加入日历，例如新下载的K线日期
+        :param dates: 日期序列
+        :return: 是否有新增的交易日
+        """
+        new_days = np.unique(pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]'))
+        merged = np.union1d(self.days, new_days)
+        if len(merged) == len(self.days):
+            return False
+        self.days = merged
+        self.save()
+        return True
+
+    def update_from_akshare(self):
+        """从新浪交易日历更新本地日历，包含当年剩余的交易日"""
+        import akshare as ak
+
+        df = ak.tool_trade_date_hist_sina()
+        exchange_days = np.unique(pd.to_datetime(df['trade_date']).to_numpy().astype('datetime64[D]'))
+        self.exchange_days = np.union1d(self.exchange_days, exchange_days)
+        self.days = np.union1d(self.days, exchange_days)
+        self.save()
+        return self
+
+    def covers(self, date) -> bool:
+        """日历是否覆盖到给定日期，覆盖范围之外只能按周一至周五推断"""
+        return self.last_covered_day is not None and _to_day(date) <= self.last_covered_day
+
+    def ensure_covers(self, date=None) -> bool:
+        """
+        日历没有覆盖到给定日期时从新浪交易日历更新。由股价数据生成的日历只到最后一根K线，
+        之后的节假日会被当作交易日，使全部数据都被判断为需要更新
+        :param date: 日期，默认为今天
+        :return: 更新后日历是否覆盖该日期，更新失败时返回False
+        """
+        global _failed_update_day
+        day = _to_day(date or datetime.now())
+        if self.covers(day):
+            return True
+        if _failed_update_day == day:
+            return False
+        try:
+            self.update_from_akshare()
+        except Exception as e:
+            _failed_update_day = day
+            print(f"更新交易日历失败，{self.last_covered_day}之后按周一至周五视为交易日：{e}")
+        return self.covers(day)
+
+    def is_trading_day(self, date) -> bool:
+        day = _to_day(date)
+        if self.last_covered_day is not None and day <= self.last_covered_day:
+            index = np.searchsorted(self.days, day)
+            return index < len(self.days) and self.days[index] == day
+        return bool(np.is_busday(day))
+
+    def previous_trading_day(self, date, inclusive: bool = True) -> pd.Timestamp:
+        """
+        获取不晚于（或早于）给定日期的最近交易日
+        :param date: 日期
+        :param inclusive: 是否包含给定日期本身
+        :return: 交易日
+        """
+        day = _to_day(date)
+        if not inclusive:
+            day = day - np.timedelta64(1, 'D')
+        if self.last_covered_day is not None and day <= self.last_covered_day:
+            index = np.searchsorted(self.days, day, side='right') - 1
+            if index >= 0:
+                return pd.Timestamp(self.days[index])
+        return pd.Timestamp(np.busday_offset(day, 0, roll='backward'))
+
+    def latest_completed_trading_day(self, now: datetime = None) -> pd.Timestamp:
+        """
+        获取最近一个已收盘的交易日
+        :param now: 当前时间，默认为系统时间
+        :return: 交易日
+        """
+        now = now or datetime.now()
+        return self.previous_trading_day(now.date(), inclusive=now.time() >= MARKET_CLOSE)
+
+    def trading_days(self, start_date, end_date) -> pd.DatetimeIndex:
+        """
+        获取日期范围内的交易日
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :return: DatetimeIndex
+        """
+        start, end = _to_day(start_date), _to_day(end_date)
+        days = self.days[(self.days >= start) & (self.days <= end)]
+        if self.last_covered_day is None or end > self.last_covered_day:
+            first = start if self.last_covered_day is None else max(start, self.last_covered_day + np.timedelta64(1, 'D'))
+            extra = np.arange(first, end + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+            days = np.concatenate([days, extra[np.is_busday(extra)]])
+        return pd.DatetimeIndex(days)